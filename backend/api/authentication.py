@@ -0,0 +1,101 @@
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from foodgram.cache import get_region
+
+TOKEN_CACHE_KEY = 'token_user:{digest}'
+USER_TOKEN_CACHE_KEY = 'user:{user_id}'
+# Поля пользователя, которые хранятся в кэше: без хэша пароля
+# и денормализованных счётчиков.
+CACHED_USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name',
+                      'is_active', 'is_staff', 'is_superuser', 'last_login',
+                      'date_joined')
+
+
+def token_digest(key):
+    '''
+    Токен хэшируется до обращения к кэшу: ключ кэша не содержит
+    самого токена, а время поиска не зависит от совпадения его префикса.
+    '''
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def invalidate_token(key):
+    get_region('auth_tokens').delete(
+        TOKEN_CACHE_KEY.format(digest=token_digest(key))
+    )
+
+
+def invalidate_user(user_id):
+    '''
+    Сбрасывает закэшированный токен пользователя. Чтение идёт мимо
+    счётчиков региона, чтобы сброс не выглядел промахом.
+    '''
+    cache = get_region('auth_tokens').cache
+    key = USER_TOKEN_CACHE_KEY.format(user_id=user_id)
+    digest = cache.get(key)
+    if digest is not None:
+        cache.delete_many((TOKEN_CACHE_KEY.format(digest=digest), key))
+
+
+def dump_user(user):
+    return {name: getattr(user, name) for name in CACHED_USER_FIELDS}
+
+
+def load_user(data):
+    '''
+    Пользователь из кэша: остальные поля, включая пароль, отложены
+    и дочитываются из БД при обращении, а полный save() записывает
+    только загруженные поля и не затирает пароль и счётчики.
+    '''
+    User = get_user_model()
+    names = [field.attname for field in User._meta.concrete_fields
+             if field.attname in data]
+    return User.from_db(
+        router.db_for_read(User), names, [data[name] for name in names]
+    )
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    Аутентификация по токену через регион кэша auth_tokens вместо
+    запроса к authtoken_token на каждый запрос. Запись сбрасывается
+    при выходе (удалении токена) и при сохранении пользователя:
+    смене пароля, деактивации, правке профиля. В кэше лежат только
+    поля CACHED_USER_FIELDS, без хэша пароля. В request.auth
+    попадает строка токена, а не объект Token.
+    '''
+
+    def authenticate(self, request):
+        self.request = request
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        cache = get_region('auth_tokens')
+        digest = token_digest(key)
+        data = cache.get(TOKEN_CACHE_KEY.format(digest=digest))
+        if data is not None:
+            self.record_saved_query()
+            return load_user(data), key
+        try:
+            token = Token.objects.select_related('user').get(key=key)
+        except Token.DoesNotExist:
+            raise AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        cache.set_many({
+            TOKEN_CACHE_KEY.format(digest=digest): dump_user(token.user),
+            USER_TOKEN_CACHE_KEY.format(user_id=token.user_id): digest,
+        })
+        return token.user, key
+
+    def record_saved_query(self):
+        metrics = getattr(self.request._request, 'query_metrics', None)
+        if metrics is not None:
+            metrics.saved_queries += 1
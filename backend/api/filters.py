@@ -1,6 +1,16 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, F, When
 from django_filters.rest_framework import FilterSet, filters
 
+from recipes.constans import USER_FLAGS_FILTER_MAX_IDS
+from recipes.flags import get_user_flags
 from recipes.models import Ingredient, Recipe, Tag, User
+from recipes.search import SEARCH_CONFIG, SEARCH_WEIGHTS, recipe_search_index
+
+# Значение ordering -> поле рейтинга, по убыванию которого сортировать.
+RECIPE_RANKINGS = {'popular': 'score', 'trending': 'trending_score'}
+TAG_RANKINGS = {'usage': 'recipes_count', 'trending': 'trending_score'}
 
 
 class RecipeFilter(FilterSet):
@@ -15,21 +25,66 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'Популярные'), ('trending', 'Популярные сейчас')),
+        method='filter_ordering'
+    )
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search')
+
+    def filter_by_flags(self, queryset, attr, relation):
+        '''
+        Отбор по флагам пользователя: небольшое множество id подставляется
+        в запрос как есть, а для большого дешевле соединение таблиц.
+        '''
+        user = self.request.user
+        recipe_ids = getattr(get_user_flags(user.id), attr)
+        if len(recipe_ids) <= USER_FLAGS_FILTER_MAX_IDS:
+            return queryset.filter(pk__in=list(recipe_ids))
+        return queryset.filter(**{f'{relation}__author': user})
 
     def filter_is_favorited(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(favorites__author=self.request.user)
+            return self.filter_by_flags(queryset, 'favorites', 'favorites')
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(cart__author=self.request.user)
+            return self.filter_by_flags(queryset, 'cart', 'cart')
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        '''Полнотекстовый поиск по названию, ингредиентам и описанию.'''
+        if connection.vendor == 'postgresql':
+            query = SearchQuery(value, config=SEARCH_CONFIG,
+                                search_type='websearch')
+            weights = [SEARCH_WEIGHTS[weight] for weight in 'DCBA']
+            return queryset.filter(search_vector=query).annotate(
+                rank=SearchRank(F('search_vector'), query, weights=weights)
+            ).order_by('-rank', '-pub_date')
+        # Индекс отдаёт не больше RECIPE_SEARCH_LIMIT лучших рецептов,
+        # поэтому условие и сортировка по ним ограничены по размеру.
+        recipe_ids = recipe_search_index.search(value)
+        if not recipe_ids:
+            return queryset.none()
+        return queryset.filter(pk__in=recipe_ids).order_by(Case(*(
+            When(pk=recipe_id, then=position)
+            for position, recipe_id in enumerate(recipe_ids)
+        )))
+
+    def filter_ordering(self, queryset, name, value):
+        '''
+        Сортировка по материализованным рейтингам (update_rankings):
+        внутреннее соединение читает индекс рейтинга по порядку.
+        '''
+        return queryset.filter(ranking__isnull=False).order_by(
+            f'-ranking__{RECIPE_RANKINGS[value]}', '-ranking__recipe_id'
+        )
+
 
 class IngredientFilter(FilterSet):
     name = filters.CharFilter(lookup_expr='startswith')
@@ -37,3 +92,20 @@ class IngredientFilter(FilterSet):
     class Meta:
         model = Ingredient
         fields = ('name',)
+
+
+class TagFilter(FilterSet):
+    ordering = filters.ChoiceFilter(
+        choices=(('usage', 'По числу рецептов'),
+                 ('trending', 'Популярные сейчас')),
+        method='filter_ordering'
+    )
+
+    class Meta:
+        model = Tag
+        fields = ()
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.filter(usage__isnull=False).order_by(
+            f'-usage__{TAG_RANKINGS[value]}', '-usage__tag_id'
+        )
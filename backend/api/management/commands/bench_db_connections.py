@@ -0,0 +1,60 @@
+from time import perf_counter
+
+from django.core.management import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from benchmarks.runner import percentiles
+from recipes.models import User
+
+
+class Command(BaseCommand):
+    '''
+    Сколько времени на запрос экономят постоянные соединения с БД:
+    один и тот же путь запрашивается с закрытием соединений после
+    каждого запроса (как при DB_CONN_MAX_AGE=0) и без него.
+    Запросы идут от первого пользователя, чтобы не попадать в кэш
+    ответов для анонимов; нужны данные, например из seed_benchmark_data.
+    '''
+    help = 'Measures per-request latency saved by persistent DB connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/recipes/?limit=6')
+        parser.add_argument('--requests', type=int, default=200)
+
+    def run(self, client, path, count, persistent):
+        timings = []
+        for _ in range(count):
+            if not persistent:
+                connections.close_all()
+            started = perf_counter()
+            response = client.get(path)
+            timings.append(perf_counter() - started)
+        assert response.status_code == 200, response.content
+        return timings
+
+    def handle(self, *args, **options):
+        client = APIClient()
+        user = User.objects.order_by('id').first()
+        if user is not None:
+            client.force_authenticate(user)
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            # Прогрев: импорты, кэши и первое соединение.
+            self.run(client, options['path'], 10, True)
+            for name, persistent in (('per-request', False),
+                                     ('persistent', True)):
+                timings = self.run(
+                    client, options['path'], options['requests'], persistent
+                )
+                results[name] = sum(timings) / len(timings)
+                p50, p95, p99 = percentiles(timings)
+                self.stdout.write(
+                    f'{name:<12} mean {results[name] * 1000:7.2f} ms  '
+                    f'p50 {p50:7.2f}  p95 {p95:7.2f}  p99 {p99:7.2f}'
+                )
+        saved = results['per-request'] - results['persistent']
+        self.stdout.write(self.style.SUCCESS(
+            f'Persistent connections save {saved * 1000:.2f} ms per request'
+        ))
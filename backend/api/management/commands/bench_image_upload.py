@@ -0,0 +1,116 @@
+import base64
+import json
+import os
+import resource
+import tracemalloc
+from io import BytesIO
+from time import perf_counter
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from PIL import Image
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.views import RecipeViewSet
+from recipes.models import Ingredient, Tag, User
+
+
+class Rollback(Exception):
+    pass
+
+
+def noise_png(size):
+    '''PNG из шума: почти не сжимается, размер файла близок к size.'''
+    side = max(int((size / 3) ** 0.5), 1)
+    image = Image.frombytes('RGB', (side, side), os.urandom(side * side * 3))
+    buffer = BytesIO()
+    image.save(buffer, 'PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def current_rss():
+    '''Текущий RSS процесса в байтах (Linux).'''
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+class Command(BaseCommand):
+    '''
+    Замер памяти при создании рецепта с изображением разного размера:
+    JSON со строкой base64 и multipart с файлом. Запрос собирается
+    заранее, поэтому учитывается только обработка на сервере.
+    Данные создаются во временной транзакции и откатываются.
+    '''
+    help = 'Measures peak memory of recipe uploads with large images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=float, nargs='+',
+                            default=(0.5, 1, 2, 4.5),
+                            help='Image sizes in MiB')
+
+    def seed(self):
+        user = User.objects.create_user(
+            username='bench_uploader', email='bench_uploader@example.com',
+            password='bench'
+        )
+        tag, _ = Tag.objects.get_or_create(
+            slug='bench', defaults={'name': 'bench', 'color': '#BE4C4B'}
+        )
+        ingredient, _ = Ingredient.objects.get_or_create(
+            name='bench', measurement_unit='г'
+        )
+        return user, {
+            'name': 'Рецепт', 'text': '-', 'cooking_time': 1,
+            'tags': [tag.id],
+            'ingredients': [{'id': ingredient.id, 'amount': 1}],
+        }
+
+    def build_request(self, mode, content, payload):
+        factory = APIRequestFactory()
+        if mode == 'json':
+            image = ('data:image/png;base64,'
+                     + base64.b64encode(content).decode())
+            return factory.post('/api/recipes/', dict(payload, image=image),
+                                format='json')
+        upload = BytesIO(content)
+        upload.name = 'bench.png'
+        return factory.post('/api/recipes/', {
+            **payload,
+            'ingredients': json.dumps(payload['ingredients']),
+            'image': upload,
+        }, format='multipart')
+
+    def measure(self, view, request):
+        rss = current_rss()
+        tracemalloc.start()
+        started = perf_counter()
+        response = view(request)
+        elapsed = perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        request.close()
+        assert response.status_code == 201, response.data
+        return peak, current_rss() - rss, elapsed
+
+    def handle(self, *args, **options):
+        view = RecipeViewSet.as_view({'post': 'create'})
+        try:
+            with transaction.atomic(), override_settings(
+                    ALLOWED_HOSTS=['testserver']):
+                user, payload = self.seed()
+                for size in options['sizes']:
+                    content = noise_png(int(size * 1024 * 1024))
+                    for mode in ('json', 'multipart'):
+                        request = self.build_request(mode, content, payload)
+                        force_authenticate(request, user)
+                        peak, rss, elapsed = self.measure(view, request)
+                        self.stdout.write(
+                            f'{len(content) / 2 ** 20:5.1f} MiB {mode:<9} '
+                            f'peak {peak / 2 ** 20:6.1f} MiB '
+                            f'rss +{rss / 2 ** 20:6.1f} MiB '
+                            f'{elapsed * 1000:8.1f} ms'
+                        )
+                raise Rollback
+        except Rollback:
+            pass
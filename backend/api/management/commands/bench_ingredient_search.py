@@ -0,0 +1,48 @@
+from time import perf_counter
+
+from django.core.management import BaseCommand
+
+from api.serializers import IngredientSerializer
+from recipes.models import Ingredient
+from recipes.search import ingredient_index
+
+
+class Command(BaseCommand):
+    '''Сравнение автодополнения ингредиентов: ORM и индекс в памяти.'''
+    help = 'Benchmarks ingredient autocomplete: ORM filter vs prefix index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*',
+                            help='Prefixes to search for')
+        parser.add_argument('--repeat', type=int, default=100)
+
+    def measure(self, search, queries, repeat):
+        started = perf_counter()
+        for _ in range(repeat):
+            for query in queries:
+                IngredientSerializer(search(query), many=True).data
+        return (perf_counter() - started) / (repeat * len(queries))
+
+    def handle(self, *args, **options):
+        queries = options['queries'] or sorted({
+            name[:length]
+            for name in Ingredient.objects.values_list(
+                'name', flat=True)[:50]
+            for length in (1, 2, 4)
+        })
+        if not queries:
+            self.stderr.write('No ingredients loaded.')
+            return
+        repeat = options['repeat']
+        ingredient_index.search(queries[0])
+        orm = self.measure(
+            lambda query: Ingredient.objects.filter(name__startswith=query),
+            queries, repeat
+        )
+        index = self.measure(ingredient_index.search, queries, repeat)
+        self.stdout.write(
+            f'{len(queries)} queries x {repeat} runs\n'
+            f'ORM startswith: {orm * 1000:.3f} ms/query\n'
+            f'Prefix index:   {index * 1000:.3f} ms/query\n'
+            f'Speedup:        {orm / index:.1f}x'
+        )
@@ -0,0 +1,80 @@
+from time import perf_counter
+
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from recipes.models import Follow, Recipe, User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    '''
+    Замер /api/users/subscriptions/ для пользователя с большим числом
+    подписок. Данные создаются во временной транзакции и откатываются.
+    '''
+    help = 'Benchmarks the subscriptions endpoint for a user with N follows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=500)
+        parser.add_argument('--recipes', type=int, default=10,
+                            help='Recipes per author')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def seed(self, authors_count, recipes_count):
+        reader = User.objects.create_user(
+            username='bench_reader', email='bench_reader@example.com',
+            password='bench'
+        )
+        User.objects.bulk_create(
+            User(username=f'bench_author_{number}',
+                 email=f'bench_author_{number}@example.com',
+                 password='!', recipes_count=recipes_count)
+            for number in range(authors_count)
+        )
+        authors = User.objects.filter(username__startswith='bench_author_')
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {number}', text='-',
+                   cooking_time=1, image='recipes/images/bench.png')
+            for author in authors
+            for number in range(recipes_count)
+        )
+        Follow.objects.bulk_create(
+            Follow(user=reader, following=author) for author in authors
+        )
+        return reader
+
+    def measure(self, client, url, repeat):
+        started = perf_counter()
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+        assert response.status_code == 200, response.content
+        return (perf_counter() - started) / repeat, len(queries)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(), override_settings(
+                    ALLOWED_HOSTS=['testserver']):
+                reader = self.seed(options['authors'], options['recipes'])
+                client = APIClient()
+                client.force_authenticate(reader)
+                for limit in (6, 50, options['authors']):
+                    for recipes_limit in ('', 3):
+                        url = (f'/api/users/subscriptions/?limit={limit}'
+                               f'&recipes_limit={recipes_limit}')
+                        elapsed, queries = self.measure(
+                            client, url, options['repeat']
+                        )
+                        self.stdout.write(
+                            f'limit={limit:<5} recipes_limit='
+                            f'{recipes_limit or "-":<3} '
+                            f'{queries} queries {elapsed * 1000:8.1f} ms'
+                        )
+                raise Rollback
+        except Rollback:
+            pass
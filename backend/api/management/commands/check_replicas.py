@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from foodgram.db_router import replica_aliases, replica_lag
+
+
+class Command(BaseCommand):
+    '''
+    Доступность и отставание реплик из DB_REPLICAS. Завершается
+    ошибкой, если хотя бы одна реплика недоступна или отстаёт
+    больше DB_REPLICA_MAX_LAG, поэтому подходит для проверки здоровья.
+    '''
+    help = 'Reports availability and lag of read replicas'
+
+    def handle(self, *args, **options):
+        aliases = replica_aliases()
+        if not aliases:
+            self.stdout.write('No replicas configured (DB_REPLICAS)')
+            return
+        failed = 0
+        for alias in aliases:
+            lag = replica_lag(alias)
+            if lag is None:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'{alias}: unavailable'))
+            elif lag > settings.DB_REPLICA_MAX_LAG:
+                failed += 1
+                self.stdout.write(self.style.WARNING(
+                    f'{alias}: lag {lag:.1f} s'))
+            else:
+                self.stdout.write(f'{alias}: lag {lag:.1f} s')
+        if failed:
+            raise CommandError(
+                f'{failed} of {len(aliases)} replicas unhealthy')
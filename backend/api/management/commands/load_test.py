@@ -0,0 +1,109 @@
+import http.client
+import socket
+import threading
+from itertools import cycle, islice
+from time import monotonic, perf_counter, sleep
+from urllib.parse import quote, urlsplit
+
+from django.core.management import BaseCommand
+
+from benchmarks.runner import percentiles
+
+DEFAULT_PATHS = (
+    '/api/recipes/',
+    '/api/recipes/?limit=20',
+    '/api/ingredients/?name=са',
+    '/api/tags/',
+)
+
+
+class Command(BaseCommand):
+    '''
+    Нагрузочный тест запущенного сервера: клиенты с keep-alive в течение
+    заданного времени запрашивают пути по кругу. Медленные клиенты
+    (--slow-clients) всё это время передают заголовки по байту.
+    Запуск против SERVER_MODE=wsgi и SERVER_MODE=asgi даёт сравнение.
+    '''
+    help = 'Load-tests a running server and reports RPS and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8888')
+        parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Seconds')
+        parser.add_argument('--token', help='Auth token for the requests')
+        parser.add_argument('--slow-clients', type=int, default=0,
+                            help='Connections that trickle request headers')
+
+    def slow_client(self, address, path, deadline):
+        '''Держит соединение, отправляя заголовок раз в полсекунды.'''
+        try:
+            with socket.create_connection(address, timeout=30) as sock:
+                sock.sendall(f'GET {path} HTTP/1.1\r\n'.encode())
+                while monotonic() < deadline:
+                    sock.sendall(b'X-Slow: 1\r\n')
+                    sleep(0.5)
+        except OSError:
+            pass
+
+    def client(self, address, paths, headers, deadline, results):
+        connection = http.client.HTTPConnection(*address, timeout=30)
+        for path in paths:
+            if monotonic() >= deadline:
+                break
+            started = perf_counter()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                connection.close()
+                connection = http.client.HTTPConnection(*address, timeout=30)
+            results.append((path, perf_counter() - started, ok))
+        connection.close()
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        address = (url.hostname, url.port or 80)
+        headers = {'Host': url.netloc}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        paths = [quote(url.path.rstrip('/') + path, safe='/?=&')
+                 for path in options['paths']]
+        results = []
+        deadline = monotonic() + options['duration']
+        clients = [
+            threading.Thread(target=self.client, args=(
+                address,
+                islice(cycle(paths), number % len(paths), None),
+                headers, deadline, results
+            ))
+            for number in range(options['concurrency'])
+        ]
+        slow_clients = [
+            threading.Thread(target=self.slow_client,
+                             args=(address, paths[0], deadline))
+            for _ in range(options['slow_clients'])
+        ]
+        for client in slow_clients:
+            client.start()
+        sleep(0.5 if slow_clients else 0)
+        started = perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients + slow_clients:
+            client.join()
+        elapsed = perf_counter() - started
+        for path in paths + [None]:
+            rows = [row for row in results if path in (None, row[0])]
+            latencies = [latency for _, latency, ok in rows if ok]
+            p50, p95, p99 = percentiles(latencies)
+            self.stdout.write(
+                f'{path or "total":<40} {len(rows):>7} req '
+                f'{len(rows) - len(latencies):>5} err '
+                f'{len(rows) / elapsed:8.1f} rps  p50 {p50:7.1f} '
+                f'p95 {p95:7.1f} p99 {p99:7.1f} ms'
+            )
@@ -0,0 +1,107 @@
+import hashlib
+import json
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+
+from foodgram.cache import get_region
+from foodgram.db_router import primary_reads
+from recipes.versions import get_versions
+
+RESPONSE_CACHE_KEY = 'response:{fingerprint}'
+
+
+class VersionedCacheMixin:
+    '''
+    HTTP-кэширование list/retrieve для анонимных пользователей.
+    ETag строится из версий моделей cache_models, поэтому условный
+    запрос получает 304 без обращения к БД, а готовые байты ответа
+    хранятся в регионе кэша cache_region до смены версии.
+    '''
+    cache_models = ()
+    cache_region = 'default'
+    cache_max_age = 0
+
+    def get_cache_models(self):
+        return self.cache_models
+
+    def is_cacheable(self, request):
+        return (request.method in ('GET', 'HEAD')
+                and not request.user.is_authenticated)
+
+    def get_cache_state(self, request):
+        '''ETag и ключ кэша для текущего запроса.'''
+        fingerprint = hashlib.sha256(json.dumps((
+            request.get_full_path(),
+            request.accepted_media_type,
+            get_versions(*self.get_cache_models()),
+        )).encode()).hexdigest()
+        return (f'"{fingerprint[:32]}"',
+                RESPONSE_CACHE_KEY.format(fingerprint=fingerprint))
+
+    def set_cache_headers(self, response, etag):
+        response['ETag'] = etag
+        response['Cache-Control'] = (
+            f'public, max-age={self.cache_max_age}, must-revalidate'
+        )
+        patch_vary_headers(response, ('Accept', 'Authorization'))
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        self.cache_state = None
+        if not self.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+        etag, key = self.cache_state = self.get_cache_state(request)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            cached = get_region(self.cache_region).get(key)
+            if cached is None:
+                # Ответ сохранится под текущими версиями моделей: строки
+                # с отстающей реплики остались бы в кэше до следующей смены.
+                with primary_reads():
+                    return handler(request, *args, **kwargs)
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+        self.set_cache_headers(response, etag)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        state = getattr(self, 'cache_state', None)
+        if (state is not None and isinstance(response, Response)
+                and response.status_code == 200):
+            etag, key = state
+            response.render()
+            get_region(self.cache_region).set(
+                key, (response.content, response['Content-Type'])
+            )
+            self.set_cache_headers(response, etag)
+        return response
+
+
+class SerializationMetricsMixin:
+    '''
+    Время to_representation попадает в метрики запроса (serialize_ms),
+    отдельно от рендеринга ответа в JSON.
+    '''
+
+    def to_representation(self, instance):
+        request = self.context.get('request')
+        metrics = getattr(getattr(request, '_request', request),
+                          'query_metrics', None)
+        if metrics is None:
+            return super().to_representation(instance)
+        with metrics.serialization():
+            return super().to_representation(instance)
@@ -1,6 +1,160 @@
-from rest_framework.pagination import PageNumberPagination
+import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    '''Сохраняет микросекунды в датах, иначе курсор теряет точность.'''
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    '''
+    Пагинация по курсору: следующая страница выбирается условием
+    по последней записи предыдущей, без OFFSET и COUNT(*).
+    '''
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+    ordering_conflict_message = (
+        'Курсор нельзя сочетать с поиском и другой сортировкой.'
+    )
+
+    def __init__(self, ordering, page_size):
+        self.ordering = ordering
+        self.page_size = page_size
+
+    def encode_cursor(self, position):
+        return urlsafe_b64encode(
+            json.dumps(position, cls=CursorEncoder).encode()
+        ).decode()
+
+    def invalid_cursor(self, message=None):
+        return ValidationError(
+            {self.cursor_query_param: message or self.invalid_cursor_message}
+        )
+
+    def decode_cursor(self, request):
+        '''
+        Позиция из курсора: список строк и чисел по одному значению
+        на ключ сортировки. Подходят ли значения к полям, проверяется
+        при построении условия.
+        '''
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(cursor.encode()))
+        except ValueError:
+            raise self.invalid_cursor()
+        if not isinstance(position, list) or (
+                len(position) != len(self.ordering)) or not all(
+                isinstance(value, (str, int, float))
+                and not isinstance(value, bool) for value in position):
+            raise self.invalid_cursor()
+        return position
+
+    def get_filter(self, position):
+        '''Условие «после позиции» для составного ключа сортировки.'''
+        condition = Q()
+        equal = {}
+        for ordering, value in zip(self.ordering, position):
+            field = ordering.lstrip('-')
+            lookup = 'lt' if ordering.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        if queryset.query.order_by and (
+                tuple(queryset.query.order_by) != tuple(self.ordering)):
+            # Сортировка фильтра (ранг поиска, рейтинг) не совпадает
+            # с ключом курсора: следующая страница была бы неверной.
+            raise self.invalid_cursor(self.ordering_conflict_message)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.get_filter(position))
+            except (TypeError, ValueError, DjangoValidationError):
+                raise self.invalid_cursor()
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.has_next:
+            last = results[-1]
+            self.next_position = [
+                getattr(last, ordering.lstrip('-'))
+                for ordering in self.ordering
+            ]
+        return results
+
+    def paginate_positions(self, fetch, request):
+        '''
+        Пагинация произвольного источника: fetch(position, limit)
+        возвращает уже упорядоченные ключи сортировки записей.
+        '''
+        self.request = request
+        try:
+            rows = fetch(self.decode_cursor(request), self.page_size + 1)
+        except (TypeError, ValueError, DjangoValidationError):
+            raise self.invalid_cursor()
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.has_next:
+            self.next_position = list(rows[-1])
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
 
 
 class LimitPagination(PageNumberPagination):
+    '''
+    Постраничная пагинация с параметром limit.
+    С параметром cursor (для первой страницы — пустым) включается
+    пагинация по курсору в порядке view.cursor_ordering.
+    '''
     page_size_query_param = "limit"
     page_size = 6
+    cursor_ordering = ('-pub_date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if KeysetPagination.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = KeysetPagination(
+            getattr(view, 'cursor_ordering', self.cursor_ordering),
+            self.get_page_size(request)
+        )
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
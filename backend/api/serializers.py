@@ -1,16 +1,35 @@
-import base64
+import binascii
+import json
 
-from django.core.files.base import ContentFile
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import exceptions, serializers
+from rest_framework.utils import html
 from rest_framework.validators import UniqueTogetherValidator
 
+from api.mixins import SerializationMetricsMixin
+from recipes.constans import (BULK_MAX_IDS, CART_MULTIPLIER_MAX,
+                              CART_MULTIPLIER_MIN, IMAGE_FORMATS,
+                              IMAGE_MAX_PIXELS, IMAGE_VARIANTS)
+from recipes.flags import get_user_flags
+from recipes.images import schedule_variants, spool_base64
 from recipes.models import (Cart, Favorite, Follow, Ingredient,
                             IngredientRecipe, Recipe, Tag, User)
+from recipes.signals import recipe_ingredients_changed
 
 
-class UserInfoSerializer(UserSerializer):
+def get_recipes_limit(request):
+    '''Значение параметра recipes_limit или None, если он не задан.'''
+    recipes_limit = request.query_params.get('recipes_limit')
+    if recipes_limit and recipes_limit.isdigit():
+        return int(recipes_limit)
+    return None
+
+
+class UserInfoSerializer(SerializationMetricsMixin, UserSerializer):
     '''Serializer для просмотра пользователя.'''
     is_subscribed = serializers.SerializerMethodField()
 
@@ -27,6 +46,8 @@ class UserInfoSerializer(UserSerializer):
 
     def get_is_subscribed(self, obj):
         '''Проверка на подписку.'''
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user_id = self.context.get('request').user.id
         return Follow.objects.filter(
             user=user_id, following=obj.id
@@ -49,18 +70,75 @@ class UserCreationSerializer(UserCreateSerializer):
 
 
 class Base64ImageField(serializers.ImageField):
-    '''Кодировка изображения.'''
+    '''
+    Изображение строкой data:image/...;base64 или файлом multipart.
+    Размер (settings.IMAGE_MAX_SIZE) проверяется до декодирования,
+    строка декодируется частями без промежуточных копий, формат
+    и число пикселей — по заголовку. Декодированный файл остаётся
+    в spooled_file, пока сериализатор не закроет его.
+    '''
+    default_error_messages = {
+        'format': f'Допустимые форматы: {", ".join(IMAGE_FORMATS)}.',
+        'base64': 'Изображение повреждено.',
+        'size': 'Размер изображения больше {max_size} байт.',
+        'pixels': f'Изображение больше {IMAGE_MAX_PIXELS} пикселей.',
+    }
+    spooled_file = None
+
     def to_internal_value(self, data):
+        max_size = settings.IMAGE_MAX_SIZE
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
+            offset = data.find(';base64,')
+            if offset == -1:
+                self.fail('base64')
+            ext = data[len('data:image/'):offset].lower()
+            if ext not in IMAGE_FORMATS:
+                self.fail('format')
+            offset += len(';base64,')
+            if (len(data) - offset) * 3 // 4 > max_size:
+                self.fail('size', max_size=max_size)
+            try:
+                data = self.spooled_file = spool_base64(
+                    data, offset, 'temp.' + ext, f'image/{ext}'
+                )
+            except (binascii.Error, ValueError):
+                self.fail('base64')
 
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+        file = super().to_internal_value(data)
+        if file.size > max_size:
+            self.fail('size', max_size=max_size)
+        width, height = file.image.size
+        if width * height > IMAGE_MAX_PIXELS:
+            self.fail('pixels')
+        return file
+
+    def close(self):
+        '''Закрывает (и удаляет с диска) декодированный файл.'''
+        if self.spooled_file is not None:
+            self.spooled_file.close()
+            self.spooled_file = None
 
-        return super().to_internal_value(data)
 
+class ImageVariantsField(serializers.ReadOnlyField):
+    '''
+    Ссылки на WebP-копии изображения рецепта по размерам.
+    Пока копии строятся, вместо них отдаётся оригинал.
+    '''
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        request = self.context.get('request')
+        urls = {}
+        for size in IMAGE_VARIANTS:
+            name = recipe.image_variants.get(size)
+            url = default_storage.url(name) if name else recipe.image.url
+            urls[size] = (request.build_absolute_uri(url)
+                          if request is not None else url)
+        return urls
 
-class TagSerializer(serializers.ModelSerializer):
+
+class TagSerializer(SerializationMetricsMixin,
+                    serializers.ModelSerializer):
     '''Serializer для тэгов.'''
 
     class Meta:
@@ -78,7 +156,8 @@ class TagsField(serializers.SlugRelatedField):
         return serializer.data
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(SerializationMetricsMixin,
+                           serializers.ModelSerializer):
     '''Serializer для ингредиентов.'''
 
     class Meta:
@@ -108,51 +187,56 @@ class CreateRecipeIngredientsSerializer(serializers.ModelSerializer):
         model = IngredientRecipe
         fields = ('id', 'amount')
 
-    def validate_id(self, value):
-        if not Ingredient.objects.filter(id=value).exists():
-            raise serializers.ValidationError('Ингредиент не существует.')
-        return value
-
 
-class RecipeListSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(SerializationMetricsMixin,
+                           serializers.ModelSerializer):
     '''Serializer для просмотра рецептов.'''
     author = UserInfoSerializer()
     tags = TagSerializer(many=True, read_only=True)
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField(source='*')
 
     class Meta:
         model = Recipe
-        exclude = ('pub_date',)
+        exclude = ('pub_date', 'favorites_count', 'carts_count',
+                   'search_vector')
 
     def get_ingredients(self, obj):
-        ingredients = IngredientRecipe.objects.filter(recipe=obj)
+        ingredients = obj.ingredientrecipe_set.all()
         serializer = IngredientRecipeSerializer(ingredients, many=True)
         return serializer.data
 
+    def get_user_flags(self):
+        '''
+        Флаги избранного и корзины текущего пользователя: загружаются
+        один раз на весь список и хранятся в общем контексте.
+        '''
+        request = self.context.get('request')
+        if request is None or request.user.is_anonymous:
+            return None
+        if 'user_flags' not in self.context:
+            self.context['user_flags'] = get_user_flags(request.user.id)
+        return self.context['user_flags']
+
     def get_is_favorited(self, obj):
         '''Находится ли рецепт в избранном.'''
-        user = self.context.get('request').user
-        if not user.is_anonymous:
-            return Favorite.objects.filter(author=user, recipe=obj).exists()
-        return False
+        flags = self.get_user_flags()
+        return flags is not None and flags.is_favorited(obj.id)
 
     def get_is_in_shopping_cart(self, obj):
         '''Находится ли рецепт в корзине покупок.'''
-        user = self.context.get('request').user
-        if not user.is_anonymous:
-            return Cart.objects.filter(author=user, recipe=obj).exists()
-        return False
+        flags = self.get_user_flags()
+        return flags is not None and flags.is_in_shopping_cart(obj.id)
 
 
-class RecipeCreateSerializer(serializers.ModelSerializer):
+class RecipeCreateSerializer(SerializationMetricsMixin,
+                             serializers.ModelSerializer):
     '''Serializer для создания, обновления и удаления рецепта.'''
     author = UserInfoSerializer(read_only=True)
     ingredients = CreateRecipeIngredientsSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True)
+    tags = serializers.ListField(child=serializers.IntegerField())
     image = Base64ImageField()
     cooking_time = serializers.IntegerField(min_value=1)
 
@@ -161,6 +245,36 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         fields = ('author', 'ingredients', 'tags', 'image',
                   'name', 'text', 'cooking_time')
 
+    def to_internal_value(self, data):
+        '''
+        В multipart-запросе ингредиенты передаются JSON-строкой,
+        тэги — повторяющимся полем tags, изображение — файлом.
+        '''
+        if html.is_html_input(data):
+            values = {
+                key: data.getlist(key) if key == 'tags' else data.get(key)
+                for key in data
+            }
+            if isinstance(values.get('ingredients'), str):
+                try:
+                    values['ingredients'] = json.loads(values['ingredients'])
+                except ValueError:
+                    raise serializers.ValidationError(
+                        {'ingredients': 'Ожидается JSON-список.'}
+                    )
+            data = values
+        return super().to_internal_value(data)
+
+    def validate_tags(self, value):
+        '''Все тэги проверяются одним запросом.'''
+        tags = Tag.objects.in_bulk(value)
+        missing = [tag_id for tag_id in value if tag_id not in tags]
+        if missing:
+            raise serializers.ValidationError(
+                f'Тэги не существуют: {missing}.'
+            )
+        return [tags[tag_id] for tag_id in value]
+
     def validate(self, data):
         ingredients = data.get('ingredients', [])
         if not ingredients:
@@ -172,6 +286,17 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise exceptions.ValidationError(
                 'Ингредиенты уже были добавлены в рецепт.'
             )
+        existing_ids = set(Ingredient.objects.filter(
+            id__in=ingredient_ids
+        ).values_list('id', flat=True))
+        missing = [
+            ingredient_id for ingredient_id in ingredient_ids
+            if ingredient_id not in existing_ids
+        ]
+        if missing:
+            raise exceptions.ValidationError(
+                {'ingredients': f'Ингредиенты не существуют: {missing}.'}
+            )
         tags = data.get('tags', [])
         if not tags:
             raise exceptions.ValidationError(
@@ -181,11 +306,44 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Теги не должны повторяться')
         return data
 
+    def is_valid(self, raise_exception=False):
+        '''Без сохранения декодированное изображение больше не нужно.'''
+        try:
+            valid = super().is_valid(raise_exception=raise_exception)
+        except exceptions.ValidationError:
+            self.fields['image'].close()
+            raise
+        if not valid:
+            self.fields['image'].close()
+        return valid
+
+    def save(self, **kwargs):
+        '''После записи в хранилище временный файл изображения закрывается.'''
+        try:
+            return super().save(**kwargs)
+        finally:
+            self.fields['image'].close()
+
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance],
+            'tags',
+            Prefetch(
+                'ingredientrecipe_set',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            ),
+        )
         return RecipeListSerializer(
             instance, context={'request': self.context.get('request')}
         ).data
 
+    @staticmethod
+    def ingredients_changed(recipe):
+        transaction.on_commit(lambda: recipe_ingredients_changed.send(
+            sender=Recipe, recipe_ids=(recipe.id,)
+        ))
+
+    @transaction.atomic
     def create(self, validated_data):
         author = self.context.get('request').user
         tags = validated_data.pop('tags')
@@ -193,53 +351,79 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
         recipe = Recipe.objects.create(author=author, **validated_data)
         recipe.tags.set(tags)
-
-        for ingredient in ingredients:
-            amount = ingredient.get('amount')
-            ingredient = get_object_or_404(
-                Ingredient, id=ingredient.get('id')
-            )
-            IngredientRecipe.objects.create(
-                recipe=recipe, ingredient=ingredient, amount=amount
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe,
+                ingredient_id=ingredient.get('id'),
+                amount=ingredient.get('amount')
             )
+            for ingredient in ingredients
+        )
+        self.ingredients_changed(recipe)
+        schedule_variants(recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags', None)
-        if tags:
-            instance.tags.set(tags)
-
         ingredients = validated_data.pop('ingredients', None)
         if not ingredients or not tags:
             raise exceptions.ValidationError(
                 'Необходимо выбрать тэг и ингредиенты!'
             )
-        if ingredients:
-            instance.ingredients.clear()
-
-            for ingredient in ingredients:
-                amount = ingredient.get('amount')
-                ingredient = get_object_or_404(
-                    Ingredient, id=ingredient.get('id')
-                )
-
-                IngredientRecipe.objects.update_or_create(
+        instance.tags.set(tags)
+
+        amounts = {
+            ingredient.get('id'): ingredient.get('amount')
+            for ingredient in ingredients
+        }
+        current = {
+            row.ingredient_id: row
+            for row in IngredientRecipe.objects.filter(recipe=instance)
+        }
+        removed = current.keys() - amounts.keys()
+        if removed:
+            IngredientRecipe.objects.filter(
+                recipe=instance, ingredient_id__in=removed
+            ).delete()
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ('amount',))
+        added = amounts.keys() - current.keys()
+        if added:
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
                     recipe=instance,
-                    ingredient=ingredient,
-                    defaults={'amount': amount},
+                    ingredient_id=ingredient_id,
+                    amount=amounts[ingredient_id]
                 )
+                for ingredient_id in added
+            )
+        if removed or changed or added:
+            self.ingredients_changed(instance)
 
-        return super().update(instance, validated_data)
+        recipe = super().update(instance, validated_data)
+        if 'image' in validated_data:
+            schedule_variants(recipe)
+        return recipe
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
     '''Serializer для вывода рецептов в подписках.'''
+    image_variants = ImageVariantsField(source='*')
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'cooking_time', 'image',)
+        fields = ('id', 'name', 'cooking_time', 'image', 'image_variants')
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(SerializationMetricsMixin,
+                         serializers.ModelSerializer):
     '''Serializer для избранных рецептов.'''
     id = serializers.PrimaryKeyRelatedField(
         source='recipe',
@@ -250,16 +434,18 @@ class FavoriteSerializer(serializers.ModelSerializer):
     image = serializers.ImageField(
         source='recipe.image',
         read_only=True)
+    image_variants = ImageVariantsField(source='recipe')
     cooking_time = serializers.IntegerField(
         source='recipe.cooking_time',
         read_only=True)
 
     class Meta:
         model = Favorite
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SerializationMetricsMixin,
+                     serializers.ModelSerializer):
     '''Serializer для  списка покупок.'''
     id = serializers.PrimaryKeyRelatedField(
         source='recipe',
@@ -270,13 +456,22 @@ class CartSerializer(serializers.ModelSerializer):
     image = serializers.ImageField(
         source='recipe.image',
         read_only=True)
+    image_variants = ImageVariantsField(source='recipe')
     cooking_time = serializers.IntegerField(
         source='recipe.cooking_time',
         read_only=True)
+    multiplier = serializers.DecimalField(
+        max_digits=4,
+        decimal_places=2,
+        min_value=CART_MULTIPLIER_MIN,
+        max_value=CART_MULTIPLIER_MAX,
+        required=False,
+        coerce_to_string=False)
 
     class Meta:
         model = Cart
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time',
+                  'multiplier')
 
 
 class UsersRecipeSerializer(serializers.ModelSerializer):
@@ -284,14 +479,16 @@ class UsersRecipeSerializer(serializers.ModelSerializer):
     Cериализатор для просмотра рецептов из подписок, избранного и корзины.
     '''
     image = Base64ImageField()
+    image_variants = ImageVariantsField(source='*')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class FollowReadSerializer(serializers.ModelSerializer):
+class FollowReadSerializer(SerializationMetricsMixin,
+                           serializers.ModelSerializer):
     '''Сериализатор просмотра подписок текущего пользователя.'''
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
@@ -312,19 +509,24 @@ class FollowReadSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         '''Проверка на подписку.'''
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user_id = self.context.get('request').user.id
         return Follow.objects.filter(
             user=user_id, following=obj.id
         ).exists()
 
     def get_recipes(self, obj):
-        '''Получение рецептов автора.'''
-        request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        queryset = obj.recipes.all()
-        if recipes_limit and recipes_limit.isdigit():
-            recipes_limit = int(recipes_limit)
-            queryset = queryset[:recipes_limit]
+        '''
+        Получение рецептов автора. Для страницы подписок они загружены
+        заранее одним запросом и переданы в context['recipes'].
+        '''
+        if 'recipes' in self.context:
+            queryset = self.context['recipes'].get(obj.id, [])
+        else:
+            request = self.context.get('request')
+            recipes_limit = get_recipes_limit(request)
+            queryset = obj.recipes.all()[:recipes_limit]
         serializer = UsersRecipeSerializer(
             queryset,
             many=True,
@@ -334,10 +536,11 @@ class FollowReadSerializer(serializers.ModelSerializer):
 
     def get_recipes_count(self, obj):
         '''Получение количества рецептов автора.'''
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(SerializationMetricsMixin,
+                       serializers.ModelSerializer):
     '''Serializer создания и удаления подписки.'''
 
     user = serializers.PrimaryKeyRelatedField(
@@ -379,3 +582,12 @@ class FollowSerializer(serializers.ModelSerializer):
             context={'request':
                      self.context['request']}
         ).data
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    '''Serializer для списка id рецептов или авторов в массовых операциях.'''
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_MAX_IDS
+    )
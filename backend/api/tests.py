@@ -0,0 +1,1486 @@
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import TOKEN_CACHE_KEY, token_digest
+from benchmarks.management.commands.check_query_plans import query_shapes
+from foodgram.bridge import BridgedASGIHandler
+from foodgram.cache import RedisCache, get_region, region_stats
+from foodgram.db_router import reset_replica, use_replica
+from recipes.constans import (BULK_MAX_IDS, INGREDIENT_SEARCH_LIMIT,
+                              RANKING_EPOCH)
+from recipes.flags import get_user_flags
+from recipes.images import build_variants, spool_base64
+from recipes.models import (Cart, Favorite, Follow, Ingredient,
+                            IngredientRecipe, Recipe, RecipeRanking, Tag,
+                            TimelineEntry, User)
+from recipes.rankings import update_rankings
+from recipes.search import recipe_search_index
+from recipes.shopping_list import ShoppingAggregate
+from recipes.versions import get_versions
+
+RECIPES_COUNT = 60
+
+
+class RecipeReadQueriesTest(TestCase):
+    '''
+    Список и карточка рецептов читаются фиксированным числом запросов,
+    сколько бы рецептов ни было на странице.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f'user{number}', email=f'user{number}@test.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for number in range(5)
+        ]
+        tags = [
+            Tag.objects.create(name=f'Тэг {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(10)
+        ]
+        for number in range(RECIPES_COUNT):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=5,
+                author=cls.users[number % len(cls.users)],
+                image='recipes/images/test.png'
+            )
+            recipe.tags.set(tags[:2])
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe, amount=position + 1,
+                                 ingredient=ingredients[
+                                     (number + position) % len(ingredients)
+                                 ])
+                for position in range(3)
+            )
+            if number % 3 == 0:
+                Favorite.objects.create(author=cls.users[0], recipe=recipe)
+                Cart.objects.create(author=cls.users[0], recipe=recipe)
+            if number == 6:
+                cls.recipe = recipe
+        Follow.objects.create(user=cls.users[0], following=cls.users[1])
+        cls.token = Token.objects.create(user=cls.users[0])
+
+    def setUp(self):
+        # Ответы, токены и флаги не должны приходить из кэша
+        # предыдущего теста: считаются запросы холодного чтения.
+        for cache in caches.all():
+            cache.clear()
+        self.anonymous = APIClient()
+        self.authorized = APIClient()
+        self.authorized.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+    def assert_queries(self, client, path, count):
+        with self.assertNumQueries(count):
+            response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_list_anonymous(self):
+        for limit in (1, 50):
+            with self.subTest(limit=limit):
+                data = self.assert_queries(
+                    self.anonymous, f'/api/recipes/?limit={limit}', 5
+                )
+                self.assertEqual(len(data['results']), limit)
+
+    def test_list_authorized(self):
+        '''Плюс токен и два запроса за флагами избранного и корзины.'''
+        for limit in (1, 50):
+            with self.subTest(limit=limit):
+                caches['auth_tokens'].clear()
+                caches['user_flags'].clear()
+                data = self.assert_queries(
+                    self.authorized, f'/api/recipes/?limit={limit}', 8
+                )
+                self.assertEqual(len(data['results']), limit)
+        self.assertTrue(any(
+            recipe['is_favorited'] and recipe['is_in_shopping_cart']
+            for recipe in data['results']
+        ))
+
+    def test_retrieve(self):
+        path = f'/api/recipes/{self.recipe.id}/'
+        self.assert_queries(self.anonymous, path, 4)
+        data = self.assert_queries(self.authorized, path, 7)
+        self.assertTrue(data['is_favorited'])
+        self.assertTrue(data['is_in_shopping_cart'])
+        self.assertTrue(data['author']['is_subscribed'])
+
+
+class ShoppingListExportTest(TestCase):
+    '''Выгрузка списка покупок во всех форматах.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer', email='buyer@test.ru', password='password',
+            first_name='Имя', last_name='Фамилия'
+        )
+        recipe = Recipe.objects.create(
+            name='Блины', text='Текст', cooking_time=5, author=cls.user,
+            image='recipes/images/test.png'
+        )
+        IngredientRecipe.objects.create(
+            recipe=recipe, amount=200,
+            ingredient=Ingredient.objects.create(name='Мука',
+                                                 measurement_unit='г')
+        )
+        Cart.objects.create(author=cls.user, recipe=recipe)
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def download(self, file_format):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/',
+            {'file_format': file_format}
+        )
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_text_formats(self):
+        self.assertEqual(self.download('txt').decode(), 'Мука - 200 г\n')
+        self.assertIn('Мука,200,г', self.download('csv').decode())
+
+    def test_pdf(self):
+        content = self.download('pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertIn(b'/FontFile2', content)
+
+    def test_unknown_format(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'file_format': 'doc'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class CountersTest(TestCase):
+    '''
+    Сохранение устаревшего экземпляра не затирает счётчики,
+    а разошедшийся счётчик не уходит ниже нуля.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.follower = (
+            User.objects.create_user(
+                username=username, email=f'{username}@test.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for username in ('author', 'follower')
+        )
+        cls.recipe = Recipe.objects.create(
+            name='Блины', text='Текст', cooking_time=5, author=cls.author,
+            image='recipes/images/test.png'
+        )
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+    def test_set_password_keeps_counters(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        Follow.objects.create(user=self.follower, following=self.author)
+        response = client.post('/api/users/set_password/', {
+            'current_password': 'password', 'new_password': 'Pa55word!x'
+        })
+        self.assertEqual(response.status_code, 204)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertEqual(self.author.recipes_count, 1)
+
+    def test_stale_recipe_save_keeps_counters(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        Favorite.objects.create(author=self.follower, recipe=self.recipe)
+        stale.name = 'Оладьи'
+        stale.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.recipe.name, 'Оладьи')
+
+    def test_drifted_counter_stays_at_zero(self):
+        favorite = Favorite.objects.create(author=self.follower,
+                                           recipe=self.recipe)
+        Recipe.objects.filter(pk=self.recipe.pk).update(favorites_count=0)
+        favorite.delete()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+    def test_counters_not_exposed(self):
+        data = APIClient().get(f'/api/recipes/{self.recipe.pk}/').json()
+        self.assertNotIn('favorites_count', data)
+        self.assertNotIn('carts_count', data)
+
+
+class VersionBumpTest(TestCase):
+    '''Версии моделей для ETag меняются только после коммита.'''
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.tag = Tag.objects.create(name='Завтрак', color='#000000',
+                                      slug='breakfast')
+
+    def etag(self):
+        return APIClient().get('/api/tags/')['ETag']
+
+    def test_tag_change_bumps_after_commit(self):
+        before = self.etag()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.tag.name = 'Обед'
+            self.tag.save()
+        self.assertEqual(self.etag(), before)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(self.etag(), before)
+
+
+@override_settings(FEED_WORKERS=0)
+@mock.patch('recipes.feeds.FEED_FANOUT_LIMIT', 3)
+class FeedFanoutTest(TestCase):
+    '''
+    Лента подписок: раскладка рецептов обычных авторов, чтение рецептов
+    популярных из Recipe и лента после отписок.
+    '''
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.author, *self.followers = (
+            User.objects.create_user(
+                username=f'user{number}', email=f'user{number}@test.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for number in range(4)
+        )
+
+    def follow(self, followers):
+        for follower in followers:
+            Follow.objects.create(user=follower, following=self.author)
+
+    def publish(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Recipe.objects.create(
+                name='Блины', text='Текст', cooking_time=5,
+                author=self.author, image='recipes/images/test.png'
+            )
+
+    def feed_ids(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/recipes/feed/')
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_fan_out(self):
+        self.follow(self.followers[:2])
+        recipe = self.publish()
+        self.assertEqual(sorted(TimelineEntry.objects.values_list(
+            'user_id', 'recipe_id'
+        )), [(follower.id, recipe.id) for follower in self.followers[:2]])
+        self.assertEqual(self.feed_ids(self.followers[0]), [recipe.id])
+        self.assertEqual(self.feed_ids(self.followers[2]), [])
+
+    def test_popular_author_read_path(self):
+        self.follow(self.followers)
+        recipe = self.publish()
+        self.assertFalse(TimelineEntry.objects.exists())
+        for follower in self.followers:
+            self.assertEqual(self.feed_ids(follower), [recipe.id])
+
+    def test_unfollow_clears_timeline(self):
+        self.follow(self.followers[:2])
+        self.publish()
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.get(user=self.followers[0]).delete()
+        self.assertEqual(self.feed_ids(self.followers[0]), [])
+        self.assertEqual(list(TimelineEntry.objects.values_list(
+            'user_id', flat=True
+        )), [self.followers[1].id])
+
+    def test_unfollow_below_limit(self):
+        self.follow(self.followers)
+        recipe = self.publish()
+        self.assertEqual(self.feed_ids(self.followers[1]), [recipe.id])
+        with self.captureOnCommitCallbacks() as callbacks:
+            Follow.objects.get(user=self.followers[0]).delete()
+        # Раскладка идёт после коммита, а не внутри запроса на отписку.
+        self.assertFalse(TimelineEntry.objects.exists())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.feed_ids(self.followers[1]), [recipe.id])
+        self.assertEqual(TimelineEntry.objects.count(), 2)
+
+    def test_bulk_unfollow_below_limit(self):
+        self.follow(self.followers)
+        recipe = self.publish()
+        client = APIClient()
+        client.force_authenticate(self.followers[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.delete('/api/users/subscribe/bulk/',
+                                     {'ids': [self.author.id]},
+                                     format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.feed_ids(self.followers[2]), [recipe.id])
+        self.assertEqual(TimelineEntry.objects.count(), 2)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_WORKERS=0)
+class ImageVariantsTest(TestCase):
+    '''Готовые копии изображения сбрасывают закэшированную карточку.'''
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        author = User.objects.create_user(
+            username='author', email='author@test.ru', password='password',
+            first_name='Имя', last_name='Фамилия'
+        )
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'red').save(buffer, 'PNG')
+        self.recipe = Recipe(name='Блины', text='Текст', cooking_time=5,
+                             author=author)
+        self.recipe.image.save('test.png', ContentFile(buffer.getvalue()))
+
+    def test_variants_bump_etag(self):
+        path = f'/api/recipes/{self.recipe.pk}/'
+        response = APIClient().get(path)
+        self.assertEqual(response.json()['image_variants']['small'],
+                         response.json()['image'])
+        with self.captureOnCommitCallbacks(execute=True):
+            build_variants(self.recipe.pk)
+        updated = APIClient().get(path)
+        self.assertNotEqual(updated['ETag'], response['ETag'])
+        self.assertTrue(
+            updated.json()['image_variants']['small'].endswith('.webp')
+        )
+
+
+class SpoolBase64Test(TestCase):
+    '''Base64 с переносами строк декодируется, как и без них.'''
+
+    def test_line_wrapped(self):
+        content = bytes(range(256)) * 40
+        data = 'data:' + base64.encodebytes(content).decode()
+        for chunk_size in (5, 64, 1024):
+            with self.subTest(chunk_size=chunk_size), mock.patch(
+                'recipes.images.BASE64_CHUNK_SIZE', chunk_size
+            ):
+                file = spool_base64(data, 5, 'test.png', 'image/png')
+                self.assertEqual(file.read(), content)
+
+
+@override_settings(DATABASE_ROUTERS=['foodgram.db_router.ReplicaRouter'])
+class ReplicaCacheTest(TestCase):
+    '''Ответ для кэша по версиям не читается с реплики.'''
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        Tag.objects.create(name='Завтрак', color='#000000', slug='breakfast')
+
+    def test_cache_miss_reads_primary(self):
+        # Несуществующий псевдоним: любое чтение с реплики упадёт.
+        token = use_replica('replica_missing')
+        try:
+            response = APIClient().get('/api/tags/')
+        finally:
+            reset_replica(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+
+
+class CachedTokenTest(TestCase):
+    '''В кэше токенов нет хэша пароля, а пользователь из кэша безопасен.'''
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.author, self.follower = (
+            User.objects.create_user(
+                username=username, email=f'{username}@test.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for username in ('author', 'follower')
+        )
+        Follow.objects.create(user=self.follower, following=self.author)
+        self.token = Token.objects.create(user=self.author)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cached_user_has_no_password(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        data = caches['auth_tokens'].get(
+            TOKEN_CACHE_KEY.format(digest=token_digest(self.token.key))
+        )
+        self.assertNotIn('password', data)
+        self.assertNotIn(self.author.password, str(data))
+
+    def test_set_password_from_cache(self):
+        self.client.get('/api/users/me/')
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'password', 'new_password': 'Pa55word!x'
+        })
+        self.assertEqual(response.status_code, 204)
+        self.author.refresh_from_db()
+        self.assertTrue(self.author.check_password('Pa55word!x'))
+        self.assertEqual(self.author.followers_count, 1)
+
+
+class UserFlagsTest(TestCase):
+    '''Флаги избранного и корзины сбрасываются при каждом изменении.'''
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.user = User.objects.create_user(
+            username='user', email='user@test.ru', password='password',
+            first_name='Имя', last_name='Фамилия'
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=5,
+                author=self.user, image='recipes/images/test.png'
+            )
+            for number in range(2)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def flags(self):
+        return {
+            recipe['id']: (recipe['is_favorited'],
+                           recipe['is_in_shopping_cart'])
+            for recipe in self.client.get('/api/recipes/').json()['results']
+        }
+
+    def test_toggles(self):
+        first, second = (recipe.id for recipe in self.recipes)
+        self.assertEqual(self.flags()[first], (False, False))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipes/{first}/favorite/')
+            self.client.post(f'/api/recipes/{second}/shopping_cart/')
+        self.assertEqual(self.flags(),
+                         {first: (True, False), second: (False, True)})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{first}/favorite/')
+        self.assertEqual(self.flags()[first], (False, False))
+
+
+class ShoppingListCacheTest(TestCase):
+    '''Список покупок в кэше совпадает с корзиной после каждого коммита.'''
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.user = User.objects.create_user(
+            username='buyer', email='buyer@test.ru', password='password',
+            first_name='Имя', last_name='Фамилия'
+        )
+        flour = Ingredient.objects.create(name='Мука', measurement_unit='г')
+        self.recipes = []
+        for number in range(2):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=5,
+                author=self.user, image='recipes/images/test.png'
+            )
+            IngredientRecipe.objects.create(recipe=recipe, ingredient=flour,
+                                            amount=100)
+            self.recipes.append(recipe)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def download(self):
+        return b''.join(self.client.get(
+            '/api/recipes/download_shopping_cart/'
+        ).streaming_content).decode()
+
+    def test_build_before_callback_is_not_counted_twice(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.client.post(f'/api/recipes/{self.recipes[0].id}'
+                             '/shopping_cart/')
+        # Список пересчитан другим запросом между коммитом и обработчиком.
+        self.assertEqual(self.download(), 'Мука - 100 г\n')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.download(), 'Мука - 100 г\n')
+
+    def test_multiplier_and_removal(self):
+        first, second = (recipe.id for recipe in self.recipes)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/recipes/shopping_cart/bulk/',
+                             {'ids': [first, second]}, format='json')
+        self.assertEqual(self.download(), 'Мука - 200 г\n')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/recipes/{first}/shopping_cart/',
+                              {'multiplier': 3}, format='json')
+        self.assertEqual(self.download(), 'Мука - 400 г\n')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/api/recipes/shopping_cart/bulk/',
+                               {'ids': [second]}, format='json')
+        self.assertEqual(self.download(), 'Мука - 300 г\n')
+        with self.assertNumQueries(0):
+            self.download()
+
+    def test_deleted_ingredient_leaves_cached_list(self):
+        sugar = Ingredient.objects.create(name='Сахар', measurement_unit='г')
+        IngredientRecipe.objects.create(recipe=self.recipes[0],
+                                        ingredient=sugar, amount=50)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipes/{self.recipes[0].id}'
+                             '/shopping_cart/')
+        self.assertEqual(self.download(), 'Мука - 100 г\nСахар - 50 г\n')
+        versions = get_versions(Recipe)
+        with self.captureOnCommitCallbacks(execute=True):
+            sugar.delete()
+        self.assertEqual(self.download(), 'Мука - 100 г\n')
+        self.assertNotEqual(get_versions(Recipe), versions)
+
+    def test_aggregate_sorted_after_batch_add(self):
+        aggregate = ShoppingAggregate()
+        aggregate.add([(3, 'В', 'г', 1), (1, 'А', 'г', 2), (3, 'В', 'г', 1)])
+        aggregate.add([(2, 'Б', 'г', 5), (1, 'А', 'г', 1)], multiplier=2)
+        self.assertEqual(list(aggregate.ids), [1, 2, 3])
+        self.assertEqual(list(aggregate.amounts), [4.0, 10.0, 2.0])
+        aggregate.add([(2, 'Б', 'г', 5)], multiplier=-2)
+        self.assertEqual(list(aggregate.ids), [1, 3])
+        self.assertEqual(set(aggregate.ingredients), {1, 3})
+
+
+class IngredientSearchTest(TestCase):
+    '''Автодополнение ингредиентов из индекса в памяти.'''
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        for name in ('Сахар', 'сахарная пудра', 'Тростниковый сахар',
+                     'Соль'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        self.client = APIClient()
+
+    def search(self, name):
+        return [
+            ingredient['name'] for ingredient in
+            self.client.get('/api/ingredients/', {'name': name}).json()
+        ]
+
+    def test_prefix_matches_first(self):
+        self.assertEqual(self.search('САХ'), [
+            'Сахар', 'сахарная пудра', 'Тростниковый сахар'
+        ])
+        self.assertEqual(self.search('ахар'), [
+            'Сахар', 'сахарная пудра', 'Тростниковый сахар'
+        ])
+        self.assertEqual(self.search('перец'), [])
+
+    def test_limit(self):
+        for number in range(25):
+            Ingredient.objects.create(name=f'Перец {number:02}',
+                                      measurement_unit='г')
+            Ingredient.objects.create(name=f'Молотый перец {number:02}',
+                                      measurement_unit='г')
+        prefix = self.search('пер')
+        self.assertEqual(len(prefix), INGREDIENT_SEARCH_LIMIT)
+        self.assertEqual(prefix[0], 'Перец 00')
+        inside = self.search('ерец')
+        self.assertEqual(len(inside), INGREDIENT_SEARCH_LIMIT)
+        self.assertEqual(inside[0], 'Молотый перец 00')
+
+    def test_invalidated_after_change(self):
+        self.assertEqual(self.search('мёд'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            honey = Ingredient.objects.create(name='Мёд',
+                                              measurement_unit='г')
+        self.assertEqual(self.search('мёд'), ['Мёд'])
+        honey.name = 'Мёд липовый'
+        with self.captureOnCommitCallbacks(execute=True):
+            honey.save()
+        self.assertEqual(self.search('липов'), ['Мёд липовый'])
+        with self.captureOnCommitCallbacks(execute=True):
+            honey.delete()
+        self.assertEqual(self.search('мёд'), [])
+
+
+class MergeDuplicateIngredientsTest(TransactionTestCase):
+    '''Миграция уникальности ингредиентов сливает существующие дубликаты.'''
+
+    before = [('recipes', '0014_tagrecipe_unique_tag')]
+    after = [('recipes', '0015_ingredient_unique_ingredient_unit')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_merge(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        Ingredient = apps.get_model('recipes', 'Ingredient')
+        IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+        Recipe = apps.get_model('recipes', 'Recipe')
+        author = User.objects.create_user(
+            username='author', email='author@test.ru', password='password'
+        )
+        kept, first, second = (
+            Ingredient.objects.create(name='Мука', measurement_unit='г')
+            for _ in range(3)
+        )
+        both, single = (
+            Recipe.objects.create(name=name, text='Текст', cooking_time=5,
+                                  author_id=author.pk, image='test.png')
+            for name in ('Оба', 'Один')
+        )
+        IngredientRecipe.objects.create(recipe=both, ingredient=kept,
+                                        amount=100)
+        IngredientRecipe.objects.create(recipe=both, ingredient=second,
+                                        amount=50)
+        IngredientRecipe.objects.create(recipe=single, ingredient=first,
+                                        amount=30)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+        self.assertEqual(
+            list(Ingredient.objects.values_list('pk', flat=True)), [kept.pk]
+        )
+        self.assertEqual(sorted(IngredientRecipe.objects.values_list(
+            'recipe_id', 'ingredient_id', 'amount'
+        )), [(both.pk, kept.pk, 150), (single.pk, kept.pk, 30)])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeWriteQueriesTest(TestCase):
+    '''
+    Создание и изменение рецепта выполняют одно и то же число запросов,
+    сколько бы в нём ни было ингредиентов и тэгов.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@test.ru', password='password',
+            first_name='Имя', last_name='Фамилия'
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(20)
+        ]
+        cls.tags = [
+            Tag.objects.create(name=f'Тэг {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(5)
+        ]
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10), 'red').save(buffer, 'PNG')
+        cls.image = ('data:image/png;base64,'
+                     + base64.b64encode(buffer.getvalue()).decode())
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Флаги избранного и корзины загружаются в кэш первым запросом.
+        get_user_flags(self.user.id)
+
+    def payload(self, count):
+        return {
+            'name': 'Рецепт', 'text': 'Текст', 'cooking_time': 5,
+            'image': self.image,
+            'tags': [tag.id for tag in self.tags[:count % 5 + 1]],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in self.ingredients[:count]
+            ],
+        }
+
+    def test_create(self):
+        for count in (1, 20):
+            with self.subTest(count=count), self.assertNumQueries(14):
+                response = self.client.post('/api/recipes/',
+                                            self.payload(count),
+                                            format='json')
+                self.assertEqual(response.status_code, 201)
+
+    def test_update(self):
+        recipe_id = self.client.post(
+            '/api/recipes/', self.payload(5), format='json'
+        ).json()['id']
+        for count in (1, 20):
+            with self.subTest(count=count), self.assertNumQueries(15):
+                response = self.client.patch(f'/api/recipes/{recipe_id}/',
+                                             self.payload(count),
+                                             format='json')
+                self.assertEqual(response.status_code, 200)
+
+
+class KeysetPaginationTest(TestCase):
+    '''Пагинация по курсору: страницы без пропусков и проверка курсора.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@test.ru', password='password',
+            first_name='Имя', last_name='Фамилия'
+        )
+        recipes = [
+            Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=5,
+                author=cls.user, image='recipes/images/test.png'
+            )
+            for number in range(8)
+        ]
+        # Два рецепта с одинаковой датой: порядок между ними задаёт id.
+        Recipe.objects.filter(pk__in=[recipe.pk for recipe in recipes[:2]]
+                              ).update(pub_date=recipes[0].pub_date)
+        cls.expected = list(Recipe.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('id', flat=True))
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.client = APIClient()
+
+    def get(self, cursor='', **params):
+        return self.client.get('/api/recipes/',
+                               {'cursor': cursor, 'limit': 3, **params})
+
+    def test_pages(self):
+        first = self.get().json()
+        self.assertNotIn('count', first)
+        ids = [recipe['id'] for recipe in first['results']]
+        self.assertEqual(ids, self.expected[:3])
+        response = self.client.get(first['next'])
+        ids += [recipe['id'] for recipe in response.json()['results']]
+        self.assertEqual(ids, self.expected[:6])
+        last = self.client.get(response.json()['next']).json()
+        ids += [recipe['id'] for recipe in last['results']]
+        self.assertEqual(ids, self.expected)
+        self.assertIsNone(last['next'])
+
+    def test_invalid_cursor(self):
+        for position in ('не json', [], ['вчера', 1], [{}, 1], [True, 1],
+                         ['2026-01-01T00:00:00', 'один']):
+            cursor = position if isinstance(position, str) else (
+                base64.urlsafe_b64encode(json.dumps(position).encode())
+            ).decode()
+            with self.subTest(position=position):
+                response = self.get(cursor)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('cursor', response.json())
+
+    def test_conflicting_ordering(self):
+        for params in ({'search': 'рецепт'}, {'ordering': 'popular'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.get(**params).status_code, 400)
+
+
+class SharedCacheSettingsTest(SimpleTestCase):
+    '''Несколько воркеров не запускаются с кэшем в памяти процесса.'''
+
+    def check(self, **env):
+        return subprocess.run(
+            (sys.executable, 'manage.py', 'check'),
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+            env={**os.environ, **env}
+        )
+
+    def test_locmem_with_workers(self):
+        result = self.check(GUNICORN_WORKERS='2', CACHE_BACKEND='locmem')
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('ImproperlyConfigured', result.stderr)
+
+    def test_shared_cache_with_workers(self):
+        result = self.check(GUNICORN_WORKERS='2', CACHE_BACKEND='file',
+                            CACHE_LOCATION=tempfile.mkdtemp())
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+class RedisCacheTest(SimpleTestCase):
+    '''RedisCache и счётчики региона на fakeredis вместо сервера.'''
+
+    def setUp(self):
+        self.cache = RedisCache('redis://localhost:6379/0', {
+            'KEY_PREFIX': 'test',
+            'OPTIONS': {'CLIENT_CLASS': 'fakeredis.FakeRedis'},
+        })
+        self.cache.clear()
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('missing'))
+        self.cache.set('value', {'ids': [1, 2]})
+        self.assertEqual(self.cache.get('value'), {'ids': [1, 2]})
+        self.assertFalse(self.cache.add('value', 'other'))
+        self.cache.set_many({'first': 1, 'second': 'два'})
+        self.assertEqual(self.cache.get_many(['first', 'second', 'none']),
+                         {'first': 1, 'second': 'два'})
+
+    def test_incr(self):
+        with self.assertRaises(ValueError):
+            self.cache.incr('counter')
+        self.cache.set('counter', 10)
+        self.assertEqual(self.cache.incr('counter'), 11)
+        self.assertEqual(self.cache.incr('counter', 5), 16)
+        self.assertEqual(self.cache.get('counter'), 16)
+
+    def test_concurrent_incr(self):
+        self.cache.set('counter', 0)
+
+        def bump():
+            for _ in range(50):
+                self.cache.incr('counter')
+
+        threads = [threading.Thread(target=bump) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+
+    def test_delete_many(self):
+        self.cache.set_many({'first': 1, 'second': 2, 'third': 3})
+        self.cache.delete_many(['first', 'second'])
+        self.assertEqual(self.cache.get_many(['first', 'second', 'third']),
+                         {'third': 3})
+
+    def test_region_stats(self):
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'foodgram.cache.RedisCache',
+            'LOCATION': 'redis://localhost:6379/0',
+            'KEY_PREFIX': 'region',
+            'OPTIONS': {'CLIENT_CLASS': 'fakeredis.FakeRedis'},
+        }}):
+            region = get_region()
+            self.assertIsInstance(region.cache, RedisCache)
+            before = region_stats()['default']
+            region.set('key', 'value')
+            region.get('key')
+            region.get('missing')
+            region.get_many(['key', 'missing'])
+            after = region_stats()['default']
+        self.assertEqual(after['hits'] - before['hits'], 2)
+        self.assertEqual(after['misses'] - before['misses'], 2)
+
+
+class RecipeSearchTest(TestCase):
+    '''Поиск ?search=: ранжирование по полям и ограничение выдачи.'''
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.author = User.objects.create_user(
+            username='author', email='author@test.ru', password='password',
+            first_name='Имя', last_name='Фамилия'
+        )
+        beet = Ingredient.objects.create(name='Свёкла для борща',
+                                         measurement_unit='г')
+        self.in_text, self.in_ingredients, self.in_name = (
+            Recipe.objects.create(
+                name=name, text=text, cooking_time=5, author=self.author,
+                image='recipes/images/test.png'
+            )
+            for name, text in (
+                ('Суп', 'Похож на борщ, но без капусты.'),
+                ('Салат', 'Нарезать и смешать.'),
+                ('Борщ', 'Сварить.'),
+            )
+        )
+        IngredientRecipe.objects.create(recipe=self.in_ingredients,
+                                        ingredient=beet, amount=1)
+        Recipe.objects.create(name='Каша', text='Сварить.', cooking_time=5,
+                              author=self.author,
+                              image='recipes/images/test.png')
+
+    def search(self, query):
+        return [
+            recipe['id'] for recipe in APIClient().get(
+                '/api/recipes/', {'search': query, 'limit': 10}
+            ).json()['results']
+        ]
+
+    def test_rank_order(self):
+        self.assertEqual(self.search('борщ'), [
+            self.in_name.id, self.in_ingredients.id, self.in_text.id
+        ])
+        self.assertEqual(self.search('сварить борщ'), [self.in_name.id])
+        self.assertEqual(self.search('плов'), [])
+
+    def test_fallback_limit(self):
+        self.assertEqual(recipe_search_index.search('борщ', limit=2),
+                         [self.in_name.id, self.in_ingredients.id])
+
+    def test_vector_updated_only_on_text_change(self):
+        with mock.patch('recipes.signals.update_search_vectors') as update:
+            recipe = Recipe.objects.get(pk=self.in_name.pk)
+            recipe.cooking_time = 10
+            recipe.save()
+            update.assert_not_called()
+            recipe.text = 'Сварить и настоять.'
+            recipe.save()
+            update.assert_called_once_with((recipe.pk,))
+
+
+class SubscriptionsTest(TestCase):
+    '''Подписки: порядок авторов и recipes_limit в оконном запросе.'''
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.user, *self.authors = (
+            User.objects.create_user(
+                username=f'user{number}', email=f'user{number}@test.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for number in range(4)
+        )
+        self.recipes = {}
+        for count, author in zip((3, 0, 1), self.authors):
+            self.recipes[author.id] = [
+                Recipe.objects.create(
+                    name=f'Рецепт {number}', text='Текст', cooking_time=5,
+                    author=author, image='recipes/images/test.png'
+                ).id
+                for number in range(count)
+            ][::-1]
+        # Подписки в другом порядке, чем авторы были созданы.
+        for author in (self.authors[1], self.authors[0], self.authors[2]):
+            Follow.objects.create(user=self.user, following=author)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def subscriptions(self, **params):
+        return self.client.get('/api/users/subscriptions/',
+                               params).json()['results']
+
+    def test_order_and_limit(self):
+        results = self.subscriptions(recipes_limit=2)
+        self.assertEqual(
+            [author['id'] for author in results],
+            [self.authors[2].id, self.authors[0].id, self.authors[1].id]
+        )
+        for author in results:
+            self.assertEqual(
+                [recipe['id'] for recipe in author['recipes']],
+                self.recipes[author['id']][:2]
+            )
+            self.assertEqual(author['recipes_count'],
+                             len(self.recipes[author['id']]))
+
+    def test_without_limit(self):
+        for author in self.subscriptions():
+            self.assertEqual(
+                [recipe['id'] for recipe in author['recipes']],
+                self.recipes[author['id']]
+            )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_WORKERS=0)
+class ImageUploadTest(TestCase):
+    '''Предел размера изображения и закрытие декодированного файла.'''
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.user = User.objects.create_user(
+            username='author', email='author@test.ru', password='password',
+            first_name='Имя', last_name='Фамилия'
+        )
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10), 'red').save(buffer, 'PNG')
+        self.payload = {
+            'name': 'Рецепт', 'text': 'Текст', 'cooking_time': 5,
+            'image': ('data:image/png;base64,'
+                      + base64.b64encode(buffer.getvalue()).decode()),
+            'tags': [Tag.objects.create(name='Тэг', color='#000000',
+                                        slug='tag').id],
+            'ingredients': [{
+                'id': Ingredient.objects.create(name='Мука',
+                                                measurement_unit='г').id,
+                'amount': 10
+            }],
+        }
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.files = []
+
+    def spool(self, *args):
+        file = spool_base64(*args)
+        self.files.append(file)
+        return file
+
+    def post(self, **changes):
+        with mock.patch('api.serializers.spool_base64', self.spool):
+            return self.client.post('/api/recipes/',
+                                    {**self.payload, **changes},
+                                    format='json')
+
+    def test_size_limit_from_settings(self):
+        with override_settings(IMAGE_MAX_SIZE=20):
+            response = self.post()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('20 байт', response.json()['image'][0])
+        self.assertEqual(self.post().status_code, 201)
+
+    def test_spooled_file_closed(self):
+        self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(self.post(ingredients=[]).status_code, 400)
+        self.assertEqual(len(self.files), 2)
+        self.assertTrue(all(file.closed for file in self.files))
+
+
+class BridgedASGIHandlerTest(TransactionTestCase):
+    '''Запросы через ASGI-мост, включая потоковую выгрузку.'''
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        user = User.objects.create_user(
+            username='buyer', email='buyer@test.ru', password='password',
+            first_name='Имя', last_name='Фамилия'
+        )
+        self.token = Token.objects.create(user=user).key
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=5,
+                author=user, image='recipes/images/test.png'
+            )
+            IngredientRecipe.objects.create(
+                recipe=recipe, amount=100,
+                ingredient=Ingredient.objects.create(
+                    name=f'Ингредиент {number}', measurement_unit='г'
+                )
+            )
+            Cart.objects.create(author=user, recipe=recipe)
+
+    def request(self, path):
+        scope = {
+            'type': 'http', 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'root_path': '',
+            'query_string': b'', 'server': ('testserver', 80),
+            'client': ('127.0.0.1', 50000),
+            'headers': [(b'host', b'testserver'),
+                        (b'authorization', f'Token {self.token}'.encode())],
+        }
+
+        async def communicate():
+            communicator = ApplicationCommunicator(BridgedASGIHandler(),
+                                                   scope)
+            await communicator.send_input({'type': 'http.request'})
+            messages = [await communicator.receive_output(5)]
+            while messages[-1].get('more_body', messages[-1]['type']
+                                   == 'http.response.start'):
+                messages.append(await communicator.receive_output(5))
+            return messages
+
+        start, *body = async_to_sync(communicate)()
+        return start['status'], body
+
+    def test_regular_response(self):
+        status, body = self.request('/api/ingredients/')
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            len(json.loads(b''.join(part['body'] for part in body))), 3
+        )
+
+    def test_streamed_response(self):
+        status, body = self.request('/api/recipes/download_shopping_cart/')
+        self.assertEqual(status, 200)
+        # По сообщению на строку списка и закрывающее сообщение.
+        self.assertEqual([part.get('body', b'') for part in body], [
+            'Ингредиент 0 - 100 г\n'.encode(),
+            'Ингредиент 1 - 100 г\n'.encode(),
+            'Ингредиент 2 - 100 г\n'.encode(),
+            b'',
+        ])
+
+
+class QueryMetricsMiddlewareTest(TestCase):
+    '''Метрики запроса: потоковые ответы, сериализация, Server-Timing.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer', email='buyer@test.ru', password='password',
+            first_name='Имя', last_name='Фамилия'
+        )
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=5,
+                author=cls.user, image='recipes/images/test.png'
+            )
+            IngredientRecipe.objects.create(
+                recipe=recipe, amount=100,
+                ingredient=Ingredient.objects.create(
+                    name=f'Ингредиент {number}', measurement_unit='г'
+                )
+            )
+            Cart.objects.create(author=cls.user, recipe=recipe)
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_streamed_response_recorded_on_close(self):
+        with mock.patch('foodgram.middleware.record') as record, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/'
+            )
+            record.assert_not_called()
+            b''.join(response.streaming_content)
+        record.assert_called_once()
+        self.assertEqual(record.call_args.args[0].queries, len(queries))
+        self.assertEqual(record.call_args.args[2], 200)
+
+    def test_serialization_timed_separately(self):
+        with mock.patch('foodgram.middleware.record') as record:
+            self.client.get('/api/recipes/')
+        request_metrics = record.call_args.args[0]
+        self.assertGreater(request_metrics.serialize_duration, 0)
+        self.assertGreater(request_metrics.render_duration, 0)
+        self.assertEqual(request_metrics.serialize_depth, 0)
+
+    def test_server_timing_header_setting(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/tags/'))
+        with self.settings(SERVER_TIMING_HEADER=True):
+            header = self.client.get('/api/tags/')['Server-Timing']
+        self.assertIn('serialize;dur=', header)
+
+    def test_request_line_logged_at_debug(self):
+        with self.assertLogs('foodgram.requests', 'DEBUG') as logs:
+            self.client.get('/api/tags/')
+        self.assertEqual([record.levelname for record in logs.records],
+                         ['DEBUG'])
+        self.assertIn('serialize_ms', logs.records[0].getMessage())
+
+
+class QueryPlansTest(TestCase):
+    '''check_query_plans на небольшом сгенерированном наборе данных.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_benchmark_data', users=40, recipes=400,
+                     follows=5, favorites=10, carts=3, stdout=StringIO())
+
+    def test_queries_use_expected_indexes(self):
+        output = StringIO()
+        call_command('check_query_plans', stdout=output)
+        user = User.objects.filter(favorites__isnull=False).first()
+        author = Recipe.objects.values_list('author', flat=True).first()
+        for name, _, index, vendors in query_shapes(user, author):
+            if vendors and connection.vendor not in vendors:
+                self.assertIn(f'SKIP {name}', output.getvalue())
+            else:
+                self.assertIn(f'OK   {name}: {index}', output.getvalue())
+
+    def test_analyze_limited_to_checked_tables(self):
+        with CaptureQueriesContext(connection) as queries:
+            call_command('check_query_plans', stdout=StringIO())
+        analyzed = [query['sql'] for query in queries
+                    if query['sql'].startswith('ANALYZE')]
+        self.assertIn('ANALYZE "recipes_ingredientrecipe"', analyzed)
+        self.assertNotIn('ANALYZE', analyzed)
+        self.assertFalse(any('recipes_tag"' in sql for sql in analyzed))
+
+
+class BulkRelationsTest(TestCase):
+    '''Массовое добавление и удаление избранного, корзины и подписок.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author = (
+            User.objects.create_user(
+                username=name, email=f'{name}@test.ru', password='password',
+                first_name='Имя', last_name='Фамилия'
+            )
+            for name in ('buyer', 'author')
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=5,
+                author=cls.author, image='recipes/images/test.png'
+            )
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def bulk(self, method, path, ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(
+                path, {'ids': ids}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        return {result['id']: result['status']
+                for result in response.data['results']}
+
+    def favorites_counts(self):
+        return [Recipe.objects.get(pk=recipe.pk).favorites_count
+                for recipe in self.recipes]
+
+    def test_ids_limit(self):
+        path = '/api/recipes/favorite/bulk/'
+        response = self.client.post(
+            path, {'ids': list(range(1, BULK_MAX_IDS + 2))}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['ids'][0].code, 'max_length')
+        results = self.bulk('post', path, list(range(1, BULK_MAX_IDS + 1)))
+        self.assertEqual(len(results), BULK_MAX_IDS)
+
+    def test_duplicate_and_unknown_ids(self):
+        first = self.recipes[0].id
+        self.assertEqual(
+            self.bulk('post', '/api/recipes/favorite/bulk/',
+                      [first, first, 999999]),
+            {first: 'added', 999999: 'not_found'}
+        )
+        self.assertEqual(self.favorites_counts(), [1, 0, 0])
+        self.assertEqual(
+            self.bulk('post', '/api/recipes/favorite/bulk/', [first]),
+            {first: 'exists'}
+        )
+        self.assertEqual(self.favorites_counts(), [1, 0, 0])
+
+    def test_remove_updates_counters_and_flags(self):
+        first, second, third = (recipe.id for recipe in self.recipes)
+        self.bulk('post', '/api/recipes/favorite/bulk/', [first, second])
+        self.assertEqual(list(get_user_flags(self.user.id).favorites),
+                         [first, second])
+        self.assertEqual(
+            self.bulk('delete', '/api/recipes/favorite/bulk/',
+                      [first, first, third, 999999]),
+            {first: 'removed', third: 'absent', 999999: 'absent'}
+        )
+        self.assertEqual(self.favorites_counts(), [0, 1, 0])
+        self.assertEqual(list(get_user_flags(self.user.id).favorites),
+                         [second])
+
+    def test_remove_runs_no_row_handlers(self):
+        ids = [recipe.id for recipe in self.recipes]
+        self.bulk('post', '/api/recipes/shopping_cart/bulk/', ids)
+        self.assertEqual(list(get_user_flags(self.user.id).cart), ids)
+        # Точка сохранения, выбор строк, их удаление, один пересчёт
+        # счётчиков вместо обновления по строке и снятие точки.
+        with self.assertNumQueries(5):
+            self.bulk('delete', '/api/recipes/shopping_cart/bulk/', ids)
+        self.assertEqual(
+            [Recipe.objects.get(pk=pk).carts_count for pk in ids], [0] * 3
+        )
+        self.assertEqual(list(get_user_flags(self.user.id).cart), [])
+
+    def test_unsubscribe(self):
+        path = '/api/users/subscribe/bulk/'
+        self.assertEqual(
+            self.bulk('post', path, [self.author.id, self.user.id]),
+            {self.author.id: 'added', self.user.id: 'self'}
+        )
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertEqual(
+            self.bulk('delete', path, [self.author.id, 999999]),
+            {self.author.id: 'removed', 999999: 'absent'}
+        )
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+        self.assertFalse(Follow.objects.filter(user=self.user).exists())
+
+
+class RankingsTest(TestCase):
+    '''update_rankings и сортировки рецептов и тэгов по рейтингам.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@test.ru', password='password',
+            first_name='Имя', last_name='Фамилия'
+        )
+        cls.fans = [
+            User.objects.create_user(
+                username=f'fan{number}', email=f'fan{number}@test.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for number in range(3)
+        ]
+        cls.tags = [
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (('Завтрак', '#E26C2D', 'breakfast'),
+                                      ('Обед', '#49B64E', 'lunch'))
+        ]
+        cls.recipes = []
+        for number, tags in enumerate(
+            (cls.tags[:1], cls.tags[1:], cls.tags[1:])
+        ):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=5,
+                author=cls.author, image='recipes/images/test.png'
+            )
+            recipe.tags.set(tags)
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+    def add_favorites(self, recipe, fans, added_at=None):
+        for fan in fans:
+            favorite = Favorite.objects.create(author=fan, recipe=recipe)
+            if added_at is not None:
+                Favorite.objects.filter(pk=favorite.pk).update(
+                    added_at=added_at
+                )
+
+    def rankings(self, field):
+        return list(RecipeRanking.objects.order_by(
+            f'-{field}', '-recipe_id'
+        ).values_list('recipe_id', flat=True))
+
+    def ordered_ids(self, path):
+        with self.captureOnCommitCallbacks(execute=True):
+            update_rankings()
+        response = APIClient().get(path)
+        self.assertEqual(response.status_code, 200)
+        results = response.data
+        if isinstance(results, dict):
+            results = results['results']
+        return [item['id'] for item in results]
+
+    def test_full_update(self):
+        first, second, third = self.recipes
+        # Давние добавления дают популярность, но не популярность сейчас.
+        self.add_favorites(first, self.fans, RANKING_EPOCH)
+        self.add_favorites(second, self.fans[:1])
+        Cart.objects.create(author=self.fans[0], recipe=third)
+        result = update_rankings()
+        self.assertEqual(result['trending'], 3)
+        self.assertEqual(self.rankings('score'),
+                         [first.id, second.id, third.id])
+        self.assertEqual(self.rankings('trending_score'),
+                         [second.id, third.id, first.id])
+
+    def test_incremental_update_adds_new_events(self):
+        first, second, third = self.recipes
+        self.add_favorites(first, self.fans[:2])
+        update_rankings()
+        trending = RecipeRanking.objects.get(pk=first.pk).trending_score
+        self.add_favorites(third, self.fans)
+        result = update_rankings(incremental=True)
+        # Учтены только добавления после прошлого запуска.
+        self.assertEqual(result['trending'], 1)
+        self.assertEqual(
+            RecipeRanking.objects.get(pk=first.pk).trending_score, trending
+        )
+        self.assertEqual(self.rankings('trending_score'),
+                         [third.id, first.id, second.id])
+
+    def test_command(self):
+        self.add_favorites(self.recipes[1], self.fans[:1])
+        output = StringIO()
+        call_command('update_rankings', '--incremental', stdout=output)
+        self.assertIn('1 trending scores', output.getvalue())
+
+    def test_recipe_ordering(self):
+        first, second, third = self.recipes
+        self.add_favorites(second, self.fans)
+        self.add_favorites(third, self.fans[:1])
+        self.assertEqual(
+            self.ordered_ids('/api/recipes/?ordering=popular'),
+            [second.id, third.id, first.id]
+        )
+        self.add_favorites(first, self.fans[:2], RANKING_EPOCH)
+        self.assertEqual(
+            self.ordered_ids('/api/recipes/?ordering=trending'),
+            [second.id, third.id, first.id]
+        )
+        self.assertEqual(
+            self.ordered_ids('/api/recipes/?ordering=popular'),
+            [second.id, first.id, third.id]
+        )
+
+    def test_tag_ordering(self):
+        breakfast, lunch = self.tags
+        self.assertEqual(self.ordered_ids('/api/tags/?ordering=usage'),
+                         [lunch.id, breakfast.id])
+        self.add_favorites(self.recipes[0], self.fans)
+        self.assertEqual(self.ordered_ids('/api/tags/?ordering=trending'),
+                         [breakfast.id, lunch.id])
+        self.recipes[1].tags.set([breakfast])
+        self.assertEqual(self.ordered_ids('/api/tags/?ordering=usage'),
+                         [breakfast.id, lunch.id])
+
+
+class RankingsMigrationTest(TransactionTestCase):
+    '''Существующим добавлениям миграция не ставит текущую дату.'''
+
+    before = [('recipes', '0022_cart_multiplier')]
+    after = [('recipes', '0023_rankings')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_existing_rows_outside_trending_window(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        Recipe = apps.get_model('recipes', 'Recipe')
+        author = User.objects.create_user(
+            username='author', email='author@test.ru', password='password'
+        )
+        recipe = Recipe.objects.create(name='Рецепт', text='Текст',
+                                       cooking_time=5, author_id=author.pk,
+                                       image='test.png')
+        for model_name in ('Favorite', 'Cart'):
+            apps.get_model('recipes', model_name).objects.create(
+                author_id=author.pk, recipe_id=recipe.pk
+            )
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+        for model in (Favorite, Cart):
+            self.assertEqual(
+                list(model.objects.values_list('added_at', flat=True)),
+                [RANKING_EPOCH]
+            )
@@ -1,8 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter as Router
 
-from .views import (CustomUserViewSet, IngredientViewSet, RecipeViewSet,
-                    TagViewSet)
+from .views import (CacheStatsView, CustomUserViewSet, IngredientViewSet,
+                    MetricsView, RecipeViewSet, TagViewSet)
 
 router_v1 = Router()
 router_v1.register('users', CustomUserViewSet, basename='user')
@@ -14,4 +14,6 @@ router_v1.register('ingredients', IngredientViewSet, basename='ingredient')
 urlpatterns = [
     path('', include(router_v1.urls)),
     path('auth/', include('djoser.urls.authtoken')),
+    path('cache-stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,15 +1,110 @@
-from django.http import HttpResponse
-
-
-def generate_shopping_list(file_name, ingredients):
-    shopping_list = []
-    for item in ingredients:
-        name = item['ingredient__name']
-        measurement_unit = item['ingredient__measurement_unit']
-        amount = item['ingredient_total']
-        shopping_list.append(f'{name} - {amount} {measurement_unit}')
-    content = '\n'.join(shopping_list)
-    content_type = 'text/plain,charset=utf8'
-    response = HttpResponse(content, content_type=content_type)
-    response['Content-Disposition'] = f'attachment; filename={file_name}'
+import csv
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+SHOPPING_LIST_FORMATS = {
+    'txt': 'text/plain; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'pdf': 'application/pdf',
+}
+PDF_FONT_NAME = 'ShoppingListFont'
+PDF_FONT_SIZE = 12
+PDF_TITLE_SIZE = 16
+PDF_MARGIN = 20 * mm
+PDF_LINE_HEIGHT = PDF_FONT_SIZE * 1.5
+PDF_CHUNK_SIZE = 64 * 1024
+# Документ больше этого собирается во временном файле, а не в памяти.
+PDF_SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class Echo:
+    '''Псевдобуфер для csv.writer: сразу возвращает записанную строку.'''
+
+    def write(self, value):
+        return value
+
+
+def _text_lines(ingredients):
+    for name, measurement_unit, amount in ingredients:
+        yield f'{name} - {amount} {measurement_unit}\n'
+
+
+def _csv_lines(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for name, measurement_unit, amount in ingredients:
+        yield writer.writerow((name, amount, measurement_unit))
+
+
+def register_pdf_font():
+    '''
+    Шрифт с кириллицей из PDF_FONT_PATH: стандартные шрифты PDF
+    её не содержат. Используемые символы встраиваются в документ.
+    '''
+    if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(PDF_FONT_NAME, settings.PDF_FONT_PATH))
+    return PDF_FONT_NAME
+
+
+def _pdf_lines(ingredients):
+    '''
+    Строки рисуются на страницах A4 по мере чтения. Таблица ссылок PDF
+    пишется в конец файла, поэтому документ отдаётся частями
+    после того, как собран целиком; большой документ собирается
+    во временном файле, и в памяти его целиком нет.
+    '''
+    font = register_pdf_font()
+    buffer = SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_SIZE)
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pdf.setTitle('Список покупок')
+    width, height = A4
+    text_width = width - 2 * PDF_MARGIN
+    pdf.setFont(font, PDF_TITLE_SIZE)
+    pdf.drawString(PDF_MARGIN, height - PDF_MARGIN, 'Список покупок')
+    pdf.setFont(font, PDF_FONT_SIZE)
+    y = height - PDF_MARGIN - 2 * PDF_LINE_HEIGHT
+    for name, measurement_unit, amount in ingredients:
+        for line in simpleSplit(f'{name} - {amount} {measurement_unit}',
+                                font, PDF_FONT_SIZE, text_width):
+            if y < PDF_MARGIN:
+                pdf.showPage()
+                pdf.setFont(font, PDF_FONT_SIZE)
+                y = height - PDF_MARGIN
+            pdf.drawString(PDF_MARGIN, y, line)
+            y -= PDF_LINE_HEIGHT
+    pdf.save()
+    with buffer:
+        buffer.seek(0)
+        yield from iter(lambda: buffer.read(PDF_CHUNK_SIZE), b'')
+
+
+SHOPPING_LIST_WRITERS = {
+    'txt': _text_lines,
+    'csv': _csv_lines,
+    'pdf': _pdf_lines,
+}
+
+
+def generate_shopping_list(file_name, ingredients, file_format='txt'):
+    '''
+    Потоковая выгрузка списка покупок в выбранном формате.
+    ingredients — уже сведённые строки: их не больше, чем разных
+    ингредиентов в корзине, сколько бы рецептов в ней ни было,
+    поэтому память ограничена справочником, а не размером корзины.
+    '''
+    response = StreamingHttpResponse(
+        SHOPPING_LIST_WRITERS[file_format](ingredients),
+        content_type=SHOPPING_LIST_FORMATS[file_format]
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename={file_name}.{file_format}'
+    )
     return response
@@ -1,38 +1,76 @@
 from http import HTTPStatus
 
-from django.db.models import Sum
+from django.db.models import Exists, F, OuterRef, Prefetch, Value
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import mixins, permissions, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import (AllowAny, IsAuthenticated,
+from rest_framework.permissions import (AllowAny, IsAdminUser, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from .filters import IngredientFilter, RecipeFilter
-from .pagination import LimitPagination
+from .filters import IngredientFilter, RecipeFilter, TagFilter
+from .mixins import VersionedCacheMixin
+from .pagination import KeysetPagination, LimitPagination
 from .permissions import IsAuthorOrAdminOrReadOnly
-from .serializers import (CartSerializer, FavoriteSerializer, FollowSerializer,
-                          IngredientSerializer, RecipeCreateSerializer,
-                          RecipeListSerializer, TagSerializer,
-                          UserInfoSerializer)
-from .utils import generate_shopping_list
+from .serializers import (BulkIdsSerializer, CartSerializer,
+                          FavoriteSerializer, FollowReadSerializer,
+                          FollowSerializer, IngredientSerializer,
+                          RecipeCreateSerializer, RecipeListSerializer,
+                          TagSerializer, UserInfoSerializer, get_recipes_limit)
+from .utils import SHOPPING_LIST_FORMATS, generate_shopping_list
+from foodgram.cache import region_stats
+from foodgram.metrics import render_prometheus
+from recipes.bulk import bulk_add, bulk_remove
+from recipes.feeds import feed_positions, latest_recipes_by_author
 from recipes.models import (Cart, Favorite, Follow, Ingredient,
-                            IngredientRecipe, Recipe, Tag, User)
+                            IngredientRecipe, Recipe, RecipeRanking, Tag,
+                            TagUsage, User)
+from recipes.search import ingredient_index
+from recipes.shopping_list import iter_shopping_list
 
 
-class TagViewSet(mixins.ListModelMixin,
+def bulk_relation_response(request, model):
+    '''
+    Массовое добавление (POST) или удаление (DELETE) связей
+    пользователя с результатом по каждому id.
+    '''
+    serializer = BulkIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    apply = bulk_add if request.method == 'POST' else bulk_remove
+    results = apply(model, request.user, serializer.validated_data['ids'])
+    return Response({'results': [
+        {'id': target_id, 'status': status}
+        for target_id, status in results.items()
+    ]})
+
+
+class TagViewSet(VersionedCacheMixin,
+                 mixins.ListModelMixin,
                  mixins.RetrieveModelMixin,
                  viewsets.GenericViewSet):
     '''ViewSet для тэгов.'''
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
+    filter_backends = (DjangoFilterBackend,)
+    filterset_class = TagFilter
     pagination_class = None
+    cache_models = (Tag,)
+    cache_region = 'tags'
+    cache_max_age = 300
+
+    def get_cache_models(self):
+        if 'ordering' in self.request.query_params:
+            return self.cache_models + (TagUsage,)
+        return self.cache_models
 
 
-class IngredientViewSet(mixins.ListModelMixin,
+class IngredientViewSet(VersionedCacheMixin,
+                        mixins.ListModelMixin,
                         mixins.RetrieveModelMixin,
                         viewsets.GenericViewSet):
     '''ViewSet для ингредиентов.'''
@@ -42,9 +80,19 @@ class IngredientViewSet(mixins.ListModelMixin,
     filter_backends = (DjangoFilterBackend, )
     filterset_class = IngredientFilter
     pagination_class = None
+    cache_models = (Ingredient,)
+    cache_region = 'ingredients'
+    cache_max_age = 300
+
+    def filter_queryset(self, queryset):
+        '''Автодополнение по названию обслуживается индексом в памяти.'''
+        name = self.request.query_params.get('name')
+        if name and self.action == 'list':
+            return ingredient_index.search(name)
+        return super().filter_queryset(queryset)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(VersionedCacheMixin, viewsets.ModelViewSet):
     '''
     ViewSet для создания, удаления, редактирования рецептов,
     добавления/удаления их из ибранного,
@@ -54,7 +102,41 @@ class RecipeViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthorOrAdminOrReadOnly, )
     filter_backends = (DjangoFilterBackend, )
     pagination_class = LimitPagination
+    cursor_ordering = ('-pub_date', '-id')
     filterset_class = RecipeFilter
+    cache_models = (Recipe, Tag, Ingredient, User)
+    cache_region = 'recipe_cards'
+
+    def get_cache_models(self):
+        if 'ordering' in self.request.query_params:
+            return self.cache_models + (RecipeRanking,)
+        return self.cache_models
+
+    def get_queryset(self):
+        '''
+        Рецепты для чтения загружаются фиксированным числом запросов:
+        авторы, тэги и ингредиенты подгружаются пачкой, подписка
+        считается аннотацией, а флаги избранного и корзины сериализатор
+        берёт из закэшированных множеств пользователя.
+        '''
+        queryset = super().get_queryset().defer('search_vector')
+        if self.request.method not in permissions.SAFE_METHODS:
+            return queryset
+        user = self.request.user
+        if user.is_authenticated:
+            authors = User.objects.annotate(is_subscribed=Exists(
+                Follow.objects.filter(user=user, following=OuterRef('pk'))
+            ))
+        else:
+            authors = User.objects.annotate(is_subscribed=Value(False))
+        return queryset.prefetch_related(
+            Prefetch('author', queryset=authors),
+            'tags',
+            Prefetch(
+                'ingredientrecipe_set',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            ),
+        )
 
     def get_serializer_class(self):
         if self.request.method in permissions.SAFE_METHODS:
@@ -96,12 +178,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
                         status=HTTPStatus.NO_CONTENT)
 
     @action(detail=True,
-            methods=['post', 'delete'],
+            methods=['post', 'patch', 'delete'],
             permission_classes=[IsAuthenticated])
     def shopping_cart(self, request, **kwargs):
         '''
         Добавляем или удаляем рецепт из списка покупок
-        у текущего пользователя.
+        у текущего пользователя. Необязательный multiplier
+        увеличивает количества ингредиентов рецепта в списке,
+        PATCH меняет его у рецепта, уже лежащего в корзине.
         '''
         try:
             recipe = Recipe.objects.get(id=self.kwargs.get('pk'))
@@ -120,25 +204,81 @@ class RecipeViewSet(viewsets.ModelViewSet):
                                 status=HTTPStatus.CREATED)
             return Response(serializer.errors,
                             status=HTTPStatus.BAD_REQUEST)
-        if not Cart.objects.filter(author=user, recipe=recipe).exists():
+        cart = Cart.objects.filter(author=user, recipe=recipe).first()
+        if cart is None:
             return Response({'errors': 'Объект не найден'},
                             status=HTTPStatus.BAD_REQUEST)
-        Cart.objects.filter(author=user, recipe=recipe).delete()
+        if request.method == 'PATCH':
+            serializer = CartSerializer(cart, data=request.data, partial=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return Response(serializer.data)
+        cart.delete()
         return Response('Рецепт успешно удалён из списка покупок.',
                         status=HTTPStatus.NO_CONTENT)
 
-    @action(detail=False, methods=['get'])
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='favorite/bulk')
+    def favorite_bulk(self, request):
+        '''Добавить или удалить из избранного сразу несколько рецептов.'''
+        return bulk_relation_response(request, Favorite)
+
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='shopping_cart/bulk')
+    def shopping_cart_bulk(self, request):
+        '''Добавить или удалить из списка покупок несколько рецептов.'''
+        return bulk_relation_response(request, Cart)
+
+    @action(detail=False,
+            methods=['get'],
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        '''
+        Лента рецептов авторов, на которых подписан пользователь.
+        Страница выбирается по ключам из ленты и догружается
+        тем же набором запросов, что и список рецептов.
+        '''
+        paginator = KeysetPagination(
+            self.cursor_ordering, LimitPagination().get_page_size(request)
+        )
+        rows = paginator.paginate_positions(
+            lambda position, limit: feed_positions(
+                request.user, position, limit),
+            request
+        )
+        ids = [recipe_id for _, recipe_id in rows]
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = RecipeListSerializer(
+            [recipes[recipe_id] for recipe_id in ids if recipe_id in recipes],
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False,
+            methods=['get'],
+            permission_classes=[IsAuthenticated])
     def download_shopping_cart(self, request):
-        '''Скачиваем список покупок для выбранных рецептов.'''
-        ingredients_list = IngredientRecipe.objects.filter(
-            recipe__cart__author=self.request.user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).order_by(
-            'ingredient__name'
-        ).annotate(ingredient_total=Sum('amount'))
-        list_name = 'shopping_list.txt'
-        return generate_shopping_list(list_name, ingredients_list)
+        '''
+        Скачиваем список покупок для выбранных рецептов.
+        Формат задаётся параметром file_format: txt (по умолчанию),
+        csv или pdf.
+        '''
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {'errors': 'Доступные форматы: '
+                           f'{", ".join(SHOPPING_LIST_FORMATS)}.'},
+                status=HTTPStatus.BAD_REQUEST)
+        return generate_shopping_list(
+            'shopping_list',
+            iter_shopping_list(self.request.user),
+            file_format
+        )
 
 
 class CustomUserViewSet(UserViewSet):
@@ -151,6 +291,12 @@ class CustomUserViewSet(UserViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,)
     pagination_class = LimitPagination
 
+    @property
+    def cursor_ordering(self):
+        if self.action == 'subscriptions':
+            return ('-follow_id',)
+        return ('-id',)
+
     @action(detail=False,
             methods=['get'],
             permission_classes=[IsAuthenticated])
@@ -166,12 +312,26 @@ class CustomUserViewSet(UserViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def subscriptions(self, request):
-        '''Подписки данного пользователя.'''
-        follows = Follow.objects.filter(user=self.request.user)
-        pages = self.paginate_queryset(follows)
-        serializer = FollowSerializer(pages,
-                                      many=True,
-                                      context={'request': request})
+        '''
+        Подписки данного пользователя. Рецепты всех авторов страницы
+        загружаются одним оконным запросом, число рецептов берётся
+        из счётчика, поэтому число запросов не зависит от размера страницы.
+        '''
+        authors = User.objects.filter(
+            following__user=self.request.user
+        ).annotate(
+            follow_id=F('following__id'),
+            is_subscribed=Value(True)
+        ).order_by('-follow_id')
+        pages = self.paginate_queryset(authors)
+        recipes = latest_recipes_by_author(
+            (author.id for author in pages), get_recipes_limit(request)
+        )
+        serializer = FollowReadSerializer(
+            pages,
+            many=True,
+            context={'request': request, 'recipes': recipes}
+        )
         return self.get_paginated_response(serializer.data)
 
     @action(
@@ -204,3 +364,30 @@ class CustomUserViewSet(UserViewSet):
                                 status=HTTPStatus.NO_CONTENT)
             return Response('Такой подписки не существует.',
                             status=HTTPStatus.BAD_REQUEST)
+
+    @action(
+        methods=['delete', 'post'],
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        url_path='subscribe/bulk'
+    )
+    def subscribe_bulk(self, request):
+        '''Подписка на нескольких авторов или отписка от них.'''
+        return bulk_relation_response(request, Follow)
+
+
+class CacheStatsView(APIView):
+    '''Попадания и промахи по регионам кэша в текущем процессе.'''
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(region_stats())
+
+
+class MetricsView(APIView):
+    '''Метрики запросов и кэша текущего процесса для Prometheus.'''
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(render_prometheus(),
+                            content_type='text/plain; version=0.0.4')
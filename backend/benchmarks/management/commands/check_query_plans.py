@@ -0,0 +1,133 @@
+import re
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+
+from recipes.models import (Cart, Favorite, Follow, Ingredient,
+                            IngredientRecipe, Recipe, RecipeRanking,
+                            TimelineEntry, User)
+
+# Строки плана, по которым видно, что используется индекс.
+INDEX_PATTERNS = {
+    'postgresql': r'(Index Scan|Index Only Scan|Bitmap Index Scan)'
+                  r'( Backward)? (using|on) {index}\b',
+    'sqlite': r'USING (COVERING )?INDEX {index}\b',
+}
+# SQLite создаёт уникальные ограничения вместе с таблицей
+# и называет их индексы сам.
+CONSTRAINT_INDEXES = {
+    'unique_follow': r'sqlite_autoindex_recipes_follow_\d+',
+}
+
+
+def query_shapes(user, author):
+    '''
+    Запросы горячих эндпоинтов и индексы, которыми они должны
+    обслуживаться. Последний элемент — СУБД, где проверка имеет смысл
+    (None — на всех).
+    '''
+    return (
+        ('favorites of user',
+         Favorite.objects.filter(author=user).values_list('recipe_id'),
+         'favorite_author_recipe_idx', None),
+        ('cart of user',
+         Cart.objects.filter(author=user).values_list('recipe_id'),
+         'cart_author_recipe_idx', None),
+        ('latest recipes',
+         Recipe.objects.order_by('-pub_date', '-id').values('id')[:6],
+         'recipe_pub_date_id_idx', None),
+        ('popular recipes',
+         RecipeRanking.objects.order_by('-score', '-recipe_id')
+         .values('recipe_id')[:6],
+         'ranking_score_idx', None),
+        ('trending recipes',
+         RecipeRanking.objects.order_by('-trending_score', '-recipe_id')
+         .values('recipe_id')[:6],
+         'ranking_trending_idx', None),
+        ('latest recipes of author',
+         Recipe.objects.filter(author=author).order_by('-pub_date', '-id')
+         .values('id')[:3],
+         'recipe_author_pub_date_idx', None),
+        ('timeline of user',
+         TimelineEntry.objects.filter(user=user)
+         .order_by('-pub_date', '-recipe_id').values_list('recipe_id')[:6],
+         'timeline_user_pub_date_idx', None),
+        ('follows of user',
+         Follow.objects.filter(user=user).values_list('following_id'),
+         'unique_follow', None),
+        ('shopping list',
+         IngredientRecipe.objects.filter(recipe__cart__author=user)
+         .values_list('ingredient_id').annotate(total=Sum('amount')),
+         'ingredientrecipe_cover_idx', None),
+        ('ingredient prefix search',
+         Ingredient.objects.filter(name__startswith='мук').values('id'),
+         'ingredient_name_like_idx', ('postgresql',)),
+    )
+
+
+def analyze(shapes):
+    '''
+    Обновляет статистику планировщика только для таблиц проверяемых
+    запросов, а не для всей базы.
+    '''
+    tables = set()
+    for _, queryset, _, _ in shapes:
+        tables.add(queryset.model._meta.db_table)
+        tables.update(join.table_name
+                      for join in queryset.query.alias_map.values())
+    with connection.cursor() as cursor:
+        for table in sorted(tables):
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(table)}')
+
+
+class Command(BaseCommand):
+    '''
+    Проверка планов выполнения ключевых запросов: для каждого
+    запроса через EXPLAIN проверяется, что он использует ожидаемый
+    индекс. Нужны данные, например из seed_benchmark_data,
+    иначе планировщику проще прочитать таблицу целиком.
+    '''
+    help = 'Checks that key queries use the expected indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-analyze', action='store_true',
+                            help='Do not refresh planner statistics '
+                                 'of the checked tables')
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Print full plans')
+
+    def handle(self, *args, **options):
+        pattern = INDEX_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(
+                f'Unsupported database vendor: {connection.vendor}')
+        user = User.objects.filter(favorites__isnull=False).first()
+        author = Recipe.objects.values_list('author', flat=True).first()
+        if user is None or author is None:
+            raise CommandError(
+                'No data to plan against, run seed_benchmark_data first')
+        shapes = query_shapes(user, author)
+        if not options['no_analyze']:
+            analyze(shapes)
+        failed = []
+        for name, queryset, index, vendors in shapes:
+            if vendors and connection.vendor not in vendors:
+                self.stdout.write(f'SKIP {name}: {connection.vendor}')
+                continue
+            plan = queryset.explain()
+            names = re.escape(index)
+            if connection.vendor == 'sqlite' and index in CONSTRAINT_INDEXES:
+                names = f'({names}|{CONSTRAINT_INDEXES[index]})'
+            if re.search(pattern.format(index=names), plan):
+                self.stdout.write(f'OK   {name}: {index}')
+            else:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(
+                    f'FAIL {name}: {index} not used'))
+            if options['verbose_plans'] or name in failed:
+                self.stdout.write(plan)
+        if failed:
+            raise CommandError(
+                f'{len(failed)} queries do not use expected indexes')
+        self.stdout.write(self.style.SUCCESS('All query plans use indexes'))
@@ -0,0 +1,113 @@
+import json
+import logging
+import random
+import subprocess
+from datetime import datetime, timezone
+
+from django.core.management import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from benchmarks.runner import HTTPTransport, TestClientTransport, run_scenario
+from benchmarks.scenarios import SCENARIOS, BenchmarkContext
+from benchmarks.seed import dataset_summary
+
+COMPARED = ('rps', 'p95_ms', 'queries_mean')
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    '''
+    Прогон сценариев нагрузки через тестовый клиент (по умолчанию,
+    с подсчётом SQL-запросов) или против запущенного сервера (--url).
+    Результат в JSON удобно сравнивать между коммитами (--compare).
+    '''
+    help = 'Runs API benchmark scenarios and reports latency, RPS, queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS,
+                            default=list(SCENARIOS))
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Scenario runs per client')
+        parser.add_argument('--url', help='Server URL instead of test client')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Clients per scenario, only with --url')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write JSON report to file')
+        parser.add_argument('--compare', help='Baseline JSON report')
+
+    def get_transport_factory(self, options):
+        if options['url']:
+            return lambda: HTTPTransport(options['url'])
+        if options['concurrency'] != 1:
+            raise CommandError('--concurrency requires --url')
+        transport = TestClientTransport()
+        return lambda: transport
+
+    def handle(self, *args, **options):
+        make_transport = self.get_transport_factory(options)
+        # Строки лога каждого запроса тестового клиента не нужны в отчёте.
+        logging.getLogger('foodgram.requests').setLevel(logging.WARNING)
+        context = BenchmarkContext(random.Random(options['seed']))
+        if context.is_empty():
+            raise CommandError('Run seed_benchmark_data first')
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for scenario in options['scenarios']:
+                results[scenario] = run_scenario(
+                    make_transport, scenario, context,
+                    options['iterations'], options['concurrency'],
+                    options['seed']
+                )
+                self.write_row(scenario, results[scenario])
+        report = {
+            'meta': {
+                'commit': current_commit(),
+                'created': datetime.now(timezone.utc).isoformat(),
+                'transport': options['url'] or 'test-client',
+                'iterations': options['iterations'],
+                'concurrency': options['concurrency'],
+                'seed': options['seed'],
+                'dataset': dataset_summary(),
+            },
+            'scenarios': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def write_row(self, scenario, result):
+        queries = result['queries_mean']
+        self.stdout.write(
+            f'{scenario:<26} {result["requests"]:>6} req '
+            f'{result["errors"]:>4} err {result["rps"]:>8} rps  '
+            f'p50 {result["p50_ms"]:>8} p95 {result["p95_ms"]:>8} '
+            f'p99 {result["p99_ms"]:>8} ms  '
+            f'queries {"-" if queries is None else queries}'
+        )
+
+    def compare(self, path, results):
+        '''Изменение ключевых метрик относительно базового отчёта.'''
+        with open(path) as file:
+            baseline = json.load(file)['scenarios']
+        for scenario, result in results.items():
+            if scenario not in baseline:
+                continue
+            changes = []
+            for metric in COMPARED:
+                old, new = baseline[scenario].get(metric), result[metric]
+                if old is None or new is None:
+                    continue
+                delta = (new - old) / old * 100 if old else 0.0
+                changes.append(f'{metric} {old} -> {new} ({delta:+.1f}%)')
+            self.stdout.write(f'{scenario:<26} ' + ', '.join(changes))
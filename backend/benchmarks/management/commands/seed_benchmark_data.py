@@ -0,0 +1,48 @@
+from time import perf_counter
+
+from django.core.management import BaseCommand
+
+from benchmarks.seed import clear_benchmark_data, seed
+
+
+class Command(BaseCommand):
+    '''
+    Генерация синтетических пользователей, рецептов, подписок,
+    избранного и корзин для бенчмарков. Предыдущие данные
+    бенчмарков удаляются, остальные данные не затрагиваются.
+    '''
+    help = 'Seeds a reproducible synthetic dataset for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Follows per user')
+        parser.add_argument('--favorites', type=int, default=30,
+                            help='Favorites per user')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Shopping cart recipes per user')
+        parser.add_argument('--ingredients-per-recipe', type=int, default=6)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clear', action='store_true',
+                            help='Only remove benchmark data')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            clear_benchmark_data()
+            self.stdout.write(self.style.SUCCESS('Benchmark data removed'))
+            return
+        started = perf_counter()
+        summary = seed(
+            users=options['users'],
+            recipes=options['recipes'],
+            follows=options['follows'],
+            favorites=options['favorites'],
+            carts=options['carts'],
+            ingredients_per_recipe=options['ingredients_per_recipe'],
+            random_seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded in {perf_counter() - started:.1f} s: '
+            + ', '.join(f'{count} {name}' for name, count in summary.items())
+        ))
@@ -0,0 +1,142 @@
+import http.client
+import random
+import re
+import statistics
+import threading
+from time import perf_counter
+from urllib.parse import quote, urlsplit
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .scenarios import SCENARIOS
+
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def percentiles(latencies):
+    '''p50, p95 и p99 в миллисекундах.'''
+    if len(latencies) < 2:
+        return (latencies * 3 or [0.0] * 3)[:3]
+    cuts = statistics.quantiles(latencies, n=100)
+    return [cuts[49] * 1000, cuts[94] * 1000, cuts[98] * 1000]
+
+
+class TestClientTransport:
+    '''Запросы через тестовый клиент DRF с подсчётом SQL-запросов.'''
+    concurrent = False
+
+    def __init__(self):
+        self.client = APIClient()
+
+    def request(self, method, path, token):
+        if token:
+            self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        else:
+            self.client.credentials()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response.status_code, len(queries)
+
+
+class HTTPTransport:
+    '''
+    Запросы к запущенному серверу по HTTP с keep-alive.
+    Число SQL-запросов берётся из заголовка Server-Timing.
+    '''
+    concurrent = True
+
+    def __init__(self, url):
+        url = urlsplit(url)
+        self.address = (url.hostname, url.port or 80)
+        self.prefix = url.path.rstrip('/')
+        self.host = url.netloc
+        self.connection = http.client.HTTPConnection(*self.address,
+                                                     timeout=30)
+
+    def request(self, method, path, token):
+        headers = {'Host': self.host, 'Content-Length': '0'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        try:
+            self.connection.request(
+                method.upper(), quote(self.prefix + path, safe='/?=&'),
+                headers=headers
+            )
+            response = self.connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            return None, None
+        queries = SERVER_TIMING_QUERIES.search(
+            response.getheader('Server-Timing', '')
+        )
+        return response.status, queries and int(queries.group(1))
+
+
+def run_iteration(transport, steps, token, samples):
+    '''Один проход сценария: шаги получают код ответа предыдущего.'''
+    status = None
+    while True:
+        try:
+            method, path, allowed = steps.send(status)
+        except StopIteration:
+            return
+        started = perf_counter()
+        status, queries = transport.request(method, path, token)
+        ok = status is not None and (status < 400 or status in allowed)
+        samples.append((perf_counter() - started, queries, ok))
+
+
+def run_worker(transport, scenario, context, rng, iterations, samples):
+    steps, authenticated = SCENARIOS[scenario]
+    for _ in range(iterations):
+        token = rng.choice(context.users) if authenticated else None
+        run_iteration(transport, steps(context, rng), token, samples)
+
+
+def run_scenario(make_transport, scenario, context, iterations,
+                 concurrency=1, random_seed=0):
+    '''
+    Прогон сценария: concurrency клиентов по iterations проходов.
+    Генератор случайных чисел каждого клиента зависит только от
+    random_seed, имени сценария и номера клиента.
+    '''
+    samples = []
+    workers = [
+        threading.Thread(target=run_worker, args=(
+            make_transport(), scenario, context,
+            random.Random(f'{random_seed}:{scenario}:{number}'),
+            iterations, samples
+        ))
+        for number in range(concurrency)
+    ]
+    started = perf_counter()
+    if concurrency == 1:
+        workers[0].run()
+    else:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    return summarize(samples, perf_counter() - started)
+
+
+def summarize(samples, elapsed):
+    latencies = [latency for latency, _, ok in samples if ok]
+    queries = [count for _, count, _ in samples if count is not None]
+    p50, p95, p99 = percentiles(latencies)
+    return {
+        'requests': len(samples),
+        'errors': len(samples) - len(latencies),
+        'rps': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(p50, 2),
+        'p95_ms': round(p95, 2),
+        'p99_ms': round(p99, 2),
+        'queries_mean': (round(statistics.mean(queries), 2)
+                         if queries else None),
+        'queries_max': max(queries) if queries else None,
+    }
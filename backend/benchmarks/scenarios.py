@@ -0,0 +1,84 @@
+from http import HTTPStatus
+
+from rest_framework.authtoken.models import Token
+
+from .seed import BENCH_PREFIX
+from recipes.models import Ingredient, Recipe, Tag
+
+SAMPLE_SIZE = 1000
+
+
+class BenchmarkContext:
+    '''Выборка данных, из которой сценарии берут параметры запросов.'''
+
+    def __init__(self, rng):
+        self.users = list(Token.objects.filter(
+            user__username__startswith=BENCH_PREFIX
+        ).order_by('user_id').values_list('key', flat=True)[:SAMPLE_SIZE])
+        recipes = list(Recipe.objects.order_by('id').values_list(
+            'id', flat=True
+        ))
+        self.recipes = rng.sample(recipes, min(SAMPLE_SIZE, len(recipes)))
+        self.tags = list(Tag.objects.order_by('id').values_list(
+            'slug', flat=True
+        ))
+        names = list(Ingredient.objects.order_by('id').values_list(
+            'name', flat=True
+        ))
+        self.ingredients = rng.sample(names, min(SAMPLE_SIZE, len(names)))
+
+    def is_empty(self):
+        return not (self.users and self.recipes and self.ingredients)
+
+
+# Сценарий — генератор шагов (метод, путь, допустимые коды ошибок);
+# код ответа на шаг возвращается в генератор через send().
+
+def browse_recipes(context, rng):
+    '''Страницы рецептов, фильтр и рейтинги тэгов, карточка рецепта.'''
+    yield 'get', f'/api/recipes/?page={rng.randint(1, 5)}&limit=6', ()
+    yield 'get', f'/api/recipes/?tags={rng.choice(context.tags)}', ()
+    yield 'get', '/api/recipes/?ordering=popular&limit=12', ()
+    yield 'get', '/api/recipes/?ordering=trending&limit=12', ()
+    yield 'get', '/api/tags/?ordering=usage', ()
+    yield 'get', f'/api/recipes/{rng.choice(context.recipes)}/', ()
+
+
+def autocomplete_ingredients(context, rng):
+    '''Ввод названия ингредиента по буквам.'''
+    name = rng.choice(context.ingredients)
+    for length in range(1, min(len(name), 4) + 1):
+        yield 'get', f'/api/ingredients/?name={name[:length]}', ()
+
+
+def toggle_favorites(context, rng):
+    '''Добавление рецепта в избранное и удаление; состояние сохраняется.'''
+    url = f'/api/recipes/{rng.choice(context.recipes)}/favorite/'
+    status = yield 'post', url, (HTTPStatus.BAD_REQUEST,)
+    yield 'delete', url, ()
+    if status == HTTPStatus.BAD_REQUEST:
+        yield 'post', url, ()
+
+
+def download_shopping_list(context, rng):
+    '''Скачивание списка покупок в обоих форматах.'''
+    yield 'get', '/api/recipes/download_shopping_cart/', ()
+    yield 'get', '/api/recipes/download_shopping_cart/?file_format=csv', ()
+
+
+def read_subscriptions(context, rng):
+    '''Подписки с рецептами авторов и лента подписок.'''
+    yield 'get', '/api/users/subscriptions/?recipes_limit=3', ()
+    yield 'get', '/api/users/subscriptions/?page=2&recipes_limit=3', ()
+    yield 'get', '/api/recipes/feed/', ()
+
+
+# Имя: (сценарий, нужен ли токен пользователя).
+SCENARIOS = {
+    'browse_recipes_anonymous': (browse_recipes, False),
+    'browse_recipes': (browse_recipes, True),
+    'autocomplete_ingredients': (autocomplete_ingredients, False),
+    'toggle_favorites': (toggle_favorites, True),
+    'download_shopping_list': (download_shopping_list, True),
+    'read_subscriptions': (read_subscriptions, True),
+}
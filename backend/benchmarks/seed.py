@@ -0,0 +1,223 @@
+import random
+from collections import defaultdict
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from recipes.constans import FEED_BACKFILL_SIZE, FEED_FANOUT_LIMIT
+from recipes.counters import rebuild_recipe_counters, rebuild_user_counters
+from recipes.models import (Cart, Favorite, Follow, Ingredient,
+                            IngredientRecipe, Recipe, Tag, TagRecipe,
+                            TimelineEntry, User)
+from recipes.rankings import update_rankings
+from recipes.search import update_search_vectors
+from recipes.versions import bump_version
+
+BENCH_PREFIX = 'bench_'
+BATCH_SIZE = 5000
+MIN_INGREDIENTS = 100
+BENCH_TAGS = (('Завтрак', '#E26C2D', 'bench-breakfast'),
+              ('Обед', '#49B64E', 'bench-lunch'),
+              ('Ужин', '#8775D2', 'bench-dinner'))
+DISHES = ('суп', 'салат', 'пирог', 'рагу', 'каша', 'запеканка', 'омлет',
+          'паста', 'плов', 'котлеты', 'блины', 'сырники', 'борщ', 'гуляш')
+ADJECTIVES = ('домашний', 'быстрый', 'летний', 'пряный', 'сытный',
+              'лёгкий', 'бабушкин', 'праздничный', 'острый', 'нежный')
+PRODUCTS = ('морковь', 'картофель', 'лук', 'сыр', 'мука', 'сахар', 'соль',
+            'молоко', 'яйцо', 'рис', 'говядина', 'курица', 'томат', 'перец')
+UNITS = ('г', 'мл', 'шт.', 'ст. л.', 'ч. л.')
+
+
+def zipf_weights(count):
+    '''Накопленные веса 1/n: немного популярных объектов и длинный хвост.'''
+    return list(accumulate(1 / rank for rank in range(1, count + 1)))
+
+
+def weighted_sample(rng, population, cum_weights, count, exclude=None):
+    '''До count разных элементов population с весами cum_weights.'''
+    chosen = set()
+    count = min(count, len(population) - (exclude is not None))
+    for _ in range(count * 10):
+        if len(chosen) >= count:
+            break
+        item = rng.choices(population, cum_weights=cum_weights)[0]
+        if item != exclude:
+            chosen.add(item)
+    return chosen
+
+
+def clear_benchmark_data():
+    '''Удаляет сгенерированных пользователей со всем их содержимым.'''
+    users = User.objects.filter(username__startswith=BENCH_PREFIX)
+    recipes = Recipe.objects.filter(author__in=users)
+    for queryset in (
+        TimelineEntry.objects.filter(user__in=users),
+        Favorite.objects.filter(author__in=users),
+        Cart.objects.filter(author__in=users),
+        Follow.objects.filter(user__in=users),
+        IngredientRecipe.objects.filter(recipe__in=recipes),
+        TagRecipe.objects.filter(recipe__in=recipes),
+        recipes,
+        users,
+        Tag.objects.filter(slug__startswith='bench-'),
+        Ingredient.objects.filter(name__startswith=BENCH_PREFIX),
+    ):
+        queryset.delete()
+
+
+def seed_tags():
+    tags = list(Tag.objects.values_list('id', flat=True))
+    if tags:
+        return tags
+    return [Tag.objects.create(name=name, color=color, slug=slug).id
+            for name, color, slug in BENCH_TAGS]
+
+
+def seed_ingredients(rng):
+    '''Загруженные ингредиенты или синтетические, если справочник пуст.'''
+    if Ingredient.objects.count() < MIN_INGREDIENTS:
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=f'{BENCH_PREFIX}{product} {number}',
+                        measurement_unit=rng.choice(UNITS))
+             for product in PRODUCTS
+             for number in range(MIN_INGREDIENTS // len(PRODUCTS) + 1)),
+            batch_size=BATCH_SIZE, ignore_conflicts=True
+        )
+    return list(Ingredient.objects.order_by('id').values_list('id', flat=True))
+
+
+def seed_users(count):
+    password = make_password(None)
+    User.objects.bulk_create(
+        (User(username=f'{BENCH_PREFIX}{number}',
+              email=f'{BENCH_PREFIX}{number}@example.com',
+              first_name='Пользователь', last_name=str(number),
+              password=password)
+         for number in range(count)),
+        batch_size=BATCH_SIZE
+    )
+    users = list(User.objects.filter(
+        username__startswith=BENCH_PREFIX
+    ).order_by('id').values_list('id', flat=True))
+    Token.objects.bulk_create(
+        (Token(key=Token.generate_key(), user_id=user_id)
+         for user_id in users),
+        batch_size=BATCH_SIZE
+    )
+    return users
+
+
+def seed_recipes(rng, users, tags, ingredients, count, per_recipe):
+    '''Рецепты распределены по авторам по закону Ципфа.'''
+    authors = rng.choices(users, cum_weights=zipf_weights(len(users)),
+                          k=count)
+    Recipe.objects.bulk_create(
+        (Recipe(author_id=author_id,
+                name=f'{rng.choice(ADJECTIVES)} {rng.choice(DISHES)}',
+                text=' '.join(rng.choices(PRODUCTS, k=12)),
+                cooking_time=rng.randint(5, 180),
+                image='recipes/images/bench.png')
+         for author_id in authors),
+        batch_size=BATCH_SIZE
+    )
+    recipes = list(Recipe.objects.filter(
+        author__username__startswith=BENCH_PREFIX
+    ).order_by('id').values_list('id', 'author_id', 'pub_date'))
+    TagRecipe.objects.bulk_create(
+        (TagRecipe(recipe_id=recipe_id, tag_id=tag_id)
+         for recipe_id, _, _ in recipes
+         for tag_id in rng.sample(tags, rng.randint(1, min(3, len(tags))))),
+        batch_size=BATCH_SIZE
+    )
+    IngredientRecipe.objects.bulk_create(
+        (IngredientRecipe(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                          amount=rng.randint(1, 500))
+         for recipe_id, _, _ in recipes
+         for ingredient_id in rng.sample(
+             ingredients, min(per_recipe, len(ingredients)))),
+        batch_size=BATCH_SIZE
+    )
+    return recipes
+
+
+def seed_relations(rng, model, users, population, per_user, field):
+    '''Подписки, избранное или корзина: per_user связей у каждого.'''
+    cum_weights = zipf_weights(len(population))
+    rows = [
+        (user_id, target)
+        for user_id in users
+        for target in weighted_sample(
+            rng, population, cum_weights, per_user,
+            exclude=user_id if field == 'following_id' else None
+        )
+    ]
+    user_field = 'user_id' if model is Follow else 'author_id'
+    model.objects.bulk_create(
+        (model(**{user_field: user_id, field: target})
+         for user_id, target in rows),
+        batch_size=BATCH_SIZE
+    )
+    return rows
+
+
+def seed_timelines(follows, recipes):
+    '''Ленты подписчиков, как после backfill_timelines.'''
+    latest = defaultdict(list)
+    for recipe_id, author_id, pub_date in reversed(recipes):
+        if len(latest[author_id]) < FEED_BACKFILL_SIZE:
+            latest[author_id].append((recipe_id, pub_date))
+    followers = defaultdict(int)
+    for _, author_id in follows:
+        followers[author_id] += 1
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                       pub_date=pub_date)
+         for user_id, author_id in follows
+         if followers[author_id] < FEED_FANOUT_LIMIT
+         for recipe_id, pub_date in latest[author_id]),
+        batch_size=BATCH_SIZE
+    )
+
+
+@transaction.atomic
+def seed(users=1000, recipes=20000, follows=20, favorites=30, carts=5,
+         ingredients_per_recipe=6, random_seed=0):
+    '''
+    Генерирует воспроизводимый набор данных: при одинаковых параметрах
+    и random_seed получаются одни и те же связи. Денормализованные
+    счётчики, ленты, рейтинги и поисковые индексы заполняются явно, так как
+    bulk_create не отправляет сигналов.
+    '''
+    rng = random.Random(random_seed)
+    clear_benchmark_data()
+    tags = seed_tags()
+    ingredients = seed_ingredients(rng)
+    user_ids = seed_users(users)
+    recipe_rows = seed_recipes(rng, user_ids, tags, ingredients, recipes,
+                               ingredients_per_recipe)
+    recipe_ids = [recipe_id for recipe_id, _, _ in recipe_rows]
+    follow_rows = seed_relations(rng, Follow, user_ids, user_ids, follows,
+                                 'following_id')
+    seed_relations(rng, Favorite, user_ids, recipe_ids, favorites,
+                   'recipe_id')
+    seed_relations(rng, Cart, user_ids, recipe_ids, carts, 'recipe_id')
+    seed_timelines(follow_rows, recipe_rows)
+    rebuild_recipe_counters()
+    rebuild_user_counters()
+    update_search_vectors(Recipe.objects.filter(
+        author__username__startswith=BENCH_PREFIX
+    ).values('pk'))
+    update_rankings()
+    bump_version(Recipe, Tag, Ingredient, User, Favorite)
+    return dataset_summary()
+
+
+def dataset_summary():
+    '''Размер набора данных для отчёта.'''
+    return {
+        model._meta.model_name: model.objects.count()
+        for model in (User, Recipe, Ingredient, Follow, Favorite, Cart,
+                      TimelineEntry)
+    }
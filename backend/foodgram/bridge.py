@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+
+_executor = None
+END_OF_STREAM = object()
+
+
+def get_executor():
+    '''Пул потоков моста, создаётся при первом запросе.'''
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.ASYNC_DB_THREADS,
+            thread_name_prefix='db-bridge'
+        )
+    return _executor
+
+
+def run_in_db_thread(func, *args, **kwargs):
+    '''
+    Выполняет синхронный код с доступом к БД в пуле потоков моста.
+    Одновременно работает не больше ASYNC_DB_THREADS вызовов,
+    остальные ждут, не блокируя цикл событий. Соединения с БД
+    проверяются так же, как в начале и конце обычного запроса.
+    '''
+    def call():
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return SyncToAsync(
+        call, thread_sensitive=False, executor=get_executor()
+    )()
+
+
+class BridgedASGIHandler(ASGIHandler):
+    '''
+    ASGI-приложение: приём запроса и отправка ответа идут в цикле
+    событий, поэтому медленные клиенты не занимают потоки, а сама
+    обработка — синхронные middleware и представления — целиком
+    выполняется одним вызовом в пуле моста.
+    '''
+
+    def load_middleware(self, is_async=False):
+        super().load_middleware(is_async=False)
+
+    async def get_response_async(self, request):
+        return await run_in_db_thread(self.get_response, request)
+
+    @staticmethod
+    def response_headers(response):
+        headers = [
+            (header.encode('ascii') if isinstance(header, str) else header,
+             value.encode('latin1') if isinstance(value, str) else value)
+            for header, value in response.items()
+        ]
+        headers += [
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values()
+        ]
+        return headers
+
+    async def send_response(self, response, send):
+        '''
+        Потоковый ответ перебирается по одной части в потоке моста:
+        Django 3.2 перебирает его в цикле событий, где обращения к БД
+        запрещены, а собирать его целиком значило бы держать в памяти
+        весь файл. Остальные ответы отправляются как обычно.
+        '''
+        if not response.streaming:
+            await super().send_response(response, send)
+            return
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': self.response_headers(response),
+        })
+        parts = iter(response)
+        try:
+            while True:
+                part = await run_in_db_thread(next, parts, END_OF_STREAM)
+                if part is END_OF_STREAM:
+                    break
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            await send({'type': 'http.response.body'})
+        finally:
+            await run_in_db_thread(response.close)
@@ -0,0 +1,208 @@
+import pickle
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+MISSING = object()
+
+
+class RedisCache(BaseCache):
+    '''
+    Кэш на Redis или совместимом сервере (в Django 3.2 своего нет).
+    Клиент создаётся через from_url класса OPTIONS['CLIENT_CLASS'],
+    по умолчанию redis.Redis; для локальной проверки подходит
+    fakeredis.FakeRedis.
+    '''
+
+    def __init__(self, server, params):
+        super().__init__(params)
+        self._server = server
+        self._options = params.get('OPTIONS', {})
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            client_class = import_string(
+                self._options.get('CLIENT_CLASS', 'redis.Redis')
+            )
+            self._client = client_class.from_url(self._server)
+        return self._client
+
+    def _key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _timeout(self, timeout):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return None if timeout is None else max(int(timeout), 0)
+
+    @staticmethod
+    def _dump(value):
+        # Целые числа храним как есть, чтобы работал атомарный INCRBY.
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _load(value):
+        try:
+            return int(value)
+        except ValueError:
+            return pickle.loads(value)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        if timeout == 0:
+            return False
+        return bool(self.client.set(
+            self._key(key, version), self._dump(value), ex=timeout, nx=True
+        ))
+
+    def get(self, key, default=None, version=None):
+        value = self.client.get(self._key(key, version))
+        return default if value is None else self._load(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key, timeout = self._key(key, version), self._timeout(timeout)
+        if timeout == 0:
+            self.client.delete(key)
+        else:
+            self.client.set(key, self._dump(value), ex=timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key, timeout = self._key(key, version), self._timeout(timeout)
+        if timeout is None:
+            return bool(self.client.persist(key))
+        return bool(self.client.expire(key, timeout))
+
+    def delete(self, key, version=None):
+        return bool(self.client.delete(self._key(key, version)))
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.client.mget(
+            [self._key(key, version) for key in keys]
+        )
+        return {
+            key: self._load(value)
+            for key, value in zip(keys, values) if value is not None
+        }
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        pipeline = self.client.pipeline()
+        for key, value in data.items():
+            key = self._key(key, version)
+            if timeout == 0:
+                pipeline.delete(key)
+            else:
+                pipeline.set(key, self._dump(value), ex=timeout)
+        pipeline.execute()
+        return []
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if keys:
+            self.client.delete(*keys)
+
+    def has_key(self, key, version=None):
+        return bool(self.client.exists(self._key(key, version)))
+
+    def incr(self, key, delta=1, version=None):
+        '''
+        INCRBY только существующего ключа. Проверка и увеличение идут
+        в транзакции под WATCH: если ключ удалили или изменили между
+        ними, транзакция повторяется, и ни одно увеличение не теряется.
+        '''
+        key = self._key(key, version)
+
+        def increment(pipeline):
+            if not pipeline.exists(key):
+                raise ValueError(f"Key '{key}' not found")
+            pipeline.multi()
+            pipeline.incrby(key, delta)
+
+        return self.client.transaction(increment, key)[0]
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.make_key('*')))
+        if keys:
+            self.client.delete(*keys)
+
+    def close(self, **kwargs):
+        pass
+
+
+_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_stats_lock = threading.Lock()
+
+
+class CacheRegion:
+    '''Кэш именованного региона со счётчиками попаданий и промахов.'''
+
+    def __init__(self, name):
+        self.name = name
+        self.cache = caches[name]
+
+    def __getattr__(self, attr):
+        return getattr(self.cache, attr)
+
+    def record(self, hits, misses):
+        with _stats_lock:
+            stats = _stats[self.name]
+            stats['hits'] += hits
+            stats['misses'] += misses
+
+    def get(self, key, default=None, version=None):
+        value = self.cache.get(key, MISSING, version=version)
+        if value is MISSING:
+            self.record(0, 1)
+            return default
+        self.record(1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = self.cache.get_many(keys, version=version)
+        self.record(len(values), len(keys) - len(values))
+        return values
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT,
+                   version=None):
+        value = self.get(key, MISSING, version=version)
+        if value is MISSING:
+            value = default() if callable(default) else default
+            if value is not None:
+                self.cache.add(key, value, timeout=timeout, version=version)
+                return self.cache.get(key, value, version=version)
+        return value
+
+
+def get_region(name='default'):
+    return CacheRegion(name)
+
+
+def region_stats():
+    '''Счётчики регионов текущего процесса вместе с их настройками.'''
+    with _stats_lock:
+        snapshot = {name: dict(stats) for name, stats in _stats.items()}
+    result = {}
+    for name, config in settings.CACHES.items():
+        stats = snapshot.get(name, {'hits': 0, 'misses': 0})
+        total = stats['hits'] + stats['misses']
+        result[name] = {
+            **stats,
+            'hit_rate': round(stats['hits'] / total, 4) if total else None,
+            'timeout': config.get('TIMEOUT'),
+            'max_entries': config.get('OPTIONS', {}).get('MAX_ENTRIES'),
+        }
+    return result
@@ -0,0 +1,149 @@
+import hashlib
+import logging
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from foodgram.cache import get_region
+
+logger = logging.getLogger('foodgram.db')
+
+PRIMARY = 'default'
+PIN_CACHE_KEY = 'db_pin:{client}'
+
+# Отставание реплики в секундах: у реплики PostgreSQL,
+# догнавшей поток WAL, отставание считается нулевым.
+LAG_QUERIES = {
+    'postgresql': (
+        'SELECT CASE WHEN NOT pg_is_in_recovery() '
+        'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+        'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) '
+        'END'
+    ),
+    'sqlite': 'SELECT 0',
+}
+
+# Модели, которые всегда читаются с основной базы: удалённый при выходе
+# токен или сессия не должны оставаться действующими на отстающей реплике.
+PRIMARY_MODELS = {'authtoken.token', 'sessions.session'}
+
+# Реплика, выбранная для текущего запроса; None — читать с основной базы.
+_read_alias = ContextVar('read_alias', default=None)
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != PRIMARY]
+
+
+def replica_lag(alias):
+    '''Отставание реплики в секундах; None, если реплика недоступна.'''
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(LAG_QUERIES.get(connection.vendor, 'SELECT 0'))
+            lag = cursor.fetchone()[0]
+    except DatabaseError as error:
+        logger.warning('Replica %s is unavailable: %s', alias, error)
+        connection.close()
+        return None
+    return float(lag or 0)
+
+
+def replica_is_healthy(alias):
+    '''
+    Реплика доступна и отстаёт не больше DB_REPLICA_MAX_LAG секунд.
+    Результат проверки живёт DB_REPLICA_CHECK_INTERVAL секунд в процессе.
+    '''
+    now = monotonic()
+    with _health_lock:
+        checked_at, healthy = _health.get(alias, (None, False))
+        if checked_at is not None and (
+            now - checked_at < settings.DB_REPLICA_CHECK_INTERVAL
+        ):
+            return healthy
+        # Пока идёт проверка, остальные потоки видят прежний результат.
+        _health[alias] = (now, healthy)
+    lag = replica_lag(alias)
+    healthy = lag is not None and lag <= settings.DB_REPLICA_MAX_LAG
+    if lag is not None and not healthy:
+        logger.warning('Replica %s lags %.1f s behind', alias, lag)
+    with _health_lock:
+        _health[alias] = (monotonic(), healthy)
+    return healthy
+
+
+def choose_replica():
+    '''Случайная исправная реплика или None, если исправных нет.'''
+    healthy = [alias for alias in replica_aliases()
+               if replica_is_healthy(alias)]
+    return random.choice(healthy) if healthy else None
+
+
+def client_key(request):
+    '''
+    Клиент определяется по заголовку Authorization или сессии
+    без обращения к базе; у анонимного клиента ключа нет.
+    '''
+    credentials = request.META.get('HTTP_AUTHORIZATION') or (
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials:
+        return None
+    return hashlib.sha256(credentials.encode()).hexdigest()
+
+
+def pin_to_primary(client):
+    '''После записи клиент читает с основной базы DB_REPLICA_PIN_SECONDS.'''
+    get_region().set(PIN_CACHE_KEY.format(client=client), 1,
+                     settings.DB_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(client):
+    return get_region().get(PIN_CACHE_KEY.format(client=client)) is not None
+
+
+def use_replica(alias):
+    '''Направляет чтения текущего контекста на реплику alias.'''
+    return _read_alias.set(alias)
+
+
+def reset_replica(token):
+    _read_alias.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    '''Чтения внутри блока идут на основную базу.'''
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    '''
+    Чтения безопасных запросов API идут на реплику, выбранную
+    ReplicaRoutingMiddleware; запись, изменяющие запросы, команды
+    и фоновые задачи работают с основной базой.
+    '''
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or model._meta.label_lower in PRIMARY_MODELS:
+            return PRIMARY
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
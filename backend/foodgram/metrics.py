@@ -0,0 +1,233 @@
+import json
+import logging
+import threading
+import traceback
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from time import perf_counter
+
+from django.conf import settings
+
+from foodgram.cache import region_stats
+
+logger = logging.getLogger('foodgram.requests')
+
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# На каком повторе одного и того же SQL запоминается место вызова.
+TRACE_ON_REPEAT = 2
+TRACE_DEPTH = 6
+# Кадры самой инструментации в стеках не показываются.
+SKIPPED_FRAMES = ('foodgram/middleware.py', 'foodgram/metrics.py')
+REPORTED_SITES = 5
+
+_metrics = defaultdict(lambda: {
+    'count': 0, 'duration': 0.0, 'db_duration': 0.0, 'queries': 0,
+    'render_duration': 0.0, 'serialize_duration': 0.0, 'flagged': 0,
+    'saved_queries': 0,
+    'buckets': [0] * len(DURATION_BUCKETS),
+})
+_metrics_lock = threading.Lock()
+
+
+def project_stack():
+    '''Последние кадры стека из кода проекта, без библиотек.'''
+    base_dir = str(settings.BASE_DIR)
+    frames = [
+        f'{frame.filename[len(base_dir) + 1:]}:{frame.lineno} {frame.name}'
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(base_dir)
+        and 'site-packages' not in frame.filename
+        and not frame.filename.endswith(SKIPPED_FRAMES)
+    ]
+    return frames[-TRACE_DEPTH:]
+
+
+class RequestMetrics:
+    '''
+    Счётчики одного запроса. Экземпляр подключается к соединениям
+    как execute_wrapper и считает запросы и время в БД; в выбранных
+    запросах запоминает место вызова повторяющихся SQL.
+    '''
+
+    def __init__(self, sample=False):
+        self.started = perf_counter()
+        self.view = None
+        self.queries = 0
+        self.db_duration = 0.0
+        self.render_duration = 0.0
+        self.serialize_duration = 0.0
+        self.serialize_depth = 0
+        # Запросы к БД, которых удалось избежать благодаря кэшам.
+        self.saved_queries = 0
+        self.sample = sample
+        self.statements = Counter()
+        self.sites = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_duration += perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+            if self.sample and self.statements[sql] == TRACE_ON_REPEAT:
+                self.sites[sql] = project_stack()
+
+    def add_render(self, started):
+        self.render_duration += perf_counter() - started
+
+    @contextmanager
+    def serialization(self):
+        '''
+        Учитывает время сериализации без запросов к БД внутри неё.
+        Вложенные сериализаторы входят во время внешнего.
+        '''
+        self.serialize_depth += 1
+        started, db_duration = perf_counter(), self.db_duration
+        try:
+            yield
+        finally:
+            self.serialize_depth -= 1
+            if not self.serialize_depth:
+                self.serialize_duration += (
+                    perf_counter() - started
+                    - (self.db_duration - db_duration)
+                )
+
+    @property
+    def duration(self):
+        return perf_counter() - self.started
+
+    def server_timing(self, duration):
+        '''Значение заголовка Server-Timing, длительности в мс.'''
+        app_duration = (duration - self.db_duration - self.render_duration
+                        - self.serialize_duration)
+        return ', '.join((
+            f'db;dur={self.db_duration * 1000:.1f};'
+            f'desc="{self.queries} queries"',
+            f'serialize;dur={self.serialize_duration * 1000:.1f}',
+            f'render;dur={self.render_duration * 1000:.1f}',
+            f'app;dur={app_duration * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ))
+
+    def repeated_sites(self):
+        '''Самые частые повторяющиеся SQL с местами вызова.'''
+        return [
+            {'count': count, 'sql': sql[:300],
+             'stack': self.sites.get(sql)}
+            for sql, count in self.statements.most_common(REPORTED_SITES)
+            if count > 1
+        ]
+
+
+def record(request_metrics, method, status, duration, path):
+    '''
+    Добавляет запрос в метрики процесса и пишет строку лога: DEBUG
+    для каждого запроса, WARNING для превысивших порог SQL-запросов.
+    '''
+    flagged = request_metrics.queries > settings.QUERY_COUNT_THRESHOLD
+    key = (request_metrics.view or 'unresolved', method)
+    with _metrics_lock:
+        metrics = _metrics[key]
+        metrics['count'] += 1
+        metrics['duration'] += duration
+        metrics['db_duration'] += request_metrics.db_duration
+        metrics['queries'] += request_metrics.queries
+        metrics['render_duration'] += request_metrics.render_duration
+        metrics['serialize_duration'] += request_metrics.serialize_duration
+        metrics['saved_queries'] += request_metrics.saved_queries
+        metrics['flagged'] += flagged
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                metrics['buckets'][index] += 1
+    line = {
+        'view': key[0], 'method': method, 'path': path, 'status': status,
+        'queries': request_metrics.queries,
+        'saved_queries': request_metrics.saved_queries,
+        'db_ms': round(request_metrics.db_duration * 1000, 2),
+        'serialize_ms': round(request_metrics.serialize_duration * 1000, 2),
+        'render_ms': round(request_metrics.render_duration * 1000, 2),
+        'total_ms': round(duration * 1000, 2),
+    }
+    if flagged:
+        line['repeated'] = request_metrics.repeated_sites()
+        logger.warning(json.dumps(line, ensure_ascii=False))
+    else:
+        logger.debug(json.dumps(line, ensure_ascii=False))
+
+
+def labels(**values):
+    return ','.join(f'{name}="{value}"' for name, value in values.items())
+
+
+def render_prometheus():
+    '''Метрики процесса в текстовом формате Prometheus.'''
+    with _metrics_lock:
+        snapshot = {
+            key: {**metrics, 'buckets': list(metrics['buckets'])}
+            for key, metrics in _metrics.items()
+        }
+    lines = []
+    for name, kind, help_text in (
+        ('foodgram_requests_total', 'counter', 'Requests by view'),
+        ('foodgram_request_duration_seconds', 'histogram',
+         'Total request time'),
+        ('foodgram_db_queries_total', 'counter', 'SQL queries'),
+        ('foodgram_db_queries_saved_total', 'counter',
+         'SQL queries avoided by caches'),
+        ('foodgram_db_duration_seconds_total', 'counter', 'Time in SQL'),
+        ('foodgram_serialize_duration_seconds_total', 'counter',
+         'Serializer time without SQL'),
+        ('foodgram_render_duration_seconds_total', 'counter',
+         'Response rendering time'),
+        ('foodgram_query_threshold_exceeded_total', 'counter',
+         'Requests over QUERY_COUNT_THRESHOLD queries'),
+    ):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (view, method), metrics in sorted(snapshot.items()):
+            lines.extend(metric_lines(name, labels(view=view, method=method),
+                                      metrics))
+    lines.extend(cache_lines())
+    return '\n'.join(lines) + '\n'
+
+
+def metric_lines(name, view_labels, metrics):
+    if name == 'foodgram_request_duration_seconds':
+        lines = [
+            f'{name}_bucket{{{view_labels},le="{bound}"}} {count}'
+            for bound, count in zip(DURATION_BUCKETS, metrics['buckets'])
+        ]
+        return lines + [
+            f'{name}_bucket{{{view_labels},le="+Inf"}} {metrics["count"]}',
+            f'{name}_sum{{{view_labels}}} {metrics["duration"]:.6f}',
+            f'{name}_count{{{view_labels}}} {metrics["count"]}',
+        ]
+    value = {
+        'foodgram_requests_total': metrics['count'],
+        'foodgram_db_queries_total': metrics['queries'],
+        'foodgram_db_queries_saved_total': metrics['saved_queries'],
+        'foodgram_db_duration_seconds_total': metrics['db_duration'],
+        'foodgram_serialize_duration_seconds_total':
+            metrics['serialize_duration'],
+        'foodgram_render_duration_seconds_total':
+            metrics['render_duration'],
+        'foodgram_query_threshold_exceeded_total': metrics['flagged'],
+    }[name]
+    return [f'{name}{{{view_labels}}} {value}']
+
+
+def cache_lines():
+    lines = []
+    stats = region_stats()
+    for name in ('hits', 'misses'):
+        metric = f'foodgram_cache_{name}_total'
+        lines.append(f'# HELP {metric} Cache {name} by region')
+        lines.append(f'# TYPE {metric} counter')
+        lines.extend(
+            f'{metric}{{{labels(region=region)}}} {values[name]}'
+            for region, values in sorted(stats.items())
+        )
+    return lines
@@ -0,0 +1,164 @@
+import random
+from contextlib import ExitStack
+from time import monotonic, perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from foodgram.db_router import (choose_replica, client_key, is_pinned,
+                                pin_to_primary, replica_aliases, reset_replica,
+                                use_replica)
+from foodgram.metrics import RequestMetrics, record
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def view_name(view_func, method):
+    '''Имя представления с действием ViewSet, например RecipeViewSet.list.'''
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    action = (getattr(view_func, 'actions', None) or {}).get(method.lower())
+    return f'{view_class.__name__}.{action or method.lower()}'
+
+
+class ConnectionHealthMiddleware:
+    '''
+    Проверка постоянных соединений с БД (CONN_MAX_AGE > 0):
+    соединение, простоявшее без запросов дольше DB_HEALTH_CHECK_INTERVAL,
+    проверяется перед запросом и закрывается, если сервер его разорвал,
+    чтобы представление открыло новое, а не получило ошибку.
+    '''
+
+    def __init__(self, get_response):
+        if not any(connections[alias].settings_dict['CONN_MAX_AGE']
+                   for alias in connections):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        now = monotonic()
+        for connection in connections.all():
+            if connection.connection is None:
+                continue
+            idle = now - getattr(connection, 'last_used_at', now)
+            if idle > settings.DB_HEALTH_CHECK_INTERVAL and (
+                not connection.is_usable()
+            ):
+                connection.close()
+        try:
+            return self.get_response(request)
+        finally:
+            now = monotonic()
+            for connection in connections.all():
+                connection.last_used_at = now
+
+
+class QueryMetricsMiddleware:
+    '''
+    Число SQL-запросов, время в БД, сериализации, рендеринга ответа
+    и общее время каждого запроса. Значения попадают в метрики процесса
+    (/api/metrics/), строку лога foodgram.requests и, при
+    SERVER_TIMING_HEADER, в заголовок Server-Timing. Запросы, сделавшие
+    больше QUERY_COUNT_THRESHOLD SQL-запросов, логируются с местами
+    вызова повторяющихся SQL. Потоковые ответы учитываются целиком:
+    метрики записываются при закрытии потока.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_metrics = request.query_metrics = RequestMetrics(
+            sample=random.random() < settings.QUERY_TRACE_SAMPLE_RATE
+        )
+        with self.instrumented(request_metrics):
+            response = self.get_response(request)
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = request_metrics.server_timing(
+                request_metrics.duration
+            )
+        if response.streaming:
+            response.streaming_content = self.measured_stream(
+                iter(response.streaming_content), request, response,
+                request_metrics
+            )
+        else:
+            self.finish(request, response, request_metrics)
+        return response
+
+    @staticmethod
+    def instrumented(request_metrics):
+        '''Подключает счётчики к соединениям текущего потока.'''
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(
+                connections[alias].execute_wrapper(request_metrics)
+            )
+        return stack
+
+    @staticmethod
+    def finish(request, response, request_metrics):
+        record(request_metrics, request.method, response.status_code,
+               request_metrics.duration, request.path)
+
+    def measured_stream(self, parts, request, response, request_metrics):
+        '''
+        Части потокового ответа с подсчётом SQL-запросов, сделанных при
+        их генерации. Части могут запрашиваться из разных потоков
+        (ASGI-мост), поэтому счётчики подключаются на каждую часть.
+        '''
+        try:
+            while True:
+                with self.instrumented(request_metrics):
+                    part = next(parts, None)
+                if part is None:
+                    return
+                yield part
+        finally:
+            self.finish(request, response, request_metrics)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_metrics.view = view_name(view_func, request.method)
+
+    def process_template_response(self, request, response):
+        started = perf_counter()
+        response.add_post_render_callback(
+            lambda response: request.query_metrics.add_render(started)
+        )
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    '''
+    Чтения безопасных запросов к API идут на исправную реплику.
+    После успешного изменяющего запроса клиент на время
+    DB_REPLICA_PIN_SECONDS закрепляется за основной базой,
+    чтобы сразу видеть свои изменения.
+    '''
+
+    def __init__(self, get_response):
+        if not replica_aliases():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        client = client_key(request)
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            if client and response.status_code < 400:
+                pin_to_primary(client)
+            return response
+        alias = None
+        if request.path.startswith(settings.DB_REPLICA_PATH_PREFIX) and not (
+            client and is_pinned(client)
+        ):
+            alias = choose_replica()
+        if alias is None:
+            return self.get_response(request)
+        token = use_replica(alias)
+        try:
+            return self.get_response(request)
+        finally:
+            reset_replica(token)
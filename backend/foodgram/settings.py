@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -20,9 +21,11 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'api',
     'users',
     'recipes',
+    'benchmarks',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -31,6 +34,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.middleware.ConnectionHealthMiddleware',
+    'foodgram.middleware.QueryMetricsMiddleware',
+    'foodgram.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,15 +66,133 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
-DATABASES = {
-    'default': {
+# postgresql или sqlite3 (для локальной проверки, в том числе реплик).
+DB_ENGINE = os.getenv('DB_ENGINE', 'postgresql')
+
+# Сколько секунд соединение с БД живёт между запросами; 0 — закрывать
+# после каждого запроса. В режиме asgi соединения держат потоки моста,
+# поэтому их не больше ASYNC_DB_THREADS на воркер.
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+
+# Соединение, простоявшее дольше (в секундах), проверяется перед запросом.
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv('DB_HEALTH_CHECK_INTERVAL', 10))
+
+# Подключение через PgBouncer в режиме пула transaction.
+DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', 'false') == 'true'
+
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 5))
+
+
+def database_settings(replica=None):
+    '''
+    Настройки подключения к основной базе или к реплике:
+    для PostgreSQL реплика задаётся как host[:port], для SQLite — путём.
+    '''
+    if DB_ENGINE == 'sqlite3':
+        return {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': replica or os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        }
+    host, _, port = (replica or '').partition(':')
+    return {
         'ENGINE': 'django.db.backends.postgresql',
         'NAME': os.getenv('POSTGRES_DB', 'foodgram'),
         'USER': os.getenv('POSTGRES_USER', 'foodgram_user'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'foodgram_password'),
-        'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'HOST': host or os.getenv('DB_HOST', ''),
+        'PORT': port or os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        # PgBouncer в режиме transaction не сохраняет курсоры
+        # между транзакциями, поэтому iterator() читает без них.
+        'DISABLE_SERVER_SIDE_CURSORS': DB_PGBOUNCER,
+        'OPTIONS': {'connect_timeout': DB_CONNECT_TIMEOUT},
+    }
+
+
+DB_REPLICAS = [
+    replica.strip() for replica in os.getenv('DB_REPLICAS', '').split(',')
+    if replica.strip()
+]
+
+DATABASES = {
+    'default': database_settings(),
+    **{
+        f'replica_{number}': {
+            **database_settings(replica),
+            'TEST': {'MIRROR': 'default'},
+        }
+        for number, replica in enumerate(DB_REPLICAS, 1)
+    },
+}
+
+DATABASE_ROUTERS = ['foodgram.db_router.ReplicaRouter'] if DB_REPLICAS else []
+
+# Реплика с большим отставанием (в секундах) исключается из чтения.
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 2))
+
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5))
+
+# Сколько секунд после записи клиент читает с основной базы.
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 5))
+
+DB_REPLICA_PATH_PREFIX = '/api/'
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'foodgram.cache.RedisCache',
+}
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+
+CACHE_LOCATION = os.getenv('CACHE_LOCATION', '')
+
+GUNICORN_WORKERS = int(os.getenv('GUNICORN_WORKERS', 1))
+
+# Версии моделей для ETag, закрепление клиента за основной базой и сброс
+# токенов хранятся в кэше. У locmem он свой в каждом процессе: изменение
+# в одном воркере не видно другим, и они отдают устаревшие данные.
+if CACHE_BACKEND == 'locmem' and GUNICORN_WORKERS > 1:
+    raise ImproperlyConfigured(
+        'При GUNICORN_WORKERS > 1 нужен общий кэш: '
+        'CACHE_BACKEND=file или CACHE_BACKEND=redis.'
+    )
+
+# Регионы кэша: (TIMEOUT в секундах, MAX_ENTRIES для locmem/file).
+# У Redis размер ограничивается настройкой maxmemory сервера.
+CACHE_REGIONS = {
+    'default': (60 * 60 * 24, 10000),
+    'ingredients': (60 * 60, 1000),
+    'tags': (60 * 60, 100),
+    'recipe_cards': (60 * 10, 20000),
+    'user_flags': (60 * 30, 50000),
+    'auth_tokens': (60, 10000),
+}
+
+
+def cache_location(region):
+    if CACHE_BACKEND == 'redis':
+        return CACHE_LOCATION or 'redis://localhost:6379/0'
+    if CACHE_BACKEND == 'file':
+        return os.path.join(CACHE_LOCATION or '/tmp/foodgram_cache', region)
+    return f'{CACHE_LOCATION or "foodgram"}-{region}'
+
+
+CACHES = {
+    region: {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': cache_location(region),
+        'KEY_PREFIX': region,
+        'TIMEOUT': int(os.getenv(f'CACHE_{region.upper()}_TIMEOUT', timeout)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(
+                os.getenv(f'CACHE_{region.upper()}_MAX_ENTRIES', max_entries)
+            ),
+            'CLIENT_CLASS': os.getenv('CACHE_CLIENT_CLASS', 'redis.Redis'),
+        },
     }
+    for region, (timeout, max_entries) in CACHE_REGIONS.items()
 }
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -106,7 +230,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'SEARCH_PARAM': 'name',
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.LimitPagination',
@@ -136,3 +260,54 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = '/app/media/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Наибольший размер изображения рецепта в байтах. По умолчанию 15 МБ:
+# столько помещается в base64 в тело запроса 20M, принимаемое nginx.
+IMAGE_MAX_SIZE = int(os.getenv('IMAGE_MAX_SIZE', 15 * 1024 * 1024))
+
+# Потоков для построения копий изображений; 0 — строить сразу после коммита.
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+# Потоков для раскладки лент подписчиков, когда автор перестаёт быть
+# популярным; 0 — раскладывать сразу после коммита.
+FEED_WORKERS = int(os.getenv('FEED_WORKERS', 1))
+
+# TTF-шрифт с кириллицей для списка покупок в PDF.
+PDF_FONT_PATH = os.getenv(
+    'PDF_FONT_PATH', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Потоков, в которых ASGI-воркер обрабатывает запросы (мост к БД).
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', 8))
+
+# Запросы, сделавшие больше SQL-запросов, логируются как предупреждения.
+QUERY_COUNT_THRESHOLD = int(os.getenv('QUERY_COUNT_THRESHOLD', 20))
+
+# Доля запросов, в которых запоминаются места вызова повторяющихся SQL.
+QUERY_TRACE_SAMPLE_RATE = float(os.getenv('QUERY_TRACE_SAMPLE_RATE', 0.1))
+
+# Заголовок Server-Timing раскрывает время в БД и число SQL-запросов,
+# поэтому по умолчанию включён только при DEBUG.
+SERVER_TIMING_HEADER = os.getenv(
+    'SERVER_TIMING_HEADER', str(DEBUG).lower()
+) == 'true'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'foodgram.requests': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+        'foodgram.db': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,12 @@
+import os
+
+bind = '0.0.0.0:8888'
+
+# Больше одного воркера требует общего кэша (см. settings.CACHE_BACKEND).
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+
+if os.getenv('SERVER_MODE', 'wsgi') == 'asgi':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'foodgram.wsgi:application'
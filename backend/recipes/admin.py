@@ -1,8 +1,28 @@
 from django.contrib import admin
 
 from .constans import EMPTY_VALUE, MIN_NUM
+from .images import schedule_variants
 from .models import (Cart, Favorite, Follow, Ingredient, IngredientRecipe,
                      Recipe, Tag)
+from .signals import recipe_ingredients_changed
+
+
+class IngredientRecipeAdminMixin:
+    '''Сообщает об изменении ингредиентов рецептов из инлайнов.'''
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        recipe_ids = {
+            row.recipe_id
+            for formset in formsets
+            if formset.model is IngredientRecipe
+            for row in (formset.new_objects + formset.deleted_objects
+                        + [obj for obj, _ in formset.changed_objects])
+        }
+        if recipe_ids:
+            recipe_ingredients_changed.send(
+                sender=Recipe, recipe_ids=recipe_ids
+            )
 
 
 class IngredientRecipeInline(admin.TabularInline):
@@ -34,18 +54,20 @@ class TagAdmin(admin.ModelAdmin):
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(IngredientRecipeAdminMixin, admin.ModelAdmin):
     inlines = (IngredientRecipeInline, RecipeTagInLine)
     list_display = ('id', 'name', 'text', 'pub_date',
                     'author', 'cooking_time', 'display_tags',
                     'favorites_count', 'display_ingredients')
     search_fields = ('name', 'author__username')
     list_filter = ('name', 'author', 'tags')
+    readonly_fields = ('favorites_count', 'carts_count')
     empty_value_display = EMPTY_VALUE
 
-    @admin.display(description='Количество добавлений в избранное')
-    def favorites_count(self, obj):
-        return obj.favorites.count()
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            schedule_variants(obj)
 
     @admin.display(description='Теги')
     def display_tags(self, recipe):
@@ -58,7 +80,7 @@ class RecipeAdmin(admin.ModelAdmin):
 
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(IngredientRecipeAdminMixin, admin.ModelAdmin):
     inlines = (IngredientRecipeInline,)
     list_display = ('id', 'name', 'measurement_unit')
     search_fields = ('name',)
@@ -68,7 +90,7 @@ class IngredientAdmin(admin.ModelAdmin):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ('id', 'author', 'recipe')
+    list_display = ('id', 'author', 'recipe', 'multiplier', 'added_at')
     list_filter = ('author', 'recipe')
     search_fields = ('author', 'recipe')
     empty_value_display = EMPTY_VALUE
@@ -76,7 +98,7 @@ class CartAdmin(admin.ModelAdmin):
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
-    list_display = ('id', 'author', 'recipe')
+    list_display = ('id', 'author', 'recipe', 'added_at')
     list_filter = ('author', 'recipe')
     search_fields = ('author',)
     empty_value_display = EMPTY_VALUE
@@ -0,0 +1,73 @@
+from django.db import transaction
+
+from .models import Cart, Favorite, Follow
+from .signals import bulk_deleted, relations_bulk_changed
+
+# Модель связи -> (поле владельца, поле цели).
+RELATIONS = {
+    Favorite: ('author', 'recipe'),
+    Cart: ('author', 'recipe'),
+    Follow: ('user', 'following'),
+}
+
+
+def linked_ids(model, user, target_ids):
+    owner, target = RELATIONS[model]
+    return set(model.objects.filter(
+        **{owner: user, f'{target}__in': target_ids}
+    ).values_list(f'{target}_id', flat=True))
+
+
+@transaction.atomic
+def bulk_add(model, user, target_ids):
+    '''
+    Добавляет связи пользователя с рецептами или авторами одним
+    INSERT ... ON CONFLICT DO NOTHING. Возвращает словарь
+    {id: added | exists | not_found | self}.
+    '''
+    owner, target = RELATIONS[model]
+    target_model = model._meta.get_field(target).related_model
+    target_ids = list(dict.fromkeys(target_ids))
+    found = set(target_model.objects.filter(
+        pk__in=target_ids
+    ).values_list('pk', flat=True))
+    linked = linked_ids(model, user, target_ids)
+    results, added = {}, []
+    for target_id in target_ids:
+        if target_id not in found:
+            results[target_id] = 'not_found'
+        elif model is Follow and target_id == user.id:
+            results[target_id] = 'self'
+        elif target_id in linked:
+            results[target_id] = 'exists'
+        else:
+            results[target_id] = 'added'
+            added.append(target_id)
+    if added:
+        model.objects.bulk_create(
+            (model(**{owner: user, f'{target}_id': target_id})
+             for target_id in added),
+            ignore_conflicts=True
+        )
+        relations_bulk_changed.send(sender=model, user_id=user.id,
+                                    target_ids=added, added=True)
+    return results
+
+
+@transaction.atomic
+def bulk_remove(model, user, target_ids):
+    '''
+    Удаляет связи одним QuerySet.delete(); счётчики, флаги и версии
+    обновляются один раз по id действительно удалённых строк.
+    Возвращает словарь {id: removed | absent}.
+    '''
+    owner, target = RELATIONS[model]
+    target_ids = list(dict.fromkeys(target_ids))
+    with bulk_deleted(model, user.id, f'{target}_id') as removed:
+        model.objects.filter(
+            **{owner: user, f'{target}__in': target_ids}
+        ).delete()
+    return {
+        target_id: 'removed' if target_id in removed else 'absent'
+        for target_id in target_ids
+    }
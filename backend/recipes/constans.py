@@ -1,3 +1,6 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
 MIN_NUM = 1
 EMPTY_VALUE = '-пусто-'
 MAX_LENGTH = 200
@@ -6,3 +9,41 @@ HEX_LENGTH = 7
 INGREDIENT_NAME_LEN = 64
 MEASURE_UNIT_LEN = 20
 USER_MAX_LENGTH = 150
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+INGREDIENT_SEARCH_LIMIT = 20
+RECIPE_SEARCH_LIMIT = 100
+FEED_FANOUT_LIMIT = 1000
+FEED_BACKFILL_SIZE = 50
+IMAGE_MAX_PIXELS = 4096 * 4096
+IMAGE_FORMATS = ('jpeg', 'jpg', 'png', 'webp', 'gif')
+IMAGE_VARIANTS = {'small': 240, 'medium': 640, 'large': 1280}
+IMAGE_WEBP_QUALITY = 80
+BASE64_CHUNK_SIZE = 64 * 1024
+USER_FLAGS_FILTER_MAX_IDS = 1000
+BULK_MAX_IDS = 100
+CART_MULTIPLIER_MIN = Decimal('0.25')
+CART_MULTIPLIER_MAX = Decimal('50')
+# Единица -> (базовая единица, множитель): количества в единицах
+# одной величины складываются в базовой единице.
+UNIT_CONVERSIONS = {
+    'г': ('г', 1),
+    'кг': ('г', 1000),
+    'мл': ('мл', 1),
+    'л': ('мл', 1000),
+    'ч. л.': ('мл', 5),
+    'ст. л.': ('мл', 15),
+    'стакан': ('мл', 200),
+    'капля': ('мл', 0.05),
+}
+# Базовая единица -> (более крупная единица, во сколько раз больше).
+UNIT_UPSCALE = {'г': ('кг', 1000), 'мл': ('л', 1000)}
+# Популярность: веса добавления в избранное и в корзину, период
+# полураспада для популярности «сейчас» и точка отсчёта её шкалы.
+RANKING_FAVORITE_WEIGHT = 1
+RANKING_CART_WEIGHT = 0.5
+RANKING_HALF_LIFE = timedelta(days=7)
+RANKING_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+# Рецепты, чья популярность упала более чем в 2 ** N раз, не участвуют
+# в популярности тэгов.
+RANKING_TAG_WINDOW_HALF_LIVES = 8
+RANKING_BATCH_SIZE = 1000
@@ -0,0 +1,37 @@
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Cart, Favorite, Follow, Recipe, User
+
+
+def count_related(model, field):
+    '''Подзапрос с количеством строк model, ссылающихся на объект.'''
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+def rebuild_recipe_counters(recipes=None):
+    '''Пересчитывает счётчики избранного и корзины у рецептов.'''
+    queryset = Recipe.objects.all()
+    if recipes is not None:
+        queryset = queryset.filter(pk__in=recipes)
+    return queryset.update(
+        favorites_count=count_related(Favorite, 'recipe'),
+        carts_count=count_related(Cart, 'recipe'),
+    )
+
+
+def rebuild_user_counters(users=None):
+    '''Пересчитывает счётчики рецептов и подписчиков у пользователей.'''
+    queryset = User.objects.all()
+    if users is not None:
+        queryset = queryset.filter(pk__in=users)
+    return queryset.update(
+        recipes_count=count_related(Recipe, 'author'),
+        followers_count=count_related(Follow, 'following'),
+    )
@@ -0,0 +1,225 @@
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from .constans import FEED_BACKFILL_SIZE, FEED_FANOUT_LIMIT
+from .models import Follow, Recipe, TimelineEntry, User
+
+LATEST_RECIPES_SQL = '''
+SELECT {columns} FROM (
+    SELECT {columns}, ROW_NUMBER() OVER (
+        PARTITION BY author_id ORDER BY pub_date DESC, id DESC
+    ) AS position
+    FROM {table}
+    WHERE author_id IN ({authors})
+) AS ranked
+WHERE position <= %s
+ORDER BY author_id, position
+'''
+SHORT_RECIPE_FIELDS = ('id', 'author_id', 'name', 'image', 'image_variants',
+                       'cooking_time')
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def latest_recipes_by_author(author_ids, limit=None,
+                             fields=SHORT_RECIPE_FIELDS):
+    '''
+    Последние рецепты авторов одним запросом: не больше limit
+    на автора (ROW_NUMBER() OVER (PARTITION BY author_id)).
+    Возвращает словарь {id автора: [рецепты]}.
+    '''
+    recipes = defaultdict(list)
+    author_ids = list(author_ids)
+    if not author_ids:
+        return recipes
+    if limit is None:
+        queryset = Recipe.objects.filter(
+            author__in=author_ids
+        ).only(*fields).order_by('-pub_date', '-id')
+    else:
+        queryset = Recipe.objects.raw(
+            LATEST_RECIPES_SQL.format(
+                columns=', '.join(fields),
+                table=Recipe._meta.db_table,
+                authors=', '.join(['%s'] * len(author_ids)),
+            ),
+            (*author_ids, limit)
+        )
+    for recipe in queryset:
+        recipes[recipe.author_id].append(recipe)
+    return recipes
+
+
+def after_position(position, date_field, id_field):
+    '''Условие «раньше позиции» для порядка (-pub_date, -id).'''
+    if position is None:
+        return Q()
+    pub_date, pk = position
+    return Q(**{f'{date_field}__lt': pub_date}) | Q(
+        **{date_field: pub_date, f'{id_field}__lt': pk}
+    )
+
+
+def popular_authors(author_ids):
+    '''Авторы, чьи рецепты не раскладываются по лентам подписчиков.'''
+    return set(User.objects.filter(
+        pk__in=author_ids, followers_count__gte=FEED_FANOUT_LIMIT
+    ).values_list('pk', flat=True))
+
+
+def popular_followed_authors(user):
+    '''Авторы с лентой «на чтение»: их рецепты не раскладываются.'''
+    return list(Follow.objects.filter(
+        user=user, following__followers_count__gte=FEED_FANOUT_LIMIT
+    ).values_list('following_id', flat=True))
+
+
+def feed_positions(user, position, limit):
+    '''
+    Ключи (pub_date, id) рецептов ленты после позиции.
+    Обычные авторы читаются из TimelineEntry пользователя, популярные —
+    прямо из Recipe; оба запроса идут по индексам и ограничены limit.
+    '''
+    rows = set(TimelineEntry.objects.filter(
+        after_position(position, 'pub_date', 'recipe_id'), user=user
+    ).order_by('-pub_date', '-recipe_id').values_list(
+        'pub_date', 'recipe_id'
+    )[:limit])
+    popular = popular_followed_authors(user)
+    if popular:
+        rows.update(Recipe.objects.filter(
+            after_position(position, 'pub_date', 'id'), author__in=popular
+        ).order_by('-pub_date', '-id').values_list('pub_date', 'id')[:limit])
+    return sorted(rows, reverse=True)[:limit]
+
+
+def fan_out_recipe(recipe):
+    '''Раскладывает новый рецепт по лентам подписчиков автора.'''
+    followers = list(Follow.objects.filter(
+        following=recipe.author_id
+    ).values_list('user_id', flat=True)[:FEED_FANOUT_LIMIT])
+    if len(followers) >= FEED_FANOUT_LIMIT:
+        return
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, recipe=recipe,
+                       pub_date=recipe.pub_date)
+         for user_id in followers),
+        ignore_conflicts=True
+    )
+
+
+def backfill_timeline(user_id, author_id, size=FEED_BACKFILL_SIZE):
+    '''Добавляет в ленту последние рецепты автора после подписки.'''
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                       pub_date=pub_date)
+         for recipe_id, pub_date in Recipe.objects.filter(
+             author=author_id
+        ).order_by('-pub_date', '-id').values_list('id', 'pub_date')[:size]),
+        ignore_conflicts=True
+    )
+
+
+def backfill_timelines(user_id, author_ids, size=FEED_BACKFILL_SIZE):
+    '''Последние рецепты сразу нескольких авторов в ленту одним запросом.'''
+    recipes = latest_recipes_by_author(
+        author_ids, size, fields=('id', 'author_id', 'pub_date')
+    )
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, recipe_id=recipe.id,
+                       pub_date=recipe.pub_date)
+         for author_recipes in recipes.values()
+         for recipe in author_recipes),
+        ignore_conflicts=True
+    )
+
+
+def backfill_followers(author_ids, size=FEED_BACKFILL_SIZE):
+    '''
+    Авторы стали непопулярными: их рецепты больше не дочитываются
+    из Recipe при чтении ленты, поэтому последние size рецептов
+    раскладываются по лентам всех подписчиков, включая рецепты,
+    опубликованные без раскладки.
+    '''
+    recipes = latest_recipes_by_author(
+        author_ids, size, fields=('id', 'author_id', 'pub_date')
+    )
+    follows = Follow.objects.filter(
+        following__in=list(recipes)
+    ).values_list('user_id', 'following_id')
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, recipe_id=recipe.id,
+                       pub_date=recipe.pub_date)
+         for user_id, author_id in follows.iterator()
+         for recipe in recipes[author_id]),
+        batch_size=FEED_BACKFILL_SIZE * 20, ignore_conflicts=True
+    )
+
+
+def get_executor():
+    '''Пул потоков процесса для раскладки лент, создаётся при первой задаче.'''
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.FEED_WORKERS,
+            thread_name_prefix='feed-backfill'
+        )
+    return _executor
+
+
+def backfill_unpopular(author_ids):
+    '''
+    Раскладывает рецепты авторов, которые к началу задачи всё ещё
+    ниже FEED_FANOUT_LIMIT: за время ожидания в очереди на них
+    могли снова подписаться.
+    '''
+    author_ids = set(author_ids)
+    backfill_followers(author_ids - popular_authors(author_ids))
+
+
+def process_backfill(author_ids):
+    '''Задача пула: ошибки пишутся в лог, соединение с БД закрывается.'''
+    try:
+        backfill_unpopular(author_ids)
+    except Exception:
+        logger.exception('Не удалось разложить рецепты авторов %s',
+                         sorted(author_ids))
+    finally:
+        close_old_connections()
+
+
+def schedule_backfill(author_ids):
+    '''
+    После коммита ставит раскладку рецептов авторов, опустившихся
+    ниже FEED_FANOUT_LIMIT, в очередь: для тысячи подписчиков это
+    десятки тысяч строк, и запрос на отписку их не ждёт.
+    '''
+    author_ids = set(author_ids)
+    if not author_ids:
+        return
+    if settings.FEED_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(process_backfill, author_ids)
+        )
+    else:
+        transaction.on_commit(lambda: backfill_unpopular(author_ids))
+
+
+def clear_timeline(user_id, author_id):
+    '''Убирает из ленты рецепты автора после отписки.'''
+    TimelineEntry.objects.filter(
+        user=user_id, recipe__author=author_id
+    ).delete()
+
+
+def clear_timelines(user_id, author_ids):
+    TimelineEntry.objects.filter(
+        user=user_id, recipe__author__in=author_ids
+    ).delete()
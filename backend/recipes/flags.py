@@ -0,0 +1,74 @@
+from array import array
+from bisect import bisect_left
+
+from django.db import router
+
+from .models import Cart, Favorite
+from foodgram.cache import get_region
+
+USER_FLAGS_CACHE_KEY = 'user_flags:{user_id}'
+
+
+def contains(ids, recipe_id):
+    position = bisect_left(ids, recipe_id)
+    return position < len(ids) and ids[position] == recipe_id
+
+
+class UserFlags:
+    '''
+    Id рецептов в избранном и в корзине пользователя: отсортированные
+    массивы 64-битных чисел, 8 байт на рецепт. Проверка рецепта —
+    двоичный поиск, без обращения к БД.
+    '''
+    __slots__ = ('favorites', 'cart')
+
+    def __init__(self, favorites, cart):
+        self.favorites = array('q', favorites)
+        self.cart = array('q', cart)
+
+    def __getstate__(self):
+        return self.favorites, self.cart
+
+    def __setstate__(self, state):
+        self.favorites, self.cart = state
+
+    def is_favorited(self, recipe_id):
+        return contains(self.favorites, recipe_id)
+
+    def is_in_shopping_cart(self, recipe_id):
+        return contains(self.cart, recipe_id)
+
+
+def get_cache_key(user_id):
+    return USER_FLAGS_CACHE_KEY.format(user_id=user_id)
+
+
+def load_user_flags(user_id):
+    '''
+    Флаги читаются с основной базы: собранные с отстающей реплики
+    остались бы в кэше без только что сделанных изменений.
+    '''
+    return UserFlags(*(
+        model.objects.db_manager(router.db_for_write(model)).filter(
+            author_id=user_id
+        ).order_by(
+            'recipe_id'
+        ).values_list('recipe_id', flat=True)
+        for model in (Favorite, Cart)
+    ))
+
+
+def get_user_flags(user_id):
+    '''Флаги пользователя из региона user_flags, при промахе — из БД.'''
+    return get_region('user_flags').get_or_set(
+        get_cache_key(user_id), lambda: load_user_flags(user_id)
+    )
+
+
+def invalidate_user_flags(user_id):
+    '''
+    Сбрасывает флаги после коммита изменения: их соберёт следующий
+    запрос. Правка закэшированного множества на месте теряла бы
+    одно из одновременных изменений одного пользователя.
+    '''
+    get_region('user_flags').delete(get_cache_key(user_id))
@@ -0,0 +1,148 @@
+import base64
+import binascii
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .constans import BASE64_CHUNK_SIZE, IMAGE_VARIANTS, IMAGE_WEBP_QUALITY
+from .models import Recipe
+from .versions import bump_version_on_commit
+
+logger = logging.getLogger(__name__)
+
+VARIANT_PATH = 'recipes/images/variants/{recipe_id}_{stem}_{size}.webp'
+
+_executor = None
+
+
+def spool_base64(data, offset, name, content_type):
+    '''
+    Декодирует base64 из строки data, начиная с offset, частями
+    по BASE64_CHUNK_SIZE символов, пропуская пробельные символы. Файл больше
+    FILE_UPLOAD_MAX_MEMORY_SIZE пишется во временный файл на диске,
+    так что полная декодированная копия в памяти не создаётся.
+    '''
+    size = (len(data) - offset) * 3 // 4
+    if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+        file = TemporaryUploadedFile(name, content_type, 0, None)
+    else:
+        file = InMemoryUploadedFile(
+            BytesIO(), None, name, content_type, 0, None
+        )
+    # Переводы строк и пробелы (base64 с переносами) отбрасываются;
+    # хвост чанка короче четырёх символов переходит в следующий.
+    remainder = ''
+    for start in range(offset, len(data), BASE64_CHUNK_SIZE):
+        chunk = remainder + ''.join(
+            data[start:start + BASE64_CHUNK_SIZE].split()
+        )
+        usable = len(chunk) - len(chunk) % 4
+        file.write(base64.b64decode(chunk[:usable], validate=True))
+        remainder = chunk[usable:]
+    if remainder:
+        raise binascii.Error('Incorrect padding')
+    file.size = file.tell()
+    file.seek(0)
+    return file
+
+
+def get_executor():
+    '''Пул потоков процесса, создаётся при первой загрузке.'''
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='recipe-images'
+        )
+    return _executor
+
+
+def render_variant(image, max_side):
+    '''Уменьшенная копия в WebP, пропорции сохраняются.'''
+    variant = image.copy()
+    variant.thumbnail((max_side, max_side), Image.LANCZOS)
+    buffer = BytesIO()
+    variant.save(buffer, 'WEBP', quality=IMAGE_WEBP_QUALITY)
+    return buffer.getvalue()
+
+
+def open_image(file):
+    '''
+    Открывает изображение для уменьшения: JPEG декодируется сразу
+    в нужном масштабе (draft), поворот берётся из EXIF.
+    '''
+    image = Image.open(file)
+    largest = max(IMAGE_VARIANTS.values())
+    image.draft('RGB', (largest, largest))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.has_transparency_data
+                              else 'RGB')
+    return image
+
+
+def build_variants(recipe_id):
+    '''
+    Строит WebP-копии изображения рецепта всех размеров IMAGE_VARIANTS
+    и записывает их пути, если изображение за это время не сменилось.
+    '''
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'image', 'image_variants'
+    ).first()
+    if recipe is None or not recipe.image:
+        return
+    stem = PurePosixPath(recipe.image.name).stem
+    variants = {}
+    with recipe.image.open('rb') as file:
+        image = open_image(file)
+        for size, max_side in IMAGE_VARIANTS.items():
+            path = VARIANT_PATH.format(
+                recipe_id=recipe_id, stem=stem, size=size
+            )
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            variants[size] = default_storage.save(
+                path, ContentFile(render_variant(image, max_side))
+            )
+    updated = Recipe.objects.filter(
+        pk=recipe_id, image=recipe.image.name
+    ).update(image_variants=variants)
+    if updated:
+        # update() не отправляет сигналов: закэшированные карточки
+        # со старыми копиями сбрасываются явно.
+        bump_version_on_commit(Recipe)
+        stale = set(recipe.image_variants.values()) - set(variants.values())
+    else:
+        stale = set(variants.values())
+    for path in stale:
+        default_storage.delete(path)
+
+
+def process_variants(recipe_id):
+    '''Задача пула: ошибки пишутся в лог, соединение с БД закрывается.'''
+    try:
+        build_variants(recipe_id)
+    except Exception:
+        logger.exception('Не удалось обработать изображение рецепта %s',
+                         recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(recipe):
+    '''После коммита ставит построение копий изображения в очередь.'''
+    if settings.IMAGE_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(process_variants, recipe.pk)
+        )
+    else:
+        transaction.on_commit(lambda: build_variants(recipe.pk))
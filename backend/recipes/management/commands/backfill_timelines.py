@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from recipes.constans import FEED_BACKFILL_SIZE, FEED_FANOUT_LIMIT
+from recipes.feeds import backfill_timeline
+from recipes.models import Follow, TimelineEntry
+
+
+class Command(BaseCommand):
+    '''Заполнение лент подписчиков по существующим подпискам.'''
+    help = 'Fills follower timelines with latest recipes of followed authors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=FEED_BACKFILL_SIZE,
+                            help='Recipes per followed author')
+
+    def handle(self, *args, **options):
+        follows = Follow.objects.filter(
+            following__followers_count__lt=FEED_FANOUT_LIMIT
+        ).values_list('user_id', 'following_id')
+        with transaction.atomic():
+            TimelineEntry.objects.all().delete()
+            for user_id, author_id in follows.iterator():
+                backfill_timeline(user_id, author_id, options['size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Timelines hold {TimelineEntry.objects.count()} entries'
+        ))
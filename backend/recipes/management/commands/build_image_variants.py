@@ -0,0 +1,29 @@
+from django.core.management import BaseCommand
+
+from recipes.images import build_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    '''Построение WebP-копий изображений уже загруженных рецептов.'''
+    help = 'Builds resized WebP variants for recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Rebuild variants that already exist')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        done = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            try:
+                build_variants(recipe_id)
+            except Exception as error:
+                self.stderr.write(f'Recipe {recipe_id}: {error}')
+            else:
+                done += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Built image variants for {done} recipes'
+        ))
@@ -1,29 +1,118 @@
-from csv import DictReader
+import csv
+import json
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
 
-from django.core.management import BaseCommand
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
 
-# Import the model
 from recipes.models import Ingredient
+from recipes.search import ingredient_index
 
-ALREDY_LOADED_ERROR_MESSAGE = """
-If you need to reload the child data from the CSV file,
-first delete the db.sqlite3 file to destroy the database.
-Then, run `python manage.py migrate` for a new empty
-database with tables"""
+DEFAULT_PATHS = (
+    settings.BASE_DIR.parent / 'data' / 'ingredients.csv',
+    settings.BASE_DIR / 'ingredients.csv',
+)
+CSV_HEADER = ['name', 'measurement_unit']
+JSON_READ_SIZE = 64 * 1024
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8', newline='') as file:
+        for row in csv.reader(file):
+            if row and row != CSV_HEADER:
+                yield row[0], row[1]
+
+
+def read_json(path):
+    '''Потоково читает JSON-массив объектов, не загружая файл целиком.'''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    with open(path, encoding='utf-8') as file:
+        while True:
+            chunk = file.read(JSON_READ_SIZE)
+            buffer += chunk
+            if not started:
+                buffer = buffer.lstrip()
+                if buffer:
+                    if not buffer.startswith('['):
+                        raise CommandError('Ожидался JSON-массив.')
+                    buffer = buffer[1:]
+                    started = True
+            while started:
+                buffer = buffer.lstrip(' \t\r\n,')
+                if buffer.startswith(']'):
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    break
+                yield item['name'], item['measurement_unit']
+                buffer = buffer[end:]
+            if not chunk:
+                raise CommandError('Файл JSON оборван.')
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
 
 
 class Command(BaseCommand):
-    """Кастомная команда для загрузки данных из CSV-файлов в БД"""
-    help = "Loads data from category.csv"
+    '''
+    Кастомная команда для загрузки ингредиентов из CSV или JSON в БД.
+    Повторный запуск безопасен: существующие пары
+    (название, единица измерения) пропускаются.
+    '''
+    help = 'Loads ingredients from data/ingredients.csv or .json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', type=Path,
+                            help='CSV or JSON file with ingredients')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def get_path(self, path):
+        if path is not None:
+            if not path.exists():
+                raise CommandError(f'Файл {path} не найден.')
+            return path
+        for path in DEFAULT_PATHS:
+            if path.exists():
+                return path
+        raise CommandError('Файл с ингредиентами не найден.')
 
     def handle(self, *args, **options):
-        if Ingredient.objects.exists():
-            print('category data already loaded...exiting.')
-            print(ALREDY_LOADED_ERROR_MESSAGE)
-            return
-        print("Loading category data")
-        for row in DictReader(open('./ingredients.csv', encoding='utf-8')):
-            ingredient = Ingredient(
-                name=row['name'],
-                measurement_unit=row['measurement_unit'])
-            ingredient.save()
+        path = self.get_path(options['path'])
+        reader = READERS.get(path.suffix)
+        if reader is None:
+            raise CommandError('Поддерживаются только .csv и .json.')
+        batch_size = options['batch_size']
+        self.stdout.write(f'Loading ingredients from {path}')
+        started = perf_counter()
+        rows = (
+            Ingredient(name=name.strip(),
+                       measurement_unit=measurement_unit.strip())
+            for name, measurement_unit in reader(path)
+        )
+        total = 0
+        with transaction.atomic():
+            count_before = Ingredient.objects.count()
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                Ingredient.objects.bulk_create(
+                    batch, batch_size=batch_size, ignore_conflicts=True
+                )
+                total += len(batch)
+            created = Ingredient.objects.count() - count_before
+        ingredient_index.invalidate()
+        elapsed = perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {total} rows, created {created} ingredients '
+            f'in {elapsed:.2f}s ({total / elapsed:.0f} rows/s)'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from recipes.counters import rebuild_recipe_counters, rebuild_user_counters
+
+
+class Command(BaseCommand):
+    '''Пересчёт денормализованных счётчиков рецептов и пользователей.'''
+    help = 'Rebuilds favorites/carts/recipes/followers counters from scratch'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            recipes = rebuild_recipe_counters()
+            users = rebuild_user_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt counters for {recipes} recipes and {users} users'
+        ))
@@ -0,0 +1,27 @@
+from time import perf_counter
+
+from django.core.management import BaseCommand
+
+from recipes.rankings import update_rankings
+
+
+class Command(BaseCommand):
+    '''
+    Пересчёт популярности рецептов и тэгов. Запускается периодически
+    (cron): часто — с --incremental, изредка — полностью.
+    '''
+    help = 'Rebuilds popular/trending recipe rankings and tag usage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only apply favorites/carts added since '
+                                 'the previous run')
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        result = update_rankings(options['incremental'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated {result["scores"]} scores, {result["trending"]} '
+            f'trending scores and {result["tags"]} tags '
+            f'in {perf_counter() - started:.2f}s'
+        ))
@@ -0,0 +1,60 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:25
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    '''
+    Оставляет у одинаковых ингредиентов (название и единица) запись
+    с наименьшим id. Рецепты переносятся на неё; если в рецепте были
+    оба дубликата, количества складываются в одну строку.
+    '''
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(kept_id=Min('pk'), count=Count('pk')).filter(count__gt=1)
+    for duplicate in duplicates:
+        kept_id = duplicate['kept_id']
+        extra_ids = list(Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(pk=kept_id).values_list('pk', flat=True))
+        kept = {
+            row.recipe_id: row
+            for row in IngredientRecipe.objects.filter(ingredient_id=kept_id)
+        }
+        for row in IngredientRecipe.objects.filter(
+            ingredient_id__in=extra_ids
+        ).order_by('pk'):
+            if row.recipe_id in kept:
+                kept[row.recipe_id].amount += row.amount
+                kept[row.recipe_id].save(update_fields=('amount',))
+                row.delete()
+            else:
+                row.ingredient_id = kept_id
+                row.save(update_fields=('ingredient',))
+                kept[row.recipe_id] = row
+        Ingredient.objects.filter(pk__in=extra_ids).delete()
+
+
+class Migration(migrations.Migration):
+    # Ограничение добавляется после коммита слияния: на PostgreSQL
+    # ALTER TABLE не выполняется при отложенных проверках внешних ключей.
+    atomic = False
+
+    dependencies = [
+        ('recipes', '0014_tagrecipe_unique_tag'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop,
+            atomic=True
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_unit'),
+        ),
+    ]
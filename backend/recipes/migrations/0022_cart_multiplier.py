@@ -0,0 +1,20 @@
+# Generated by Django 3.2.16 on 2026-10-18 19:06
+
+from decimal import Decimal
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0021_query_shape_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='multiplier',
+            field=models.DecimalField(decimal_places=2, default=1, help_text='Во сколько раз увеличить количества ингредиентов', max_digits=4, validators=[django.core.validators.MinValueValidator(Decimal('0.25')), django.core.validators.MaxValueValidator(Decimal('50'))], verbose_name='Множитель порций'),
+        ),
+    ]
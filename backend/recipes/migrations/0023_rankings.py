@@ -0,0 +1,98 @@
+# Generated by Django 3.2.16 on 2026-10-18 19:10
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Дата добавления существующих строк: их настоящая дата неизвестна,
+# а с датой миграции все они попали бы в популярность «сейчас».
+# Дата совпадает с RANKING_EPOCH и лежит далеко за окном популярности.
+ADDED_BEFORE_RANKINGS = datetime.datetime(
+    2020, 1, 1, tzinfo=datetime.timezone.utc
+)
+
+
+def create_rankings(apps, schema_editor):
+    '''Нулевые строки рейтингов: рецепты и тэги сразу видны в сортировках.'''
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Tag = apps.get_model('recipes', 'Tag')
+    RecipeRanking = apps.get_model('recipes', 'RecipeRanking')
+    TagUsage = apps.get_model('recipes', 'TagUsage')
+    RecipeRanking.objects.bulk_create(
+        (RecipeRanking(recipe_id=recipe_id)
+         for recipe_id in Recipe.objects.values_list('pk', flat=True)),
+        batch_size=1000
+    )
+    TagUsage.objects.bulk_create(
+        TagUsage(tag_id=tag_id)
+        for tag_id in Tag.objects.values_list('pk', flat=True)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0022_cart_multiplier'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeRanking',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('score', models.FloatField(default=0, verbose_name='Популярность')),
+                ('trending_score', models.FloatField(default=0, verbose_name='Популярность сейчас')),
+                ('computed_at', models.DateTimeField(editable=False, null=True, verbose_name='Добавления учтены по')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг рецепта',
+                'verbose_name_plural': 'Рейтинги рецептов',
+            },
+        ),
+        migrations.CreateModel(
+            name='TagUsage',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='usage', serialize=False, to='recipes.tag', verbose_name='Тэг')),
+                ('recipes_count', models.PositiveIntegerField(default=0, verbose_name='Рецептов')),
+                ('trending_score', models.FloatField(default=0, verbose_name='Популярность сейчас')),
+            ],
+            options={
+                'verbose_name': 'Использование тэга',
+                'verbose_name_plural': 'Использование тэгов',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='recipe',
+            name='recipe_popular_idx',
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='added_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=ADDED_BEFORE_RANKINGS, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='added_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=ADDED_BEFORE_RANKINGS, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='tagusage',
+            index=models.Index(fields=['-recipes_count', '-tag'], name='tagusage_recipes_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagusage',
+            index=models.Index(fields=['-trending_score', '-tag'], name='tagusage_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reciperanking',
+            index=models.Index(fields=['-score', '-recipe'], name='ranking_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reciperanking',
+            index=models.Index(fields=['-trending_score', '-recipe'], name='ranking_trending_idx'),
+        ),
+        migrations.RunPython(create_rankings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+class CounterFieldsMixin:
+    '''
+    Денормализованные счётчики counter_fields меняются только атомарными
+    UPDATE (recipes.signals, recipes.counters). Обычный save() их
+    не записывает: иначе сохранение экземпляра, прочитанного раньше
+    (смена пароля, правка рецепта, форма админки), вернуло бы в БД
+    устаревшие значения.
+    '''
+    counter_fields = ()
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is not None:
+            update_fields = [name for name in update_fields
+                             if name not in self.counter_fields]
+        elif not self._state.adding and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, update_fields=update_fields, **kwargs)
@@ -1,10 +1,13 @@
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
-from django.core.validators import MinValueValidator
+from django.contrib.postgres.search import SearchVectorField
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 
-from .constans import (HEX_LENGTH, INGREDIENT_NAME_LEN, MAX_LENGTH,
-                       MEASURE_UNIT_LEN, MIN_NUM)
+from .constans import (CART_MULTIPLIER_MAX, CART_MULTIPLIER_MIN, HEX_LENGTH,
+                       INGREDIENT_NAME_LEN, MAX_LENGTH, MEASURE_UNIT_LEN,
+                       MIN_NUM)
+from .mixins import CounterFieldsMixin
 from .validators import validate_color
 
 User = get_user_model()
@@ -54,12 +57,23 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ('name',)
+        constraints = (
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient_unit'
+            ),
+        )
+        indexes = (
+            # LIKE 'префикс%' использует индекс при любой collation.
+            models.Index(fields=('name',), name='ingredient_name_like_idx',
+                         opclasses=('varchar_pattern_ops',)),
+        )
 
     def __str__(self):
         return self.name
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
     name = models.CharField(
         max_length=MAX_LENGTH,
         verbose_name='Название рецепта'
@@ -74,6 +88,12 @@ class Recipe(models.Model):
         upload_to='recipes/images/',
         verbose_name='Изображение'
     )
+    image_variants = models.JSONField(
+        'Уменьшенные копии изображения',
+        default=dict,
+        blank=True,
+        editable=False
+    )
     text = models.TextField(
         verbose_name='Описание'
     )
@@ -94,15 +114,40 @@ class Recipe(models.Model):
         verbose_name='Тэги',
         through='TagRecipe')
     pub_date = models.DateTimeField('Дата публикации', auto_now_add=True)
+    favorites_count = models.PositiveIntegerField(
+        'Количество добавлений в избранное', default=0, editable=False)
+    carts_count = models.PositiveIntegerField(
+        'Количество добавлений в список покупок', default=0, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    counter_fields = ('favorites_count', 'carts_count')
+    # Поля рецепта, из которых вместе с ингредиентами строится search_vector.
+    search_fields = ('name', 'text')
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=('author', '-pub_date', '-id'),
+                         name='recipe_author_pub_date_idx'),
+        )
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        recipe = super().from_db(db, field_names, values)
+        recipe.saved_search_text = recipe.get_search_text()
+        return recipe
+
+    def get_search_text(self):
+        '''Значения search_fields; отложенные поля — None.'''
+        return tuple(self.__dict__.get(name) for name in self.search_fields)
+
 
 class TagRecipe(models.Model):
     tag = models.ForeignKey(
@@ -154,6 +199,11 @@ class IngredientRecipe(models.Model):
                 name='unique_ingredient'
             ),
         )
+        indexes = (
+            # Список покупок читается только из индекса.
+            models.Index(fields=('recipe', 'ingredient', 'amount'),
+                         name='ingredientrecipe_cover_idx'),
+        )
         verbose_name = 'Ингредиенты для рецепта'
         verbose_name_plural = 'Ингредиенты для рецептов'
 
@@ -200,6 +250,16 @@ class Cart(models.Model):
         Recipe,
         on_delete=models.CASCADE,
         verbose_name='Рецепт')
+    multiplier = models.DecimalField(
+        max_digits=4,
+        decimal_places=2,
+        default=1,
+        validators=[MinValueValidator(CART_MULTIPLIER_MIN),
+                    MaxValueValidator(CART_MULTIPLIER_MAX)],
+        verbose_name='Множитель порций',
+        help_text='Во сколько раз увеличить количества ингредиентов')
+    added_at = models.DateTimeField(
+        'Дата добавления', auto_now_add=True, db_index=True)
 
     class Meta:
         ordering = ('author',)
@@ -209,6 +269,10 @@ class Cart(models.Model):
             models.UniqueConstraint(
                 fields=['recipe', 'author'],
                 name='unique_recipe_in_cart')]
+        indexes = (
+            models.Index(fields=('author', 'recipe'),
+                         name='cart_author_recipe_idx'),
+        )
 
     def __str__(self):
         return f'{self.author} добавил в список покупок {self.recipe}.'
@@ -224,6 +288,8 @@ class Favorite(models.Model):
         Recipe,
         on_delete=models.CASCADE,
         verbose_name='Рецепт')
+    added_at = models.DateTimeField(
+        'Дата добавления', auto_now_add=True, db_index=True)
 
     class Meta:
         ordering = ('author',)
@@ -234,6 +300,105 @@ class Favorite(models.Model):
             models.UniqueConstraint(
                 fields=['recipe', 'author'],
                 name='unique_favorite')]
+        indexes = (
+            models.Index(fields=('author', 'recipe'),
+                         name='favorite_author_recipe_idx'),
+        )
 
     def __str__(self):
         return f'{self.author} добавил {self.recipe} в избранное.'
+
+
+class TimelineEntry(models.Model):
+    '''Рецепт в ленте подписчика, записывается при публикации.'''
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель')
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Рецепт')
+    pub_date = models.DateTimeField('Дата публикации рецепта')
+
+    class Meta:
+        ordering = ('-pub_date', '-recipe')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_timeline_entry'
+            ),
+        )
+        indexes = (
+            models.Index(fields=('user', '-pub_date', '-recipe'),
+                         name='timeline_user_pub_date_idx'),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}.'
+
+
+class RecipeRanking(models.Model):
+    '''
+    Популярность рецепта, пересчитывается командой update_rankings.
+    score — избранное и корзины сейчас с весами, trending_score —
+    log2 суммы весов добавлений, каждое из которых вдвое старше
+    предыдущего через RANKING_HALF_LIFE: сравнение таких значений
+    равносильно сравнению популярности с затуханием в любой момент,
+    а старые значения не нужно пересчитывать. 0 — добавлений не было.
+    '''
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='ranking',
+        verbose_name='Рецепт')
+    score = models.FloatField('Популярность', default=0)
+    trending_score = models.FloatField('Популярность сейчас', default=0)
+    computed_at = models.DateTimeField(
+        'Добавления учтены по', null=True, editable=False)
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = (
+            models.Index(fields=('-score', '-recipe'),
+                         name='ranking_score_idx'),
+            models.Index(fields=('-trending_score', '-recipe'),
+                         name='ranking_trending_idx'),
+        )
+
+    def __str__(self):
+        return f'{self.recipe}: {self.score:g} / {self.trending_score:g}.'
+
+
+class TagUsage(models.Model):
+    '''
+    Сколько рецептов с тэгом и суммарная популярность недавних
+    рецептов с ним (в тех же единицах, что RecipeRanking.trending_score).
+    '''
+    tag = models.OneToOneField(
+        Tag,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='usage',
+        verbose_name='Тэг')
+    recipes_count = models.PositiveIntegerField('Рецептов', default=0)
+    trending_score = models.FloatField('Популярность сейчас', default=0)
+
+    class Meta:
+        verbose_name = 'Использование тэга'
+        verbose_name_plural = 'Использование тэгов'
+        indexes = (
+            models.Index(fields=('-recipes_count', '-tag'),
+                         name='tagusage_recipes_count_idx'),
+            models.Index(fields=('-trending_score', '-tag'),
+                         name='tagusage_trending_idx'),
+        )
+
+    def __str__(self):
+        return f'{self.tag}: {self.recipes_count}.'
@@ -0,0 +1,149 @@
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.utils import timezone
+
+from .constans import (RANKING_BATCH_SIZE, RANKING_CART_WEIGHT, RANKING_EPOCH,
+                       RANKING_FAVORITE_WEIGHT, RANKING_HALF_LIFE,
+                       RANKING_TAG_WINDOW_HALF_LIVES)
+from .models import (Cart, Favorite, Recipe, RecipeRanking, Tag, TagRecipe,
+                     TagUsage)
+from .versions import bump_version
+
+# Модель добавления -> log2 его веса в популярности «сейчас».
+EVENT_WEIGHTS = {
+    Favorite: math.log2(RANKING_FAVORITE_WEIGHT),
+    Cart: math.log2(RANKING_CART_WEIGHT),
+}
+
+
+def half_lives(moment):
+    '''Сколько периодов полураспада прошло от RANKING_EPOCH.'''
+    return (moment - RANKING_EPOCH) / RANKING_HALF_LIFE
+
+
+def log_add(*values):
+    '''log2(2 ** a + 2 ** b + ...) без переполнения; 0 — пустое слагаемое.'''
+    values = [value for value in values if value]
+    if not values:
+        return 0
+    top = max(values)
+    return top + math.log2(sum(2 ** (value - top) for value in values))
+
+
+def create_missing_rankings():
+    '''Строки для рецептов и тэгов, добавленных в обход сигналов.'''
+    RecipeRanking.objects.bulk_create(
+        (RecipeRanking(recipe_id=recipe_id)
+         for recipe_id in Recipe.objects.filter(
+             ranking__isnull=True
+         ).values_list('pk', flat=True)),
+        batch_size=RANKING_BATCH_SIZE, ignore_conflicts=True
+    )
+    TagUsage.objects.bulk_create(
+        (TagUsage(tag_id=tag_id)
+         for tag_id in Tag.objects.filter(
+             usage__isnull=True
+         ).values_list('pk', flat=True)),
+        ignore_conflicts=True
+    )
+
+
+def update_scores():
+    '''
+    Популярность за всё время из счётчиков рецептов. Перезаписываются
+    только изменившиеся строки, иначе каждый запуск переписывал бы
+    всю таблицу.
+    '''
+    score = Subquery(Recipe.objects.filter(pk=OuterRef('pk')).annotate(
+        score=F('favorites_count') * RANKING_FAVORITE_WEIGHT
+        + F('carts_count') * RANKING_CART_WEIGHT
+    ).values('score'))
+    return RecipeRanking.objects.exclude(score=score).update(score=score)
+
+
+def collect_events(since, until):
+    '''
+    Популярность «сейчас» от добавлений в (since, until] по рецептам.
+    Удаления не учитываются: рецепт был популярен, когда его добавляли.
+    '''
+    scores = defaultdict(int)
+    for model, weight in EVENT_WEIGHTS.items():
+        events = model.objects.filter(added_at__lte=until)
+        if since is not None:
+            events = events.filter(added_at__gt=since)
+        for recipe_id, added_at in events.values_list(
+            'recipe_id', 'added_at'
+        ).order_by().iterator():
+            scores[recipe_id] = log_add(
+                scores[recipe_id], half_lives(added_at) + weight
+            )
+    return scores
+
+
+def update_trending(scores, now, incremental):
+    '''Прибавляет события к сохранённым значениям или заменяет их.'''
+    if not incremental:
+        RecipeRanking.objects.exclude(
+            trending_score=0, computed_at=None
+        ).update(trending_score=0, computed_at=None)
+    rankings = list(RecipeRanking.objects.filter(pk__in=list(scores)))
+    for ranking in rankings:
+        ranking.trending_score = log_add(
+            ranking.trending_score, scores[ranking.pk]
+        )
+        ranking.computed_at = now
+    RecipeRanking.objects.bulk_update(
+        rankings, ('trending_score', 'computed_at'),
+        batch_size=RANKING_BATCH_SIZE
+    )
+    return len(rankings)
+
+
+def update_tag_usage(now):
+    '''
+    Число рецептов у тэгов и сумма популярности их рецептов «сейчас».
+    Давно не добавлявшиеся рецепты отсекаются индексом по trending_score.
+    '''
+    counts = dict(TagRecipe.objects.values_list('tag_id').annotate(
+        count=Count('pk')
+    ).order_by())
+    threshold = half_lives(now) - RANKING_TAG_WINDOW_HALF_LIVES
+    scores = defaultdict(int)
+    for tag_id, score in TagRecipe.objects.filter(
+        recipe__ranking__trending_score__gt=threshold
+    ).values_list('tag_id', 'recipe__ranking__trending_score').order_by():
+        scores[tag_id] = log_add(scores[tag_id], score)
+    usages = list(TagUsage.objects.all())
+    for usage in usages:
+        usage.recipes_count = counts.get(usage.pk, 0)
+        usage.trending_score = scores[usage.pk]
+    TagUsage.objects.bulk_update(usages, ('recipes_count', 'trending_score'))
+    return len(usages)
+
+
+@transaction.atomic
+def update_rankings(incremental=False):
+    '''
+    Пересчёт рейтингов рецептов и тэгов. Полный пересчёт проходит по
+    всем добавлениям в избранное и корзину; инкрементальный — только
+    по добавленным после прошлого запуска, а без прошлого запуска
+    выполняется полный. Возвращает число обновлённых строк.
+    '''
+    now = timezone.now()
+    create_missing_rankings()
+    since = RecipeRanking.objects.aggregate(
+        since=Max('computed_at')
+    )['since'] if incremental else None
+    incremental = since is not None
+    result = {
+        'scores': update_scores(),
+        'trending': update_trending(
+            collect_events(since, now), now, incremental
+        ),
+        'tags': update_tag_usage(now),
+    }
+    transaction.on_commit(lambda: bump_version(RecipeRanking, TagUsage))
+    return result
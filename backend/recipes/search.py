@@ -0,0 +1,204 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import connection
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .constans import INGREDIENT_SEARCH_LIMIT, RECIPE_SEARCH_LIMIT
+from .models import Ingredient, IngredientRecipe, Recipe
+from .versions import bump_version, get_versions
+
+SEARCH_CONFIG = 'russian'
+# Веса полей для ранжирования: название, ингредиенты, описание.
+SEARCH_WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2, 'D': 0.1}
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'иях', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ом', 'ем',
+    'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ью', 'ия', 'ию', 'ие',
+    'ы', 'и', 'а', 'я', 'о', 'е', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+
+class IngredientIndex:
+    '''
+    Отсортированный индекс названий ингредиентов в памяти процесса
+    и отсортированный список их суффиксов для поиска по подстроке.
+    Строится при первом запросе и перестраивается, когда меняется
+    версия модели Ingredient.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._keys = []
+        self._ingredients = []
+        self._suffixes = []
+
+    def _ensure_fresh(self):
+        version, = get_versions(Ingredient)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            ingredients = sorted(
+                Ingredient.objects.all(),
+                key=lambda ingredient: ingredient.name.casefold()
+            )
+            self._keys = [
+                ingredient.name.casefold() for ingredient in ingredients
+            ]
+            # Суффиксы без первого символа: совпадения с начала
+            # названия находит бинарный поиск по _keys.
+            self._suffixes = sorted(
+                (key[start:], position)
+                for position, key in enumerate(self._keys)
+                for start in range(1, len(key))
+            )
+            self._ingredients = ingredients
+            self._version = version
+
+    def invalidate(self):
+        '''Помечает индекс устаревшим во всех процессах.'''
+        bump_version(Ingredient)
+
+    def search(self, query, limit=INGREDIENT_SEARCH_LIMIT):
+        '''
+        Поиск без учёта регистра: сначала ингредиенты, название которых
+        начинается с запроса, затем те, где запрос встречается внутри.
+        Оба поиска — бинарные, по названиям и по их суффиксам.
+        '''
+        self._ensure_fresh()
+        keys, ingredients = self._keys, self._ingredients
+        prefix = query.casefold()
+        start = position = bisect_left(keys, prefix)
+        while (position < len(keys) and position - start < limit
+               and keys[position].startswith(prefix)):
+            position += 1
+        results = ingredients[start:position]
+        if len(results) < limit:
+            suffixes = self._suffixes
+            found = set()
+            index = bisect_left(suffixes, (prefix,))
+            while (index < len(suffixes)
+                   and suffixes[index][0].startswith(prefix)):
+                found.add(suffixes[index][1])
+                index += 1
+            # Названия, начинающиеся с запроса, уже в results.
+            results += [
+                ingredients[found_position]
+                for found_position in sorted(found)
+                if not keys[found_position].startswith(prefix)
+            ][:limit - len(results)]
+        return results
+
+
+ingredient_index = IngredientIndex()
+
+
+def ingredient_names():
+    '''Подзапрос с названиями ингредиентов рецепта через пробел.'''
+    return Coalesce(Subquery(
+        IngredientRecipe.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    ), Value(''))
+
+
+def update_search_vectors(recipes):
+    '''
+    Пересчитывает tsvector рецептов на PostgreSQL.
+    На других СУБД поиск обслуживает RecipeSearchIndex.
+    '''
+    if connection.vendor != 'postgresql':
+        return
+    Recipe.objects.filter(pk__in=recipes).update(search_vector=(
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(ingredient_names(), weight='B', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+    ))
+
+
+def stem(word):
+    '''Упрощённый стеммер: отрезает типичные русские окончания.'''
+    for ending in RUSSIAN_ENDINGS:
+        if (word.endswith(ending)
+                and len(word) - len(ending) >= MIN_STEM_LENGTH):
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    return [stem(word) for word in re.findall(r'\w+', text.casefold())]
+
+
+class RecipeSearchIndex:
+    '''
+    Инвертированный индекс рецептов в памяти процесса — запасной
+    вариант полнотекстового поиска для SQLite.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._postings = {}
+
+    def _ensure_fresh(self):
+        version = get_versions(Recipe, Ingredient)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            postings = defaultdict(lambda: defaultdict(float))
+            ingredients = defaultdict(list)
+            for recipe_id, name in IngredientRecipe.objects.values_list(
+                    'recipe_id', 'ingredient__name'):
+                ingredients[recipe_id].append(name)
+            for recipe_id, name, text in Recipe.objects.values_list(
+                    'id', 'name', 'text'):
+                for weight, value in (
+                        ('A', name),
+                        ('B', ' '.join(ingredients[recipe_id])),
+                        ('C', text)):
+                    for token in tokenize(value):
+                        postings[token][recipe_id] += SEARCH_WEIGHTS[weight]
+            self._postings = postings
+            self._version = version
+
+    def search(self, query, limit=RECIPE_SEARCH_LIMIT):
+        '''
+        Id не более limit лучших рецептов, содержащих все слова запроса,
+        по убыванию ранга.
+        '''
+        self._ensure_fresh()
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        scores = None
+        for token in tokens:
+            posting = self._postings.get(token, {})
+            if scores is None:
+                scores = dict(posting)
+            else:
+                scores = {
+                    recipe_id: score + posting[recipe_id]
+                    for recipe_id, score in scores.items()
+                    if recipe_id in posting
+                }
+        return heapq.nsmallest(
+            limit, scores, key=lambda recipe_id: (-scores[recipe_id],
+                                                  -recipe_id)
+        )
+
+
+recipe_search_index = RecipeSearchIndex()
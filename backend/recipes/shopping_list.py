@@ -0,0 +1,268 @@
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import chain
+
+from django.db import router, transaction
+from django.db.models import F, FloatField, Sum
+
+from .constans import (SHOPPING_LIST_CACHE_TIMEOUT, UNIT_CONVERSIONS,
+                       UNIT_UPSCALE)
+from .models import Cart, IngredientRecipe
+from foodgram.cache import get_region
+
+SHOPPING_LIST_CACHE_KEY = 'shopping_list:{user_id}'
+SHOPPING_LIST_VERSION_KEY = 'shopping_list_version:{user_id}'
+# Остаток меньше этого после вычитания считается нулём.
+AMOUNT_EPSILON = 1e-9
+
+
+def get_cache_key(user_id):
+    return SHOPPING_LIST_CACHE_KEY.format(user_id=user_id)
+
+
+def get_version_key(user_id):
+    return SHOPPING_LIST_VERSION_KEY.format(user_id=user_id)
+
+
+def format_amount(amount):
+    '''Количество с точностью до сотых, целое — без дробной части.'''
+    amount = round(amount, 2)
+    return int(amount) if amount == int(amount) else amount
+
+
+def merge_units(amounts):
+    '''
+    Складывает количества одного продукта в разных единицах.
+    Одна единица остаётся как есть; разные единицы одной величины
+    (г и кг, ложки и мл) переводятся в базовую, а от тысячи — в крупную.
+    '''
+    if len(amounts) == 1:
+        (unit, amount), = amounts.items()
+        return unit, amount
+    base_unit = UNIT_CONVERSIONS[next(iter(amounts))][0]
+    total = sum(amount * UNIT_CONVERSIONS[unit][1]
+                for unit, amount in amounts.items())
+    unit, factor = UNIT_UPSCALE.get(base_unit, (base_unit, 1))
+    if total >= factor:
+        return unit, total / factor
+    return base_unit, total
+
+
+class ShoppingAggregate:
+    '''
+    Суммы ингредиентов списка покупок: отсортированный массив id
+    ингредиентов и параллельный массив количеств, а также множители
+    рецептов корзины, по которым они посчитаны. Изменение рецепта
+    в корзине меняет суммы на месте.
+    '''
+    __slots__ = ('ids', 'amounts', 'ingredients', 'recipes')
+
+    def __init__(self):
+        self.ids = array('q')
+        self.amounts = array('d')
+        self.ingredients = {}
+        self.recipes = {}
+
+    def __getstate__(self):
+        return self.ids, self.amounts, self.ingredients, self.recipes
+
+    def __setstate__(self, state):
+        self.ids, self.amounts, self.ingredients, self.recipes = state
+
+    def add(self, rows, multiplier=1):
+        '''
+        Прибавляет строки (id, название, единица, количество).
+        Суммы известных id меняются на месте, а новые id не вставляются
+        по одному в середину массивов: массивы собираются заново
+        и сортируются один раз.
+        '''
+        added = defaultdict(float)
+        for ingredient_id, name, unit, amount in rows:
+            amount = float(amount) * multiplier
+            position = bisect_left(self.ids, ingredient_id)
+            if (position < len(self.ids)
+                    and self.ids[position] == ingredient_id):
+                self.amounts[position] += amount
+            else:
+                added[ingredient_id] += amount
+                self.ingredients[ingredient_id] = (name, unit)
+        if added:
+            self.assign(sorted(chain(zip(self.ids, self.amounts),
+                                     added.items())))
+        self.drop_empty()
+
+    def assign(self, pairs):
+        '''Заменяет массивы парами (id, количество) по возрастанию id.'''
+        self.ids = array('q', (ingredient_id for ingredient_id, _ in pairs))
+        self.amounts = array('d', (amount for _, amount in pairs))
+
+    def set_recipe(self, recipe_id, multiplier, rows):
+        '''
+        Приводит вклад рецепта к множителю multiplier (0 — рецепта
+        нет в корзине). Повторный вызов с тем же множителем ничего
+        не меняет, поэтому изменение, уже попавшее в суммы, не
+        учитывается дважды.
+        '''
+        delta = multiplier - self.recipes.pop(recipe_id, 0)
+        if multiplier:
+            self.recipes[recipe_id] = multiplier
+        if delta:
+            self.add(rows, delta)
+
+    def drop_empty(self):
+        if all(amount >= AMOUNT_EPSILON for amount in self.amounts):
+            return
+        kept = []
+        for ingredient_id, amount in zip(self.ids, self.amounts):
+            if amount < AMOUNT_EPSILON:
+                del self.ingredients[ingredient_id]
+            else:
+                kept.append((ingredient_id, amount))
+        self.assign(kept)
+
+    def rows(self):
+        '''Строки списка (название, единица, количество) по алфавиту.'''
+        groups = defaultdict(dict)
+        for ingredient_id, amount in zip(self.ids, self.amounts):
+            name, unit = self.ingredients[ingredient_id]
+            base_unit = UNIT_CONVERSIONS.get(unit, (unit,))[0]
+            groups[name, base_unit][unit] = amount
+        rows = []
+        for (name, _), amounts in groups.items():
+            unit, amount = merge_units(amounts)
+            rows.append((name, unit, format_amount(amount)))
+        return sorted(rows)
+
+
+def recipe_rows(recipe_ids):
+    '''Строки ингредиентов рецептов: {id рецепта: [строки]}.'''
+    rows = defaultdict(list)
+    for recipe_id, *row in IngredientRecipe.objects.db_manager(
+        router.db_for_write(IngredientRecipe)
+    ).filter(recipe__in=list(recipe_ids)).values_list(
+        'recipe_id', 'ingredient_id', 'ingredient__name',
+        'ingredient__measurement_unit', 'amount'
+    ):
+        rows[recipe_id].append(row)
+    return rows
+
+
+def build_aggregate(user_id):
+    '''
+    Полный пересчёт по корзине с учётом множителей: суммы по
+    ингредиентам считает БД одним GROUP BY. Читается основная база:
+    список с отстающей реплики остался бы в кэше на сутки.
+    '''
+    database = router.db_for_write(Cart)
+    aggregate = ShoppingAggregate()
+    aggregate.recipes = {
+        recipe_id: float(multiplier)
+        for recipe_id, multiplier in Cart.objects.using(database).filter(
+            author_id=user_id
+        ).values_list('recipe_id', 'multiplier')
+    }
+    aggregate.add(IngredientRecipe.objects.using(database).filter(
+        recipe__cart__author_id=user_id
+    ).values_list(
+        'ingredient_id', 'ingredient__name', 'ingredient__measurement_unit'
+    ).annotate(total=Sum(F('amount') * F('recipe__cart__multiplier'),
+                         output_field=FloatField())).order_by())
+    return aggregate
+
+
+def get_version(cache, user_id):
+    '''
+    Версия корзины пользователя. Отсутствующая заводится от текущего
+    времени, чтобы не совпасть с версией ранее сохранённого списка.
+    '''
+    key = get_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(cache, user_id):
+    '''Следующая версия корзины или None, если версии не было.'''
+    try:
+        return cache.incr(get_version_key(user_id))
+    except ValueError:
+        return None
+
+
+def iter_shopping_list(user):
+    '''
+    Отдаёт строки списка покупок (название, единица, количество).
+    Суммы хранятся в кэше вместе с версией корзины, по которой они
+    посчитаны; список другой версии пересчитывается заново.
+    '''
+    cache = get_region()
+    key = get_cache_key(user.id)
+    # Версия читается до запроса к БД: если корзина изменится
+    # во время пересчёта, версия сменится и результат не будет принят.
+    version = get_version(cache.cache, user.id)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        aggregate = cached[1]
+    else:
+        aggregate = build_aggregate(user.id)
+        cache.set(key, (version, aggregate), SHOPPING_LIST_CACHE_TIMEOUT)
+    yield from aggregate.rows()
+
+
+def update_shopping_list(user_id, recipe_ids):
+    '''
+    Обновляет список после коммита изменения рецептов recipe_ids
+    в корзине. Версия корзины увеличивается атомарно всегда, так что
+    любой список, посчитанный раньше, устаревает. Если в кэше список
+    предыдущей версии и одновременно никто больше версию не менял,
+    вклад рецептов приводится к текущему состоянию корзины и список
+    сохраняется под новой версией; иначе его соберёт следующий запрос.
+    '''
+    cache = get_region().cache
+    key = get_cache_key(user_id)
+    version = get_version(cache, user_id)
+    cached = cache.get(key)
+    if bump_version(cache, user_id) != version + 1 or (
+        cached is None or cached[0] != version
+    ):
+        return
+    aggregate = cached[1]
+    multipliers = dict(Cart.objects.db_manager(
+        router.db_for_write(Cart)
+    ).filter(
+        author_id=user_id, recipe__in=list(recipe_ids)
+    ).values_list('recipe_id', 'multiplier'))
+    rows = recipe_rows(recipe_ids)
+    if any(recipe_id in aggregate.recipes and recipe_id not in rows
+           for recipe_id in recipe_ids):
+        # Рецепт удалён вместе с ингредиентами: вычесть его вклад нечем.
+        return
+    for recipe_id in recipe_ids:
+        aggregate.set_recipe(recipe_id,
+                             float(multipliers.get(recipe_id, 0)),
+                             rows[recipe_id])
+    cache.set(key, (version + 1, aggregate), SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+def bump_versions(user_ids):
+    '''Делает устаревшими списки покупок пользователей.'''
+    cache = get_region().cache
+    for user_id in set(user_ids):
+        bump_version(cache, user_id)
+
+
+def invalidate_for_recipes(recipe_ids):
+    '''
+    После коммита сбрасывает списки у всех, у кого рецепты в корзине.
+    Корзины читаются из основной базы уже после коммита, чтобы не
+    пропустить добавивших рецепт одновременно с изменением.
+    '''
+    transaction.on_commit(lambda: bump_versions(
+        Cart.objects.db_manager(router.db_for_write(Cart)).filter(
+            recipe__in=recipe_ids
+        ).values_list('author_id', flat=True)
+    ))
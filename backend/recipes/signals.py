@@ -0,0 +1,284 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import Signal, receiver
+
+from .constans import FEED_FANOUT_LIMIT
+from .counters import count_related
+from .feeds import (backfill_timeline, backfill_timelines, clear_timeline,
+                    clear_timelines, fan_out_recipe, popular_authors,
+                    schedule_backfill)
+from .flags import invalidate_user_flags
+from .models import (Cart, Favorite, Follow, Ingredient, Recipe, RecipeRanking,
+                     Tag, TagRecipe, TagUsage, User)
+from .search import ingredient_index, update_search_vectors
+from .shopping_list import invalidate_for_recipes, update_shopping_list
+from .versions import bump_version_on_commit
+
+# Отправляется после массовой записи ингредиентов рецептов
+# (bulk_create/bulk_update не вызывают post_save).
+recipe_ingredients_changed = Signal()
+
+# Отправляется после массового добавления или удаления избранного,
+# корзины или подписок (recipes.bulk) с аргументами user_id,
+# target_ids и added; обработчики отдельных строк при этом не работают.
+relations_bulk_changed = Signal()
+
+# Массовое удаление в bulk_deleted: (модель, поле цели, id целей).
+_bulk_delete = ContextVar('bulk_delete', default=None)
+
+
+@contextmanager
+def bulk_deleted(model, user_id, target_field):
+    '''
+    Удаление строк model внутри блока не запускает обработчики
+    отдельных строк: id целей удалённых строк собираются и после
+    блока один раз передаются в relations_bulk_changed.
+    Возвращает множество этих id.
+    '''
+    target_ids = set()
+    token = _bulk_delete.set((model, target_field, target_ids))
+    try:
+        yield target_ids
+    finally:
+        _bulk_delete.reset(token)
+    if target_ids:
+        relations_bulk_changed.send(sender=model, user_id=user_id,
+                                    target_ids=sorted(target_ids),
+                                    added=False)
+
+
+def row_handler(handler):
+    '''Обработчик сигнала строки, пропускаемый в bulk_deleted.'''
+    @wraps(handler)
+    def wrapper(sender, instance, **kwargs):
+        bulk_delete = _bulk_delete.get()
+        if bulk_delete is not None and bulk_delete[0] is sender:
+            return None
+        return handler(sender, instance=instance, **kwargs)
+    return wrapper
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=Cart)
+@receiver(post_delete, sender=Follow)
+def bulk_row_deleted(sender, instance, **kwargs):
+    bulk_delete = _bulk_delete.get()
+    if bulk_delete is not None and bulk_delete[0] is sender:
+        bulk_delete[2].add(getattr(instance, bulk_delete[1]))
+
+
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+@row_handler
+def cart_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: update_shopping_list(
+        instance.author_id, (instance.recipe_id,)
+    ))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=Cart)
+@row_handler
+def user_flags_changed(sender, instance, signal, created=False, **kwargs):
+    if signal is post_save and not created:
+        return
+    transaction.on_commit(
+        lambda: invalidate_user_flags(instance.author_id)
+    )
+
+
+@receiver(recipe_ingredients_changed)
+def invalidate_recipe_ingredients(sender, recipe_ids, **kwargs):
+    invalidate_for_recipes(recipe_ids)
+    update_search_vectors(recipe_ids)
+    bump_version_on_commit(Recipe)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_changed(sender, instance, created, **kwargs):
+    transaction.on_commit(ingredient_index.invalidate)
+    if not created:
+        recipes = instance.ingredientrecipe_set.values('recipe_id')
+        invalidate_for_recipes(recipes)
+        update_search_vectors(recipes)
+
+
+@receiver(pre_delete, sender=Ingredient)
+def ingredient_deleting(sender, instance, **kwargs):
+    instance.recipe_ids = list(
+        instance.ingredientrecipe_set.values_list('recipe_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, instance, **kwargs):
+    '''
+    Строки рецептов с ингредиентом удалены каскадом: у этих рецептов
+    пересчитываются списки покупок, векторы поиска и версия.
+    '''
+    transaction.on_commit(ingredient_index.invalidate)
+    recipe_ids = getattr(instance, 'recipe_ids', ())
+    if recipe_ids:
+        invalidate_for_recipes(recipe_ids)
+        update_search_vectors(recipe_ids)
+        bump_version_on_commit(Recipe)
+
+
+# Денормализованные счётчики: модель строки -> (модель, FK, счётчик).
+COUNTERS = {
+    Favorite: (Recipe, 'recipe_id', 'favorites_count'),
+    Cart: (Recipe, 'recipe_id', 'carts_count'),
+    Recipe: (User, 'author_id', 'recipes_count'),
+    Follow: (User, 'following_id', 'followers_count'),
+}
+
+
+def update_counter(sender, instance, delta):
+    '''
+    Сдвигает счётчик на delta. Разошедшийся с данными счётчик
+    не уходит ниже нуля: иначе удаление строки нарушило бы
+    ограничение PositiveIntegerField.
+    '''
+    model, field_name, counter = COUNTERS[sender]
+    model.objects.filter(pk=getattr(instance, field_name)).update(
+        **{counter: Greatest(F(counter) + delta, 0)}
+    )
+
+
+def recount_counter(sender, ids):
+    '''Пересчитывает счётчики по строкам: точно и одним запросом.'''
+    model, field_name, counter = COUNTERS[sender]
+    model.objects.filter(pk__in=ids).update(
+        **{counter: count_related(sender, field_name)}
+    )
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=Cart)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Follow)
+def counter_row_created(sender, instance, created, **kwargs):
+    if created:
+        update_counter(sender, instance, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=Cart)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Follow)
+@row_handler
+def counter_row_deleted(sender, instance, **kwargs):
+    update_counter(sender, instance, -1)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(sender, **kwargs):
+    bump_version_on_commit(Tag)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=TagRecipe)
+def recipe_changed(sender, **kwargs):
+    bump_version_on_commit(Recipe)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    '''
+    Вектор поиска пересчитывается для нового рецепта и при смене
+    названия или описания, а не при каждом сохранении.
+    '''
+    search_text = instance.get_search_text()
+    if created or search_text != getattr(instance, 'saved_search_text', None):
+        update_search_vectors((instance.pk,))
+    instance.saved_search_text = search_text
+
+
+@receiver(m2m_changed, sender=TagRecipe)
+def recipe_tags_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_version_on_commit(Recipe)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, update_fields=None, **kwargs):
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        bump_version_on_commit(User)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, **kwargs):
+    bump_version_on_commit(User)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: fan_out_recipe(instance))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+def ranking_created(sender, instance, created, **kwargs):
+    '''Нулевой рейтинг: новые рецепты и тэги сразу видны в сортировках.'''
+    if created and sender is Recipe:
+        RecipeRanking.objects.create(recipe=instance)
+    elif created:
+        TagUsage.objects.create(tag=instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created and instance.following.followers_count < FEED_FANOUT_LIMIT:
+        backfill_timeline(instance.user_id, instance.following_id)
+
+
+@receiver(pre_delete, sender=Follow)
+@row_handler
+def follow_deleting(sender, instance, **kwargs):
+    instance.was_popular = bool(popular_authors((instance.following_id,)))
+
+
+@receiver(post_delete, sender=Follow)
+@row_handler
+def follow_deleted(sender, instance, **kwargs):
+    '''
+    Если автор опустился ниже FEED_FANOUT_LIMIT, его рецепты
+    перестают дочитываться при чтении лент и раскладываются по ним.
+    '''
+    clear_timeline(instance.user_id, instance.following_id)
+    if getattr(instance, 'was_popular', False):
+        schedule_backfill((instance.following_id,))
+
+
+def follows_changed(user_id, target_ids, added):
+    if added:
+        recount_counter(Follow, target_ids)
+        backfill_timelines(
+            user_id, set(target_ids) - popular_authors(target_ids)
+        )
+        return
+    was_popular = popular_authors(target_ids)
+    recount_counter(Follow, target_ids)
+    clear_timelines(user_id, target_ids)
+    schedule_backfill(was_popular)
+
+
+@receiver(relations_bulk_changed)
+def relations_changed(sender, user_id, target_ids, added, **kwargs):
+    if sender is Follow:
+        follows_changed(user_id, target_ids, added)
+        return
+    recount_counter(sender, target_ids)
+    if sender is Cart:
+        transaction.on_commit(
+            lambda: update_shopping_list(user_id, target_ids)
+        )
+    transaction.on_commit(lambda: invalidate_user_flags(user_id))
@@ -0,0 +1,44 @@
+import time
+
+from django.db import transaction
+
+from foodgram.cache import get_region
+
+VERSION_KEY = 'model_version:{label}'
+
+
+def get_version_key(model):
+    return VERSION_KEY.format(label=model._meta.label_lower)
+
+
+def get_versions(*models):
+    '''
+    Текущие версии моделей одним запросом к кэшу.
+    Отсутствующая версия заводится заново от текущего времени,
+    чтобы после очистки кэша не совпасть ни с одной из прежних.
+    '''
+    cache = get_region()
+    keys = [get_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(*models):
+    '''Меняет версии моделей: все закэшированные по ним данные устаревают.'''
+    version = time.time_ns()
+    get_region().set_many(
+        {get_version_key(model): version for model in models}, None
+    )
+
+
+def bump_version_on_commit(*models):
+    '''
+    Меняет версии после коммита текущей транзакции. Иначе чтение между
+    сменой версии и коммитом увидит старые строки и сохранит их в кэше
+    под новой версией до следующего изменения.
+    '''
+    transaction.on_commit(lambda: bump_version(*models))
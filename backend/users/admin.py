@@ -7,7 +7,9 @@ from recipes.constans import EMPTY_VALUE
 @admin.register(User)
 class FollowAdmin(admin.ModelAdmin):
     list_display = ('id', 'username', 'first_name',
-                    'last_name', 'email', 'date_joined')
+                    'last_name', 'email', 'date_joined',
+                    'recipes_count', 'followers_count')
+    readonly_fields = ('recipes_count', 'followers_count')
     list_filter = ('username', 'email',)
     search_fields = ('email', 'username')
     empty_value_display = EMPTY_VALUE
@@ -2,9 +2,10 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 from recipes.constans import EMAIL_LENGTH, USER_MAX_LENGTH
+from recipes.mixins import CounterFieldsMixin
 
 
-class User(AbstractUser):
+class User(CounterFieldsMixin, AbstractUser):
     '''Класс переопределения базового user.'''
 
     password = models.CharField('Пароль', default=None,
@@ -12,6 +13,12 @@ class User(AbstractUser):
     first_name = models.CharField('Имя', max_length=USER_MAX_LENGTH)
     last_name = models.CharField('Фамилия', max_length=USER_MAX_LENGTH)
     email = models.EmailField('E-mail', max_length=EMAIL_LENGTH, unique=True)
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов', default=0, editable=False)
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков', default=0, editable=False)
+
+    counter_fields = ('recipes_count', 'followers_count')
 
     class Meta:
         ordering = ('-date_joined',)